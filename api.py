@@ -0,0 +1,52 @@
+########################################################
+
+# api.py
+
+# contains the library entry points for embedding the
+# calculator in other programs (e.g. long-running
+# workers): bill a meter file and render its bills
+# without prompts. Modules are imported on first call,
+# so importing this module is close to free
+
+########################################################
+
+
+# bills a meter file (csv or .ebc) and returns its priced billing cycles as {'mm-yyyy': BillingCycle}
+# tariff is a Tariff, a schedule name from tariffs/ or a path to a schedule file (default: b19)
+# with more than one worker (None for one per CPU), a large csv is parsed in parallel byte ranges (see sharded.py)
+def bill_file(path, tariff=None, use_cache=True, workers=1):
+    from billing import calculate_monthly_bills
+    from tariff import resolve_tariff
+
+    tariff = resolve_tariff(tariff)
+    if use_cache:
+        from cache import cached_read_in_data
+        billing_cycles = cached_read_in_data(path, tariff, workers=workers)
+    elif workers == 1:
+        from preprocess import read_in_data
+        billing_cycles = read_in_data(path, tariff)
+    else:
+        from sharded import read_in_data_sharded
+        billing_cycles = read_in_data_sharded(path, tariff, workers)
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+# returns the calculator's text of priced billing cycles: the monthly bill summaries,
+# followed by the detailed bill of each 'mm-yyyy' key in details
+def render_bills(billing_cycles, details=(), tariff=None):
+    from output import render_bill_details, render_monthly_bills
+
+    return render_monthly_bills(billing_cycles) + ''.join(render_bill_details(billing_cycles, key, tariff) for key in details)
+
+
+# bills a meter file and returns the text of its bills (see render_bills)
+def bill_text(path, details=(), tariff=None, use_cache=True, workers=1):
+    return render_bills(bill_file(path, tariff, use_cache, workers), details, tariff)
+
+
+# loads and compiles a tariff schedule by name or path, see tariff.load_tariff
+def load_tariff(name_or_path):
+    from tariff import load_tariff as load_schedule
+
+    return load_schedule(name_or_path)
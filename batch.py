@@ -0,0 +1,88 @@
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from billing import calculate_monthly_bills
+from cache import cached_read_in_data
+from preprocess import read_in_data
+from output import render_monthly_bills
+
+
+########################################################
+
+# batch.py
+
+# contains the non-interactive batch entry point that
+# bills many meter files in parallel worker processes
+
+########################################################
+
+
+# expands directories and glob patterns into a sorted list of csv (and columnar .ebc) files
+def find_meter_files(paths):
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.update(glob.glob(os.path.join(path, '*.csv')))
+            filenames.update(glob.glob(os.path.join(path, '*.ebc')))
+        else:
+            filenames.update(glob.glob(path))
+    return sorted(filenames)
+
+
+# reads in, bills and renders a single meter file (runs in a worker process)
+# returns (filename, rendered bills, error message)
+def bill_meter(filename, use_cache=True, tariff=None):
+    try:
+        # each file is parsed at most once, and not at all when it is unchanged since the last run
+        billing_cycles = cached_read_in_data(filename, tariff) if use_cache else read_in_data(filename, tariff)
+        calculate_monthly_bills(billing_cycles, tariff)
+
+        return filename, render_monthly_bills(billing_cycles), None
+
+    except Exception as e: # a bad file is reported instead of stopping the run
+        return filename, None, f"{type(e).__name__}: {e}"
+
+
+# bills every meter file in a process pool, writing all bills to one output
+# returns the number of files that could not be billed
+def run_batch(paths, workers=None, output=sys.stdout, errors=sys.stderr, use_cache=True, tariff=None):
+    filenames = find_meter_files(paths)
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # results come back in filename order while later files are still being billed
+        for filename, bills, error in executor.map(bill_meter, filenames, [use_cache] * len(filenames), [tariff] * len(filenames)):
+            if error:
+                failed += 1
+                print(f"Could not bill {filename}: {error}", file=errors)
+                continue
+            output.write(f"===== Meter: {filename} =====\n")
+            output.write(bills)
+
+    print(f"Billed {len(filenames) - failed} of {len(filenames)} meter file(s)", file=errors)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bill every meter CSV in a directory or glob pattern.")
+    parser.add_argument('paths', nargs='+', help="directories or glob patterns of meter CSV files (e.g. datasets/)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('-o', '--output', default=None, help="file to write the combined bills to (default: stdout)")
+    parser.add_argument('--no-cache', action='store_true', help="always parse the csv files instead of reusing cached results")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            failed = run_batch(args.paths, args.workers, output, use_cache=not args.no_cache, tariff=args.tariff)
+    else:
+        failed = run_batch(args.paths, args.workers, use_cache=not args.no_cache, tariff=args.tariff)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
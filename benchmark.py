@@ -0,0 +1,278 @@
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import os
+import subprocess
+import sys
+import time as timer
+import tracemalloc
+from datetime import datetime, time as clock_time
+
+from tariff import default_tariff
+
+
+########################################################
+
+# benchmark.py
+
+# contains benchmarks for the hot paths of the
+# monthly bill calculator, and a harness that times each
+# pipeline stage and compares it to a stored baseline
+
+########################################################
+
+
+# original hardcoded B-19 seasons and time periods, used as the reference classifier
+summer_start, summer_end = (6, 1), (9, 30)
+time_periods = {
+    "summer": {
+        "peak": (clock_time(16, 0), clock_time(21, 0)),
+        "part_peak": (clock_time(14, 0), clock_time(16, 0)),
+        "part_peak2": (clock_time(21, 0), clock_time(23, 0))
+    },
+    "winter": {
+        "peak": (clock_time(16, 0), clock_time(21, 0)),
+        "super_off_peak": (clock_time(9, 0), clock_time(14, 0)),
+    }
+}
+
+
+# checks if time is within a given time window
+def in_time_window(t, window):
+    t = datetime.strptime(t, "%H:%M").time()
+    start, end = window
+    return start <= t < end
+
+
+# classifies an interval the original way, checking each time window with strptime
+def classify_with_time_windows(month, date, time):
+    if summer_start <= (month, date) <= summer_end:
+        if in_time_window(time, time_periods['summer']['peak']):
+            return ('summer', 'peak', 'max_peak')
+        elif in_time_window(time, time_periods['summer']['part_peak']) or in_time_window(time, time_periods['summer']['part_peak2']):
+            return ('summer', 'part_peak', 'max_part_peak')
+        return ('summer', 'off_peak', None)
+    if in_time_window(time, time_periods['winter']['peak']):
+        return ('winter', 'peak', 'max_peak')
+    elif (3 <= month <= 5) and in_time_window(time, time_periods['winter']['super_off_peak']):
+        return ('winter', 'super_off_peak', None)
+    return ('winter', 'off_peak', None)
+
+
+# reads the (month, date, time) of every row in the given csv files
+def load_intervals(filenames):
+    intervals = []
+    for filename in filenames:
+        with open(filename, newline='') as file:
+            for row in csv.DictReader(file):
+                start_datetime = row['Start Date Time']
+                intervals.append((int(start_datetime[0:2]), int(start_datetime[3:5]), start_datetime[11:]))
+    return intervals
+
+
+# times a classifier over every interval and returns seconds per row
+def time_classifier(classify, intervals, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = timer.perf_counter()
+        for month, date, time in intervals:
+            classify(month, date, time)
+        elapsed = timer.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(intervals)
+
+
+# compares per-row time-of-use classification with and without the lookup table
+def bench_tou_classification(filenames):
+    intervals = load_intervals(filenames)
+    classify_interval = default_tariff().classify
+
+    # both classifiers must agree before their timings mean anything
+    for month, date, time in intervals:
+        assert classify_with_time_windows(month, date, time) == classify_interval(month, date, time)[:3]
+
+    per_row_windows = time_classifier(classify_with_time_windows, intervals)
+    per_row_table = time_classifier(classify_interval, intervals)
+
+    print(f"Time-of-use classification ({len(intervals):,} rows from {len(filenames)} file(s))")
+    print(f"  strptime time windows: {per_row_windows * 1e6:,.3f} us per row")
+    print(f"  lookup table:          {per_row_table * 1e6:,.3f} us per row")
+    print(f"  speedup:               {per_row_windows / per_row_table:,.1f}x")
+
+
+# compares the row-by-row and columnar parsing engines
+def bench_parse_engines(filenames, repeat=3):
+    from preprocess import read_in_data
+    from vectorized import read_in_data_vectorized
+
+    print(f"Parsing engines ({len(filenames)} file(s))")
+    for name, engine in (('row-by-row', read_in_data), ('columnar', read_in_data_vectorized)):
+        best = None
+        for _ in range(repeat):
+            start = timer.perf_counter()
+            for filename in filenames:
+                engine(filename)
+            elapsed = timer.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"  {name + ':':<22} {best * 1e3:,.1f} ms")
+
+
+# default file the pipeline benchmark results are stored in / compared against
+BASELINE_FILE = 'benchmark_baseline.json'
+
+
+# calls a function once under tracemalloc, returns the peak MB of Python memory allocated during the call
+# (ru_maxrss is the high-water mark of the whole process, so it cannot tell stages apart)
+def peak_allocated_mb(function, *args):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+# times a call, returns (result of the last call, best seconds of repeat calls)
+def timed(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        start = timer.perf_counter()
+        result = function(*args)
+        elapsed = timer.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+# times each stage of the billing pipeline on one file
+# returns (number of rows, {stage: {'seconds', 'rows_per_sec', 'peak_mb'}}), the memory peak of each stage is
+# measured in a separate untimed call since tracing allocations slows the stage down
+def bench_pipeline(filename, repeat=3):
+    from billing import calculate_monthly_bills
+    from output import print_monthly_bills
+    from preprocess import read_in_data, read_rows, parse_data
+
+    default_tariff() # compile the tariff up front so it is not counted in the first stage
+    results = {}
+
+    def record(stage, seconds, rows, function, *args):
+        results[stage] = {'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0.0, 'peak_mb': peak_allocated_mb(function, *args)}
+
+    # csv decoding only, kept in memory so parse_data can be timed on its own
+    def read_all_rows(filename):
+        with open(filename, newline='') as file:
+            reader, start_of_month = read_rows(file)
+            return list(reader), start_of_month
+
+    (rows, start_of_month), seconds = timed(repeat, read_all_rows, filename)
+    n_rows = len(rows)
+    record('csv_decode', seconds, n_rows, read_all_rows, filename)
+
+    _, seconds = timed(repeat, parse_data, rows, start_of_month)
+    record('parse_data', seconds, n_rows, parse_data, rows, start_of_month)
+    del rows
+
+    billing_cycles, seconds = timed(repeat, read_in_data, filename)
+    record('read_in_data', seconds, n_rows, read_in_data, filename)
+
+    _, seconds = timed(repeat, calculate_monthly_bills, billing_cycles)
+    record('calculate_monthly_bills', seconds, n_rows, calculate_monthly_bills, billing_cycles)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _, seconds = timed(repeat, print_monthly_bills, billing_cycles)
+        record('print_monthly_bills', seconds, n_rows, print_monthly_bills, billing_cycles)
+
+    return n_rows, results
+
+
+# times fresh interpreter runs of the library and calculator entry points on one file
+# (what every short per-meter job pays before and around billing), returns {command: best seconds}
+def bench_startup(filename, repeat=3):
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        'python (no imports)': [sys.executable, '-c', 'pass'],
+        'import api': [sys.executable, '-c', 'import api'],
+        'calculator --help': [sys.executable, os.path.join(here, 'monthly_bill_calculator.py'), '--help'],
+        'api.bill_text': [sys.executable, '-c', f'import api; api.bill_text({filename!r}, use_cache=False)'],
+        'calculator FILE': [sys.executable, os.path.join(here, 'monthly_bill_calculator.py'), filename, '--no-cache'],
+    }
+
+    results = {}
+    for name, command in commands.items():
+        best = None
+        for _ in range(repeat):
+            start = timer.perf_counter()
+            subprocess.run(command, cwd=here, stdout=subprocess.DEVNULL, check=True)
+            elapsed = timer.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    return results
+
+
+# prints pipeline results and compares them to the baseline, returns the number of regressions
+def report_pipeline(filename, n_rows, results, baseline, tolerance):
+    regressions = 0
+    print(f"Pipeline stages for {filename} ({n_rows:,} rows)")
+    for stage, result in results.items():
+        line = f"  {stage + ':':<26} {result['seconds'] * 1e3:>10,.1f} ms {result['rows_per_sec']:>14,.0f} rows/s {result['peak_mb']:>8,.1f} MB peak allocated"
+        previous = baseline.get(stage)
+        if previous and previous['rows_per_sec']:
+            change = result['rows_per_sec'] / previous['rows_per_sec'] - 1
+            line += f"  ({change:+.0%} vs baseline)"
+            if change < -tolerance:
+                line += "  REGRESSION"
+                regressions += 1
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the monthly bill calculator.")
+    parser.add_argument('filenames', nargs='*', help="interval data CSV files (default: datasets/*.csv)")
+    parser.add_argument('--pipeline', action='store_true', help="time each pipeline stage (read_in_data, parse_data, calculate_monthly_bills, print_monthly_bills)")
+    parser.add_argument('--startup', action='store_true', help="time cold starts of the calculator and the library entry point on the first file")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help=f"baseline results file (default: {BASELINE_FILE})")
+    parser.add_argument('--save-baseline', action='store_true', help="store the pipeline results as the new baseline")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the fastest is reported (default: 3)")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown vs baseline reported as a regression (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    filenames = args.filenames or sorted(glob.glob('datasets/*.csv'))
+
+    if args.startup:
+        filename = os.path.abspath(filenames[0])
+        print(f"Cold start (best of {args.repeat} runs) on {filenames[0]}")
+        for name, seconds in bench_startup(filename, args.repeat).items():
+            print(f"  {name + ':':<22} {seconds * 1e3:>8,.1f} ms")
+        return
+
+    if not args.pipeline:
+        bench_tou_classification(filenames)
+        bench_parse_engines(filenames)
+        return
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+
+    regressions = 0
+    for filename in filenames:
+        n_rows, results = bench_pipeline(filename, args.repeat)
+        # baselines are keyed by file name and size so a regenerated file is not compared to old numbers
+        key = f"{os.path.basename(filename)}:{os.path.getsize(filename)}"
+        regressions += report_pipeline(filename, n_rows, results, {} if args.save_baseline else baselines.get(key, {}), args.tolerance)
+        baselines[key] = results
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(baselines, file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import traceback
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from billing import calculate_monthly_bills
+from cache import cached_read_in_data
+from fixed_point import cents_decimal, quantity_decimal
+from output import render_bill_details
+from tariff import full_cycle_days, resolve_tariff
+
+
+########################################################
+
+# bill_service.py
+
+# contains a local query service that keeps parsed meters
+# loaded and indexed by date range, and answers bill
+# detail, range and aggregate queries over HTTP (or a
+# unix socket) without parsing the meter files again
+
+########################################################
+
+
+# converts an 'mm-dd-yyyy' date into a sortable yyyymmdd integer
+def date_number(value):
+    if len(value) != 10 or value[2] != '-' or value[5] != '-':
+        raise ValueError(f"Invalid date '{value}', expected mm-dd-yyyy")
+    return int(value[6:10]) * 10000 + int(value[0:2]) * 100 + int(value[3:5])
+
+
+# stores the priced billing cycles of one meter file, ordered and indexed by date
+class MeterIndex:
+    def __init__(self, filename, tariff):
+        self.filename = filename
+        self.tariff = tariff
+        self.stat = os.stat(filename)
+        self.billing_cycles = cached_read_in_data(filename, tariff) # 'mm-yyyy': BillingCycle, as print_bill_details expects
+        calculate_monthly_bills(self.billing_cycles, tariff)
+
+        cycles = sorted(self.billing_cycles.values(), key=lambda cur_cycle: date_number(cur_cycle.start_date))
+        self.cycles = cycles
+        self.starts = [date_number(cur_cycle.start_date) for cur_cycle in cycles]
+        self.ends = [date_number(cur_cycle.end_date) for cur_cycle in cycles]
+
+        # running totals of the charges (cents), so range totals are a difference of two entries
+        self.totals = list(accumulate(
+            ((cur_cycle.customer_cents, cur_cycle.demand_cents, cur_cycle.energy_cents, cur_cycle.total_cents) for cur_cycle in cycles),
+            lambda total, charges: tuple(a + b for a, b in zip(total, charges)), initial=(0, 0, 0, 0)))
+
+    # checks if the meter file changed since it was indexed
+    def is_stale(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return False # keep serving the last bills of a removed file
+        return (stat.st_size, stat.st_mtime_ns) != (self.stat.st_size, self.stat.st_mtime_ns)
+
+    # returns the (first, last + 1) positions of the cycles that overlap the start and end dates
+    def cycle_range(self, start=None, end=None):
+        first = bisect_left(self.ends, date_number(start)) if start else 0
+        last = bisect_right(self.starts, date_number(end)) if end else len(self.cycles)
+        return first, max(first, last)
+
+    # returns the billing cycles that overlap the start and end dates
+    def cycles_between(self, start=None, end=None):
+        first, last = self.cycle_range(start, end)
+        return self.cycles[first:last]
+
+    # returns the totals of the billing cycles that overlap the start and end dates
+    def aggregate(self, start=None, end=None):
+        first, last = self.cycle_range(start, end)
+        customer, demand, energy, total = (b - a for a, b in zip(self.totals[first], self.totals[last]))
+
+        usage = [0] * len(self.tariff.energy_layout)
+        max_demand = [0] * len(self.tariff.demand_layout)
+        for cur_cycle in self.cycles[first:last]:
+            usage = [a + b for a, b in zip(usage, cur_cycle.energy_values)]
+            max_demand = [max(a, b) for a, b in zip(max_demand, cur_cycle.demand_values)]
+
+        return {
+            'meter_file': self.filename,
+            'cycles': last - first,
+            'start_date': self.cycles[first].start_date if last > first else None,
+            'end_date': self.cycles[last - 1].end_date if last > first else None,
+            'billing_days': sum(cur_cycle.billing_days for cur_cycle in self.cycles[first:last]),
+            'customer_charge': str(cents_decimal(customer)),
+            'demand_charge': str(cents_decimal(demand)),
+            'energy_charge': str(cents_decimal(energy)),
+            'total_charge': str(cents_decimal(total)),
+            'energy_kwh': period_values(self.tariff.energy_layout, usage),
+            'max_demand_kw': period_values(self.tariff.demand_layout, max_demand)
+        }
+
+    # renders the detailed bill of a billing cycle the same way as the calculator
+    def render_details(self, key):
+        return render_bill_details(self.billing_cycles, key, self.tariff)
+
+
+# converts period values in layout order into {season: {period: value}}
+def period_values(layout, values):
+    result = {}
+    for (season, period), value in zip(layout, values):
+        result.setdefault(season, {})[period] = str(quantity_decimal(value))
+    return result
+
+
+# converts a billing cycle into a json-friendly summary, optionally with its line items
+def cycle_summary(cur_cycle, details=False):
+    summary = {
+        'key': cur_cycle.start_date[0:2] + '-' + cur_cycle.start_date[6:10],
+        'start_date': cur_cycle.start_date,
+        'end_date': cur_cycle.end_date,
+        'billing_days': cur_cycle.billing_days,
+        'days_in_season': dict(cur_cycle.days_in_season),
+        'partial': cur_cycle.billing_days < full_cycle_days(cur_cycle.start_date), # shorter than a full cycle
+        'customer_charge': str(cur_cycle.customer_charge),
+        'demand_charge': str(cur_cycle.demand_charge),
+        'energy_charge': str(cur_cycle.energy_charge),
+        'total_charge': str(cur_cycle.total_charge)
+    }
+    if details:
+        summary['line_items'] = [
+            {'charge': charge, 'season': season, 'period': period, 'value': str(value_cost.value), 'cost': str(value_cost.cost)}
+            for charge, periods in (('demand', cur_cycle.demand_charge_periods), ('energy', cur_cycle.energy_charge_periods))
+            for season in periods for period, value_cost in periods[season].items()
+        ]
+    return summary
+
+
+# raised by request handlers to answer with an http error status
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# stores the indexed meters and answers queries about them
+class BillIndex:
+    def __init__(self, tariff=None):
+        self.tariff = resolve_tariff(tariff)
+        self.filenames = {} # meter name : meter file
+        self.meters = {} # meter name : MeterIndex
+        self.failures = {} # meter name : ((size, mtime) of the file that could not be indexed, error)
+        self.locks = {} # meter name : lock held while the meter is (re)indexed
+
+    # adds a meter file, named after the file unless a name is given (indexed on first use or by load_all)
+    # raises ValueError if another file already has the name (e.g. meter.csv in two directories)
+    def add_meter(self, filename, name=None):
+        name = name or os.path.splitext(os.path.basename(filename))[0]
+        if name in self.filenames and os.path.realpath(self.filenames[name]) != os.path.realpath(filename):
+            raise ValueError(f"Meter name '{name}' is used by both {self.filenames[name]} and {filename}")
+        self.filenames[name] = filename
+        self.locks[name] = asyncio.Lock()
+        return name
+
+    # indexes every meter, parsing them in an executor so queries for already indexed meters are still answered
+    # a meter that cannot be indexed is reported and left unavailable, the others are still served
+    async def load_all(self, errors=sys.stderr):
+        async def load(name):
+            try:
+                await self.meter(name)
+            except RequestError as e:
+                print(f"Could not index {self.filenames[name]}: {e}", file=errors)
+
+        await asyncio.gather(*(load(name) for name in self.filenames))
+
+    # returns the index of a meter, (re)indexing it first if it is new or its file changed
+    # a file that could not be indexed is only parsed again once it changes
+    async def meter(self, name):
+        if name not in self.filenames:
+            raise RequestError(404, f"Unknown meter '{name}'")
+        meter_index = self.meters.get(name)
+        if meter_index is None or meter_index.is_stale():
+            async with self.locks[name]:
+                meter_index = self.meters.get(name)
+                if meter_index is None or meter_index.is_stale():
+                    meter_index = await self.index_meter(name)
+        return meter_index
+
+    # parses and indexes a meter file in an executor, raises a RequestError if the file cannot be billed
+    async def index_meter(self, name):
+        filename = self.filenames[name]
+        try:
+            stat = os.stat(filename)
+            source = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            source = None
+        if name in self.failures and self.failures[name][0] == source:
+            raise RequestError(500, self.failures[name][1])
+
+        loop = asyncio.get_running_loop()
+        try:
+            meter_index = await loop.run_in_executor(None, MeterIndex, filename, self.tariff)
+        except Exception as e: # a bad meter file makes that meter unavailable, not the service
+            self.failures[name] = (source, f"Meter '{name}' is unavailable: {type(e).__name__}: {e}")
+            raise RequestError(500, self.failures[name][1])
+        self.failures.pop(name, None)
+        self.meters[name] = meter_index
+        return meter_index
+
+    # answers a GET request, returns (content type, body)
+    async def handle(self, path, query):
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        start, end = query.get('from', [None])[0], query.get('to', [None])[0]
+        for value in (start, end):
+            try:
+                if value:
+                    date_number(value)
+            except ValueError as e: # bad dates
+                raise RequestError(400, str(e))
+
+        # /meters
+        if parts == ['meters']:
+            return json_body({'meters': sorted(self.filenames)})
+
+        if len(parts) < 2 or parts[0] != 'meters':
+            raise RequestError(404, "Not found")
+        meter_index = await self.meter(parts[1])
+
+        # /meters/<meter>/cycles?from=mm-dd-yyyy&to=mm-dd-yyyy
+        if parts[2:] == ['cycles']:
+            return json_body({'meter': parts[1], 'cycles': [cycle_summary(cur_cycle) for cur_cycle in meter_index.cycles_between(start, end)]})
+
+        # /meters/<meter>/cycles/<mm-yyyy>[?format=text]
+        if len(parts) == 4 and parts[2] == 'cycles':
+            if parts[3] not in meter_index.billing_cycles:
+                raise RequestError(404, f"No billing cycle '{parts[3]}' for meter '{parts[1]}'")
+            if query.get('format', [''])[0] == 'text':
+                return 'text/plain; charset=utf-8', meter_index.render_details(parts[3]).encode()
+            return json_body(cycle_summary(meter_index.billing_cycles[parts[3]], details=True))
+
+        # /meters/<meter>/aggregate?from=mm-dd-yyyy&to=mm-dd-yyyy
+        if parts[2:] == ['aggregate']:
+            return json_body(dict(meter=parts[1], **meter_index.aggregate(start, end)))
+
+        raise RequestError(404, "Not found")
+
+
+# encodes a json response body
+def json_body(data):
+    return 'application/json', json.dumps(data).encode()
+
+
+# reason phrases of the http statuses the service answers with
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+# reads http/1.1 requests from a connection and answers them (connections are kept alive)
+async def serve_connection(bill_index, reader, writer):
+    try:
+        while request_line := await reader.readline():
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                if method != 'GET':
+                    raise RequestError(405, "Only GET is supported")
+                url = urlsplit(target)
+                status, (content_type, body) = 200, await bill_index.handle(url.path, parse_qs(url.query))
+            except RequestError as e:
+                status, (content_type, body) = e.status, json_body({'error': str(e)})
+            except Exception as e: # a failed request is answered, the connection and the service keep going
+                traceback.print_exc()
+                status, (content_type, body) = 500, json_body({'error': f"{type(e).__name__}: {e}"})
+
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write(f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError): # client went away or sent a malformed request line
+        pass
+    finally:
+        writer.close()
+
+
+# indexes the meters added to a bill index and serves queries until interrupted
+async def run_service(bill_index, host='127.0.0.1', port=8765, unix_socket=None):
+    await bill_index.load_all()
+
+    def handler(reader, writer):
+        return serve_connection(bill_index, reader, writer)
+
+    if unix_socket:
+        server = await asyncio.start_unix_server(handler, path=unix_socket)
+        print(f"Serving {len(bill_index.filenames)} meter(s) on {unix_socket}")
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        print(f"Serving {len(bill_index.filenames)} meter(s) on http://{host}:{port}/meters")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    from batch import find_meter_files
+
+    parser = argparse.ArgumentParser(description="Serve bill lookups for meter files over HTTP.")
+    parser.add_argument('paths', nargs='+', help="directories or glob patterns of meter CSV files (e.g. datasets/)")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument('--unix', default=None, help="listen on this unix socket path instead of a port")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    # meters are named after their files, so two files with the same name cannot both be served
+    bill_index = BillIndex(args.tariff)
+    try:
+        for filename in find_meter_files(args.paths):
+            bill_index.add_meter(filename)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        asyncio.run(run_service(bill_index, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
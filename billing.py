@@ -1,6 +1,9 @@
-from datetime import datetime, time
-from decimal import Decimal, ROUND_HALF_UP
-from tariff_rates import B19Rates
+from array import array
+
+import instrumentation
+
+from fixed_point import CENT_SCALE, RATE_SCALE, RATIO_SCALE, round_div
+from tariff import full_cycle_days, resolve_tariff
 
 ########################################################
 
@@ -12,102 +15,107 @@ from tariff_rates import B19Rates
 ########################################################
 
 
-# defining date ranges for summer and winter
-summer_start = (6, 1)
-summer_end = (9, 30)
-
-
-# define time periods in each season
-time_periods = {
-    "summer": {
-        "peak": (time(16, 0), time(21, 0)),
-        "part_peak": (time(14, 0), time(16, 0)),
-        "part_peak2": (time(21, 0), time(23, 0))
-    },
-    "winter": {
-        "peak": (time(16, 0), time(21, 0)),
-        "super_off_peak": (time(9, 0), time(14, 0)),
-    }
-}
-
-
-# checks if time is within a given time window
-def in_time_window(t, window):
-    t = datetime.strptime(t, "%H:%M").time()
-    start, end = window
-    return start <= t < end
-
-
-# updates energy charge values based on datetime
-def update_energy_charge_periods(cur_billing_cycle, month, date, time, usage):
-    if summer_start <= (month, date) <= summer_end:
-        if in_time_window(time, time_periods['summer']['peak']): # peak hours 4pm - 9pm
-            cur_billing_cycle.energy_charge_periods['summer']['peak'].value += usage
-        elif in_time_window(time, time_periods['summer']['part_peak']) or in_time_window(time, time_periods['summer']['part_peak2']): # partial peak hours 2pm - 4pm and 9pm to 11pm
-            cur_billing_cycle.energy_charge_periods['summer']['part_peak'].value += usage
-        else: # off peak hours all other hours
-            cur_billing_cycle.energy_charge_periods['summer']['off_peak'].value += usage
-    else:
-        if in_time_window(time, time_periods['winter']['peak']): # peak hours 4pm - 9pm
-            cur_billing_cycle.energy_charge_periods['winter']['peak'].value += usage
-        elif (3 <= month <= 5) and in_time_window(time, time_periods['winter']['super_off_peak']): # super off peak hours 9am - 2pm March through May
-            cur_billing_cycle.energy_charge_periods['winter']['super_off_peak'].value += usage
-        else: # off peak hours all other hours
-            cur_billing_cycle.energy_charge_periods['winter']['off_peak'].value += usage
-
-
-# updates demand charge values based on datetime
-def update_demand_charge_periods(cur_billing_cycle, month, date, time, demand):
-    if summer_start <= (month, date) <= summer_end:
-        if in_time_window(time, time_periods['summer']['peak']): # peak hours 4pm - 9pm
-            cur_billing_cycle.demand_charge_periods['summer']['max_peak'].value = max(cur_billing_cycle.demand_charge_periods['summer']['max_peak'].value, demand)
-        elif in_time_window(time, time_periods['summer']['part_peak']) or in_time_window(time, time_periods['summer']['part_peak2']): # partial peak hours 2pm - 4pm and 9pm to 11pm
-            cur_billing_cycle.demand_charge_periods['summer']['max_part_peak'].value = max(cur_billing_cycle.demand_charge_periods['summer']['max_part_peak'].value, demand)
-        # max demand includes all hours
-        cur_billing_cycle.demand_charge_periods['summer']['max_demand'].value = max(cur_billing_cycle.demand_charge_periods['summer']['max_demand'].value, demand)
-    else:
-        if in_time_window(time, time_periods['winter']['peak']): # peak hours 4pm - 9pm
-            cur_billing_cycle.demand_charge_periods['winter']['max_peak'].value = max(cur_billing_cycle.demand_charge_periods['winter']['max_peak'].value, demand)
-        # max demand includes all hours
-        cur_billing_cycle.demand_charge_periods['winter']['max_demand'].value = max(cur_billing_cycle.demand_charge_periods['winter']['max_demand'].value, demand)
+# updates energy charge values given the row's Tariff.classify_codes (usage in millionths of a kWh)
+def update_energy_charge_periods(cur_billing_cycle, codes, usage):
+    cur_billing_cycle.energy_values[codes[0]] += usage
+
+
+# updates demand charge values given the row's Tariff.classify_codes (demand in millionths of a kW)
+def update_demand_charge_periods(cur_billing_cycle, codes, demand):
+    _, demand_code, all_hours_code = codes
+    demand_values = cur_billing_cycle.demand_values
+    if demand_code >= 0: # e.g. peak or partial peak hours
+        demand_values[demand_code] = max(demand_values[demand_code], demand)
+    if all_hours_code >= 0: # e.g. max demand includes all hours
+        demand_values[all_hours_code] = max(demand_values[all_hours_code], demand)
+
+
+# returns the day (days since 1970-01-01) the last billing cycle ends on given its last reading (minutes since
+# 1970-01-01): the midnight nearest the reading, so a file ending at 23:45 covers that day and one ending a few
+# minutes into a day does not
+def last_cycle_end_day(last_minute):
+    return (last_minute + 12 * 60) // (24 * 60)
+
+
+# returns the billing days of a cycle from its first day to the day after it ends (days since 1970-01-01):
+# the day the next cycle starts, or last_cycle_end_day for the last one, at least one day
+def cycle_billing_days(start_day, end_day):
+    return max(1, end_day - start_day)
+
+
+# returns the days a cycle's demand charges are prorated over: a full cycle from its start date (see
+# tariff.full_cycle_dates), or its billing days when it runs longer than that (e.g. no data on the next start day)
+def demand_proration_days(start_date, billing_days):
+    return max(billing_days, full_cycle_days(start_date))
 
 
 # finalizes details of billing cycle
-def finialize_billing_cycle(cur_billing_cycle, billing_days, days_summer, days_winter, prev_date, interval_length):
-    offset = 24 * interval_length # (number of intervals per day)
-    cur_billing_cycle.billing_days = int(billing_days // offset) or 1 # finalize previous billing cycle length (days)
-    cur_billing_cycle.days_in_season['summer'] = days_summer  // offset # finalize previous billing cycle's number of summer days
-    cur_billing_cycle.days_in_season['winter'] = days_winter // offset # finalize previous billing cycle's number of winter days
+# (billing days are all calendar days of the cycle, with or without data, see cycle_billing_days)
+def finialize_billing_cycle(cur_billing_cycle, billing_days, prev_date, tariff):
+    cur_billing_cycle.billing_days = billing_days # finalize previous billing cycle length (days)
+    cur_billing_cycle.days_in_season.update(tariff.season_days(cur_billing_cycle.start_date, billing_days)) # finalize previous billing cycle's number of days in each season
     cur_billing_cycle.end_date = prev_date[:10] # finalize previous billing cycle end date
 
 
+# returns the highest all hours demand of a billing cycle (used for demand ratchets)
+def cycle_max_demand(cur_cycle, tariff):
+    return max((cur_cycle.demand_values[tariff.demand_index[season][period]]
+                for season, period in tariff.all_hours_periods.items() if period), default=0)
+
+
+# returns the minimum all hours demand to bill given the previous cycles' highest demands
+def ratchet_demand(tariff, demand_history):
+    if not tariff.ratchet_cycles or not demand_history:
+        return 0
+    return round_div(tariff.ratchet_percent_fixed * max(demand_history[-tariff.ratchet_cycles:]), RATIO_SCALE)
+
+
 # calculate monthly bills for each billing cycle
-def calculate_monthly_bills(billing_cycles):
+def calculate_monthly_bills(billing_cycles, tariff=None):
+    tariff = resolve_tariff(tariff)
 
+    demand_history = []
     for cycle in billing_cycles:
         cur_cycle = billing_cycles[cycle]
+        calculate_bill(cur_cycle, tariff, ratchet_demand(tariff, demand_history))
+        demand_history.append(cycle_max_demand(cur_cycle, tariff))
+
+
+# calculate the bill for a single billing cycle
+# (ratchet is the minimum all hours demand to bill, see ratchet_demand)
+def calculate_bill(cur_cycle, tariff=None, ratchet=0):
+    tariff = resolve_tariff(tariff)
+
+    with instrumentation.stage('price'):
+        customer_cents, demand_costs, energy_costs = price_line_items(tariff, cur_cycle.energy_values, cur_cycle.demand_values, cur_cycle.billing_days,
+                                                                      cur_cycle.days_in_season, demand_proration_days(cur_cycle.start_date, cur_cycle.billing_days), ratchet)
+    cur_cycle.demand_costs = array('q', demand_costs)
+    cur_cycle.energy_costs = array('q', energy_costs)
+
+    cur_cycle.customer_cents = customer_cents
+    cur_cycle.demand_cents = sum(demand_costs)
+    cur_cycle.energy_cents = sum(energy_costs)
+    cur_cycle.total_cents = cur_cycle.customer_cents + cur_cycle.demand_cents + cur_cycle.energy_cents
+
+
+# prices the line items of a billing cycle in integer fixed point (see fixed_point.py), each rounded to cents once
+# energy and demand values are in millionths of a kWh / kW in the tariff's layout order
+# (demand charges are prorated by the days in each season / proration_days, see demand_proration_days)
+# returns (customer charge, demand charge per demand period, energy charge per energy period) in cents
+def price_line_items(tariff, energy_values, demand_values, billing_days, days_in_season, proration_days, ratchet=0):
+
+    # calculate customer charge
+    customer_cents = round_div(tariff.customer_rate_fixed * billing_days, RATE_SCALE // 100)
+
+    # calculate demand charge, prorated by the days of the billing cycle in each season
+    demand_costs = []
+    for code, (season, period) in enumerate(tariff.demand_layout):
+        demand_value = demand_values[code]
+        if ratchet and period == tariff.all_hours_periods[season]:
+            demand_value = max(demand_value, ratchet)
+        demand_costs.append(round_div(tariff.demand_rates_fixed[code] * demand_value * days_in_season[season], CENT_SCALE * proration_days))
+
+    # calculate energy charge
+    energy_costs = [round_div(rate * value, CENT_SCALE) for rate, value in zip(tariff.energy_rates_fixed, energy_values)]
 
-        # calculate customer charge
-        customer_amount = Decimal(B19Rates['customer_charge_rates']['mandatory'] * cur_cycle.billing_days)
-        cur_cycle.customer_charge = customer_amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-
-        # calculate demand charge
-        for season in cur_cycle.demand_charge_periods:
-            for period in cur_cycle.demand_charge_periods[season]:
-                rate = float(B19Rates['demand_charge_rates'][season].get(period, 0))
-                demand_value = cur_cycle.demand_charge_periods[season][period].value
-                demand_amount = Decimal(((rate * demand_value) * cur_cycle.days_in_season[season]) / (cur_cycle.billing_days or 1))
-                cur_cycle.demand_charge_periods[season][period].cost = demand_amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                cur_cycle.demand_charge += cur_cycle.demand_charge_periods[season][period].cost
-
-        # calculate energy charge
-        for season in cur_cycle.energy_charge_periods:
-            for period in cur_cycle.energy_charge_periods[season]:
-                rate = float(B19Rates['energy_charge_rates'][season].get(period, 0))
-                energy_value = cur_cycle.energy_charge_periods[season][period].value
-                energy_amount = Decimal(rate * energy_value)
-                cur_cycle.energy_charge_periods[season][period].cost = energy_amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-                cur_cycle.energy_charge += cur_cycle.energy_charge_periods[season][period].cost
-
-        # calculate total charge
-        cur_cycle.total_charge = cur_cycle.customer_charge + cur_cycle.demand_charge + cur_cycle.energy_charge
+    return customer_cents, demand_costs, energy_costs
@@ -1,62 +1,147 @@
+from array import array
+from collections.abc import Mapping
+
+from fixed_point import cents_decimal, quantity_decimal
+from tariff import resolve_tariff
+from timestamps import IntervalReport
+
 ########################################################
 
 # billing_cycle.py
 
-# contains definitions for the ValueCost
-# and BillingCycle objects
+# contains definitions for the ValueCost,
+# BillingCycle and ParseState objects
 
 ########################################################
 
 
-# stores demand/energy values and cost for those values
+# read-only view of the demand/energy value (kW / kWh) and cost (dollars) of one period of a billing cycle
 class ValueCost:
-    def __init__(self):
-        self.value = 0
-        self.cost = 0
+    __slots__ = ('values', 'costs', 'code')
+
+    def __init__(self, values, costs, code):
+        self.values = values
+        self.costs = costs
+        self.code = code
+
+    @property
+    def value(self):
+        return quantity_decimal(self.values[self.code])
+
+    @property
+    def cost(self):
+        return cents_decimal(self.costs[self.code])
+
+
+# read-only view of the periods of a season, {period: ValueCost}
+class SeasonPeriods(Mapping):
+    __slots__ = ('index', 'values', 'costs')
+
+    def __init__(self, index, values, costs):
+        self.index = index
+        self.values = values
+        self.costs = costs
+
+    def __getitem__(self, period):
+        return ValueCost(self.values, self.costs, self.index[period])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+# read-only view of the period accumulators of a billing cycle, {season: {period: ValueCost}}
+# (index is the tariff's {season: {period: code}}, values and costs are indexed by code)
+class ChargePeriods(Mapping):
+    __slots__ = ('index', 'values', 'costs')
+
+    def __init__(self, index, values, costs):
+        self.index = index
+        self.values = values
+        self.costs = costs
+
+    def __getitem__(self, season):
+        return SeasonPeriods(self.index[season], self.values, self.costs)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
 
 
 # stores information for a single billing cycle
+# energy and demand values (millionths of a kWh / kW) and costs (cents) are kept in integer arrays
+# indexed by the tariff's period codes (see Tariff.energy_layout and Tariff.demand_layout)
 class BillingCycle:
+    __slots__ = ('start_date', 'end_date', 'energy_index', 'energy_values', 'energy_costs', 'demand_index', 'demand_values', 'demand_costs',
+                 'days_in_season', 'billing_days', 'customer_cents', 'demand_cents', 'energy_cents', 'total_cents')
+
     def __init__(self, start_date: str):
         self.start_date = start_date
         self.end_date = None
-        self.energy_charge_periods = None
-        self.demand_charge_periods = None
+        self.energy_index = self.energy_values = self.energy_costs = None
+        self.demand_index = self.demand_values = self.demand_costs = None
         self.days_in_season = { 'summer': 0, 'winter': 0 }
         self.billing_days = 0
-        self.customer_charge = 0
-        self.demand_charge = 0
-        self.energy_charge = 0
-        self.total_charge = 0
-
-    # initializes energy charge values for all seasons and time periods
-    def initialize_energy_charge_periods(self, cur_billing_cycle):
-
-        cur_billing_cycle.energy_charge_periods = {
-            "summer" : {
-                "peak": ValueCost(),
-                "part_peak": ValueCost(),
-                "off_peak": ValueCost()
-            },
-            "winter" : {
-                "peak": ValueCost(),
-                "off_peak": ValueCost(),
-                "super_off_peak": ValueCost()
-            }
-        }
-
-    # initializes demand charge values for all seasons and time periods
-    def initialize_demand_charge_periods(self, cur_billing_cycle):
-
-        cur_billing_cycle.demand_charge_periods = {
-            "summer" : {
-                "max_peak": ValueCost(),
-                "max_part_peak": ValueCost(),
-                "max_demand": ValueCost()
-            },
-            "winter" : {
-                "max_peak": ValueCost(),
-                "max_demand": ValueCost()
-            }
-        }
+        self.customer_cents = 0
+        self.demand_cents = 0
+        self.energy_cents = 0
+        self.total_cents = 0
+
+    # initializes energy charge values for all seasons and time periods of the tariff
+    def initialize_energy_charge_periods(self, cur_billing_cycle, tariff=None):
+        tariff = resolve_tariff(tariff)
+        cur_billing_cycle.energy_index = tariff.energy_index
+        cur_billing_cycle.energy_values = array('q', bytes(8 * len(tariff.energy_layout)))
+        cur_billing_cycle.energy_costs = array('q', bytes(8 * len(tariff.energy_layout)))
+
+    # initializes demand charge values for all seasons and time periods of the tariff
+    def initialize_demand_charge_periods(self, cur_billing_cycle, tariff=None):
+        tariff = resolve_tariff(tariff)
+        cur_billing_cycle.demand_index = tariff.demand_index
+        cur_billing_cycle.demand_values = array('q', bytes(8 * len(tariff.demand_layout)))
+        cur_billing_cycle.demand_costs = array('q', bytes(8 * len(tariff.demand_layout)))
+
+    # energy values and costs by season and period, e.g. energy_charge_periods['summer']['peak'].value
+    @property
+    def energy_charge_periods(self):
+        return ChargePeriods(self.energy_index, self.energy_values, self.energy_costs)
+
+    # demand values and costs by season and period, e.g. demand_charge_periods['summer']['max_peak'].value
+    @property
+    def demand_charge_periods(self):
+        return ChargePeriods(self.demand_index, self.demand_values, self.demand_costs)
+
+    # charges in dollars (for display)
+    @property
+    def customer_charge(self):
+        return cents_decimal(self.customer_cents)
+
+    @property
+    def demand_charge(self):
+        return cents_decimal(self.demand_cents)
+
+    @property
+    def energy_charge(self):
+        return cents_decimal(self.energy_cents)
+
+    @property
+    def total_charge(self):
+        return cents_decimal(self.total_cents)
+
+
+# stores the running state of the parser between rows so parsing can be resumed later
+class ParseState:
+    __slots__ = ('start_of_month', 'cycle_start_day', 'prev_minute', 'prev_date', 'cur_billing_cycle', 'cycles_created', 'report')
 
+    def __init__(self, start_of_month: int):
+        self.start_of_month = start_of_month
+        self.cycle_start_day = None # first day of the current billing cycle (days since 1970-01-01)
+        self.prev_minute = None # last reading (minutes since 1970-01-01)
+        self.prev_date = None
+        self.cur_billing_cycle = None
+        self.cycles_created = set()
+        self.report = IntervalReport()
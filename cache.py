@@ -0,0 +1,163 @@
+import hashlib
+from array import array
+import os
+import struct
+
+import instrumentation
+from billing_cycle import BillingCycle
+from preprocess import read_in_data
+from tariff import resolve_tariff
+
+
+########################################################
+
+# cache.py
+
+# contains an on-disk cache of parsed billing cycles so
+# unchanged csv files are not parsed again
+
+########################################################
+
+
+# cache location and size limit (bytes), both can be overridden with environment variables
+CACHE_DIR = os.environ.get('BILL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'electricity-bill-calculator'))
+CACHE_SIZE_LIMIT = int(os.environ.get('BILL_CACHE_SIZE_LIMIT', 256 * 1024 * 1024))
+
+# bump when the binary layout below changes
+CACHE_FORMAT_VERSION = 5
+
+# binary layout: a header with the number of cycles, then one fixed size record per billing cycle
+# (start date, end date, billing days, summer days, winter days, energy values, demand values in millionths of a kWh / kW)
+HEADER = struct.Struct('<4sI')
+MAGIC = b'EBC1'
+
+
+# returns the record layout for a tariff's energy and demand periods
+def cycle_record(tariff):
+    return struct.Struct(f'<10s10sIII{len(tariff.energy_layout)}q{len(tariff.demand_layout)}q')
+
+
+# hashes the contents of a file in chunks
+def content_hash(filename, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# builds the cache key from the file's path, size, mtime and content hash plus the tariff fingerprint
+# (so cached entries are invalidated when the tariff schedule changes)
+def cache_key(filename, tariff):
+    stat = os.stat(filename)
+    parts = (CACHE_FORMAT_VERSION, tariff.fingerprint, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, content_hash(filename))
+    return hashlib.blake2b(repr(parts).encode(), digest_size=20).hexdigest()
+
+
+# packs parsed (unpriced) billing cycles into the binary cache format
+def pack_billing_cycles(billing_cycles, tariff):
+    record = cycle_record(tariff)
+    records = [HEADER.pack(MAGIC, len(billing_cycles))]
+    for cur_cycle in billing_cycles.values():
+        records.append(record.pack(cur_cycle.start_date.encode(), cur_cycle.end_date.encode(), cur_cycle.billing_days,
+                                   cur_cycle.days_in_season['summer'], cur_cycle.days_in_season['winter'],
+                                   *cur_cycle.energy_values, *cur_cycle.demand_values))
+    return b''.join(records)
+
+
+# unpacks the binary cache format back into billing cycles
+def unpack_billing_cycles(data, tariff):
+    record = cycle_record(tariff)
+    magic, n_cycles = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or len(data) != HEADER.size + n_cycles * record.size:
+        raise ValueError("Corrupt cache entry")
+
+    billing_cycles = {}
+    n_energy = len(tariff.energy_layout)
+    for start_date, end_date, billing_days, days_summer, days_winter, *values in record.iter_unpack(data[HEADER.size:]):
+        cur_billing_cycle = BillingCycle(start_date.decode())
+        cur_billing_cycle.initialize_energy_charge_periods(cur_billing_cycle, tariff)
+        cur_billing_cycle.initialize_demand_charge_periods(cur_billing_cycle, tariff)
+        cur_billing_cycle.energy_values = array('q', values[:n_energy])
+        cur_billing_cycle.demand_values = array('q', values[n_energy:])
+        cur_billing_cycle.billing_days = billing_days
+        cur_billing_cycle.days_in_season['summer'] = days_summer
+        cur_billing_cycle.days_in_season['winter'] = days_winter
+        cur_billing_cycle.end_date = end_date.decode()
+
+        key = (cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10])
+        billing_cycles[key] = cur_billing_cycle
+
+    return billing_cycles
+
+
+# removes least recently used entries until the cache fits in its size limit
+def evict_entries(cache_dir=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.bin'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError: # removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= size_limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+# returns the path of a meter file's saved state (e.g. its incremental checkpoint or rollup store) in the private
+# state directory of the cache, creating the directory (accessible by the user only) if needed
+# these files are unpickled, so they are never kept next to the meter files, where anyone who can write to a shared
+# data directory could replace them; raises PermissionError if the state directory is not private
+def private_state_path(filename, suffix, cache_dir=CACHE_DIR):
+    state_dir = os.path.join(cache_dir, 'state')
+    os.makedirs(state_dir, mode=0o700, exist_ok=True)
+    stat = os.stat(state_dir)
+    if (hasattr(os, 'getuid') and stat.st_uid != os.getuid()) or stat.st_mode & 0o077:
+        raise PermissionError(f"State directory {state_dir} must be owned by the user and not accessible by others (chmod 700)")
+    name = hashlib.blake2b(os.path.abspath(filename).encode(), digest_size=16).hexdigest()
+    return os.path.join(state_dir, name + suffix)
+
+
+# read in data through the cache, parsing the csv file only when it has no valid cache entry
+# (with more than one worker, a cache miss is parsed in byte ranges by worker processes, see sharded.py)
+def cached_read_in_data(filename, tariff=None, cache_dir=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT, workers=1):
+    tariff = resolve_tariff(tariff)
+    path = os.path.join(cache_dir, cache_key(filename, tariff) + '.bin')
+
+    # cache hit - mark entry as recently used and skip csv parsing
+    try:
+        with open(path, 'rb') as file:
+            billing_cycles = unpack_billing_cycles(file.read(), tariff)
+        os.utime(path)
+        instrumentation.count('cache_hits')
+        return billing_cycles
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+
+    # cache miss - parse csv and store the parsed billing cycles
+    instrumentation.count('cache_misses')
+    if workers == 1:
+        billing_cycles = read_in_data(filename, tariff)
+    else:
+        from sharded import read_in_data_sharded
+        billing_cycles = read_in_data_sharded(filename, tariff, workers)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(pack_billing_cycles(billing_cycles, tariff))
+        os.replace(tmp_path, path) # atomic so concurrent readers never see a partial entry
+        evict_entries(cache_dir, size_limit)
+    except OSError: # the cache is best effort, billing continues without it
+        pass
+
+    return billing_cycles
@@ -0,0 +1,157 @@
+import argparse
+import csv
+import os
+import struct
+
+import numpy as np
+
+from vectorized import decode_timestamps, parse_fields
+
+
+########################################################
+
+# columnar.py
+
+# contains the converter from interval data csv files to a
+# compact columnar binary file, and the reader that bills
+# those files from memory-mapped columns (requires numpy)
+
+########################################################
+
+
+# extension of columnar interval data files (preprocess.read_in_data reads them as well)
+COLUMNAR_EXTENSION = '.ebc'
+
+# header: magic, format version, number of rows, decimal places of the usage and demand
+# columns, bytes per usage/demand value (4 = float32, 8 = float64), padding to 32 bytes
+HEADER = struct.Struct('<8sIQBBB9x')
+MAGIC = b'EBCOLMN\x00'
+FORMAT_VERSION = 1
+
+# decimal places are only recorded up to this many, otherwise values are stored as float64
+MAX_DECIMALS = 6
+
+
+# rounds a byte offset up to the next multiple of 8 so every column is aligned
+def align(offset):
+    return (offset + 7) // 8 * 8
+
+
+# converts (month, date, year, minute of day) columns into minutes since 1970-01-01 00:00
+def to_epoch_minutes(month, date, year, minute):
+    months = (year - 1970) * 12 + (month - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + (date - 1)
+    return days * 24 * 60 + minute
+
+
+# converts minutes since 1970-01-01 00:00 back into (month, date, year, minute of day) columns
+def from_epoch_minutes(epoch_minutes):
+    days = (epoch_minutes // (24 * 60)).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    years = months.astype('datetime64[Y]')
+    minute = (epoch_minutes % (24 * 60)).astype(np.intp)
+    date = (days - months.astype('datetime64[D]')).astype(np.intp) + 1
+    month = (months - years.astype('datetime64[M]')).astype(np.intp) + 1
+    year = years.astype(np.intp) + 1970
+    return month, date, year, minute
+
+
+# returns the number of digits after the decimal point of a numeric string
+def decimals_of(value):
+    point = value.find('.')
+    return 0 if point < 0 or 'e' in value.lower() else len(value) - point - 1
+
+
+# encodes a column as float32 when the original float64 values can be restored exactly from it
+# returns (encoded column, decimal places used to restore it)
+def encode_values(values, decimals):
+    if decimals <= MAX_DECIMALS:
+        compact = values.astype(np.float32)
+        if np.array_equal(restore_values(compact, decimals), values):
+            return compact, decimals
+    return values, 0
+
+
+# restores float64 values from a stored column
+# (float32 columns are rounded back to their decimal places, which gives the same values as parsing the csv text)
+def restore_values(column, decimals):
+    if column.dtype == np.float64:
+        return column # memory-mapped as is, no copy
+    scale = 10.0 ** decimals
+    return np.round(column.astype(np.float64) * scale) / scale
+
+
+# convert an interval data csv file into a columnar binary file
+def convert_csv(filename, output_filename=None):
+    output_filename = output_filename or os.path.splitext(filename)[0] + COLUMNAR_EXTENSION
+
+    with open(filename, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        start_col, usage_col, demand_col = header.index('Start Date Time'), header.index('Usage'), header.index('Peak Demand')
+
+        start_datetimes, usage, demand = [], [], []
+        for row in reader:
+            start_datetimes.append(row[start_col])
+            usage.append(row[usage_col] or '0')
+            demand.append(row[demand_col] or '0')
+
+    epoch_minutes = to_epoch_minutes(*decode_timestamps(np.array(start_datetimes, dtype='S16'))).astype(np.int32)
+    usage_values, demand_values = np.array(usage).astype(np.float64), np.array(demand).astype(np.float64)
+    usage_column, usage_decimals = encode_values(usage_values, max(map(decimals_of, usage), default=0))
+    demand_column, demand_decimals = encode_values(demand_values, max(map(decimals_of, demand), default=0))
+    itemsize = max(usage_column.dtype.itemsize, demand_column.dtype.itemsize)
+    if itemsize == 8: # both columns are stored as float64, so both keep the parsed values (not widened float32 ones)
+        usage_column, demand_column = usage_values, demand_values
+
+    # header followed by the timestamp, usage and demand columns, each aligned to 8 bytes
+    tmp_filename = f"{output_filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(epoch_minutes), usage_decimals, demand_decimals, itemsize))
+        for column in (epoch_minutes, usage_column, demand_column):
+            file.write(column.tobytes())
+            file.write(b'\x00' * (align(file.tell()) - file.tell()))
+    os.replace(tmp_filename, output_filename)
+
+    return output_filename
+
+
+# memory-map the columns of a columnar binary file
+# returns (epoch minutes, usage, demand) with usage and demand as float64
+def load_columnar(filename):
+    with open(filename, 'rb') as file:
+        magic, version, n_rows, usage_decimals, demand_decimals, itemsize = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Not a columnar interval data file: {filename}")
+    if n_rows == 0:
+        raise ValueError("File has no rows")
+
+    value_type = np.float32 if itemsize == 4 else np.float64
+    timestamps_offset = HEADER.size
+    usage_offset = align(timestamps_offset + n_rows * 4)
+    demand_offset = align(usage_offset + n_rows * itemsize)
+
+    epoch_minutes = np.memmap(filename, dtype=np.int32, mode='r', offset=timestamps_offset, shape=(n_rows,))
+    usage = np.memmap(filename, dtype=value_type, mode='r', offset=usage_offset, shape=(n_rows,))
+    demand = np.memmap(filename, dtype=value_type, mode='r', offset=demand_offset, shape=(n_rows,))
+
+    return epoch_minutes, restore_values(usage, usage_decimals), restore_values(demand, demand_decimals)
+
+
+# open a columnar binary file and parse its columns into billing cycles
+def read_in_columnar(filename, tariff=None):
+    epoch_minutes, usage, demand = load_columnar(filename)
+    return parse_fields(*from_epoch_minutes(epoch_minutes.astype(np.int64)), usage, demand, tariff)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Convert interval data CSV files into columnar binary ({COLUMNAR_EXTENSION}) files.")
+    parser.add_argument('filenames', nargs='+', help="CSV files to convert")
+    args = parser.parse_args()
+
+    for filename in args.filenames:
+        print(f"{filename} -> {convert_csv(filename)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import argparse
+
+import numpy as np
+
+from fixed_point import CENT_SCALE, RATE_SCALE, RATIO_SCALE, format_cents
+from tariff import available_tariffs, resolve_tariff
+from vectorized import assign_billing_cycles, build_code_tables, cycle_billing_days_of, cycle_proration_days, cycle_summer_days, date_string, decode_timestamps, load_columns, to_quantities
+
+
+########################################################
+
+# compare.py
+
+# contains the what-if tariff comparison: interval data is
+# read once into tariff independent buckets, which are then
+# priced against any number of tariffs (requires numpy)
+
+########################################################
+
+
+# stores interval data aggregated into buckets that every tariff classifies the same way:
+# one bucket per (billing cycle, class of calendar days, minute of day)
+class IntervalBuckets:
+    def __init__(self, month, date, year, minute, usage, demand, tariffs):
+        cycle_index, cycle_starts = assign_billing_cycles(month, date, year, int(date[0]))
+        cycle_ends = np.append(cycle_starts[1:], len(month)) - 1
+
+        self.tariffs = tariffs
+        self.n_cycles = len(cycle_starts)
+        self.start_dates = [date_string(month, date, year, i) for i in cycle_starts]
+        self.end_dates = [date_string(month, date, year, i) for i in cycle_ends]
+        self.cycle_keys = [start_date[0:2] + '-' + start_date[6:10] for start_date in self.start_dates]
+
+        # day type of every calendar day in the data under every tariff, days with the same day types share a class
+        days, day_of_row = np.unique(year * 10000 + month * 100 + date, return_inverse=True)
+        day_year, day_month, day_date = days // 10000, days // 100 % 100, days % 100
+        day_types = np.empty((len(tariffs), len(days)), dtype=np.intp)
+        for i, tariff in enumerate(tariffs):
+            day_types[i] = build_code_tables(tariff)[0][day_month, day_date]
+            for (holiday_year, holiday_month, holiday_date), holiday_day_type in tariff.dated_holidays.items():
+                day_types[i][(day_year == holiday_year) & (day_month == holiday_month) & (day_date == holiday_date)] = holiday_day_type
+        self.class_day_types, day_class = np.unique(day_types, axis=1, return_inverse=True)
+        row_class = day_class.reshape(-1)[day_of_row.reshape(-1)]
+
+        # calendar days per cycle (the billing days) and the days its demand charges are prorated over
+        self.billing_days = cycle_billing_days_of(month, date, year, minute, cycle_starts)
+        self.proration_days = cycle_proration_days(self.start_dates, self.billing_days)
+
+        # buckets of (cycle, day class, minute) with their energy sums and demand maxima
+        minutes, row_slot = np.unique(minute, return_inverse=True)
+        n_classes, n_slots = self.class_day_types.shape[1], len(minutes)
+        keys, bucket_of_row = np.unique((cycle_index * n_classes + row_class) * n_slots + row_slot.reshape(-1), return_inverse=True)
+        bucket_of_row = bucket_of_row.reshape(-1)
+
+        self.bucket_cycle = keys // (n_classes * n_slots)
+        self.bucket_class = keys // n_slots % n_classes
+        self.bucket_minute = minutes[keys % n_slots]
+        self.bucket_energy = np.bincount(bucket_of_row, weights=to_quantities(usage)) # (millionths of a kWh / kW, see vectorized.to_quantities)
+        self.bucket_demand = np.zeros(len(keys))
+        np.maximum.at(self.bucket_demand, bucket_of_row, to_quantities(demand))
+
+    # aggregates the buckets into per-cycle period values for the i-th tariff
+    # returns (energy per [cycle, energy period], demand per [cycle, demand period], summer days per cycle)
+    def aggregate(self, i):
+        tariff = self.tariffs[i]
+        _, energy_codes, demand_codes, all_hours_codes, _ = build_code_tables(tariff)
+        day_type = self.class_day_types[i][self.bucket_class]
+        n_energy, n_demand = len(tariff.energy_layout), len(tariff.demand_layout)
+
+        energy = np.bincount(self.bucket_cycle * n_energy + energy_codes[day_type, self.bucket_minute],
+                             weights=self.bucket_energy, minlength=self.n_cycles * n_energy).reshape(self.n_cycles, n_energy)
+
+        demand = np.zeros(self.n_cycles * n_demand)
+        for codes in (demand_codes[day_type, self.bucket_minute], all_hours_codes[day_type, self.bucket_minute]):
+            in_period = codes >= 0
+            np.maximum.at(demand, self.bucket_cycle[in_period] * n_demand + codes[in_period], self.bucket_demand[in_period])
+        demand = demand.reshape(self.n_cycles, n_demand)
+
+        return energy.astype(np.int64), demand.astype(np.int64), cycle_summer_days(tariff, self.start_dates, self.billing_days)
+
+
+# divides integer arrays rounding half away from zero, the same as fixed_point.round_div on every element
+def round_div_array(numerator, denominator):
+    quotient, remainder = np.abs(numerator) // denominator, np.abs(numerator) % denominator
+    return np.where(numerator < 0, -1, 1) * (quotient + (2 * remainder >= denominator))
+
+
+# returns the integer dtype that holds products of values up to the given magnitudes exactly: int64, or python ints
+# (object arrays) for meters large enough to overflow it
+def product_dtype(*magnitudes):
+    bound = 1
+    for magnitude in magnitudes:
+        bound *= max(1, int(magnitude))
+    return np.int64 if 2 * bound < 2 ** 63 else object
+
+
+# prices per-cycle period values under a tariff the same way as billing.price_line_items and billing.ratchet_demand,
+# every cycle at once: each line item is rounded half up to cents once, then summed
+# (proration_days per cycle, see billing.demand_proration_days)
+# returns (customer, demand, energy) charges per cycle in cents
+def price_cycles(tariff, energy, demand, billing_days, days_summer, days_winter, proration_days):
+    n_cycles = len(billing_days)
+    days_in_season = {'summer': days_summer, 'winter': days_winter}
+    energy_rates, demand_rates = np.array(tariff.energy_rates_fixed, dtype=np.int64), np.array(tariff.demand_rates_fixed, dtype=np.int64)
+
+    # customer charge
+    customer = round_div_array(tariff.customer_rate_fixed * billing_days.astype(np.int64), RATE_SCALE // 100)
+
+    # demand ratchet - at least percent of the highest all hours demand in the previous cycles (before their own ratchet)
+    all_hours = [tariff.demand_index[season][period] for season, period in tariff.all_hours_periods.items() if period]
+    ratchet = np.zeros(n_cycles, dtype=np.int64)
+    if tariff.ratchet_cycles and all_hours and n_cycles > 1:
+        history = demand[:, all_hours].max(axis=1)
+        padded = np.concatenate([np.full(tariff.ratchet_cycles - 1, history[0]), history]) # (history[0] is in every early window anyway)
+        previous_max = np.lib.stride_tricks.sliding_window_view(padded, tariff.ratchet_cycles).max(axis=1)[:-1]
+        ratchet[1:] = round_div_array(previous_max.astype(product_dtype(tariff.ratchet_percent_fixed, np.abs(previous_max).max())) * tariff.ratchet_percent_fixed, RATIO_SCALE)
+    is_all_hours = np.array([period == tariff.all_hours_periods[season] for season, period in tariff.demand_layout])
+    demand = np.where(is_all_hours & (ratchet[:, None] != 0), np.maximum(demand, ratchet[:, None]), demand)
+
+    # demand charge, prorated by the days of the billing cycle in each season
+    season_days = np.stack([days_in_season[season] for season, _ in tariff.demand_layout], axis=1) if tariff.demand_layout else np.zeros((n_cycles, 0), dtype=np.int64)
+    dtype = product_dtype(np.abs(demand_rates).max(initial=0), np.abs(demand).max(initial=0), billing_days.max(initial=0))
+    demand_cents = round_div_array(demand_rates.astype(dtype) * demand.astype(dtype) * season_days.astype(dtype),
+                                   CENT_SCALE * proration_days.astype(dtype)[:, None])
+
+    # energy charge
+    dtype = product_dtype(np.abs(energy_rates).max(initial=0), np.abs(energy).max(initial=0))
+    energy_cents = round_div_array(energy_rates.astype(dtype) * energy.astype(dtype), CENT_SCALE)
+
+    return customer.astype(np.int64), demand_cents.sum(axis=1).astype(np.int64), energy_cents.sum(axis=1).astype(np.int64)
+
+
+# compares tariffs on one interval data file, reading and bucketing the data only once
+# returns (billing cycle keys, tariff names, total charge in cents per [cycle, tariff])
+def compare_tariffs(filename, tariffs):
+    tariffs = [resolve_tariff(tariff) for tariff in tariffs]
+    start_datetimes, usage, demand = load_columns(filename)
+    buckets = IntervalBuckets(*decode_timestamps(start_datetimes), usage, demand, tariffs)
+
+    costs = np.empty((buckets.n_cycles, len(tariffs)), dtype=np.int64)
+    for i, tariff in enumerate(tariffs):
+        energy, demand, days_summer = buckets.aggregate(i)
+        customer, demand_charge, energy_charge = price_cycles(tariff, energy, demand, buckets.billing_days, days_summer,
+                                                              buckets.billing_days - days_summer, buckets.proration_days)
+        costs[:, i] = customer + demand_charge + energy_charge
+
+    return buckets.cycle_keys, [tariff.name for tariff in tariffs], costs
+
+
+# print the cost matrix of billing cycles x tariffs
+def print_comparison(cycle_keys, tariff_names, costs):
+    width = max(14, *(len(name) + 2 for name in tariff_names))
+    print("Cycle".ljust(9) + "".join(name.rjust(width) for name in tariff_names))
+    for key, row in zip(cycle_keys, costs):
+        print(key.ljust(9) + "".join(("$" + format_cents(cents)).rjust(width) for cents in row.tolist()))
+    print("Total".ljust(9) + "".join(("$" + format_cents(cents)).rjust(width) for cents in costs.sum(axis=0).tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the monthly bills of one meter under several tariffs.")
+    parser.add_argument('filename', help="interval data CSV file")
+    parser.add_argument('-t', '--tariff', action='append', help="tariff schedule name or path (repeatable, default: every schedule in tariffs/)")
+    args = parser.parse_args()
+
+    print_comparison(*compare_tariffs(args.filename, args.tariff or available_tariffs()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,577 @@
+import argparse
+import asyncio
+import csv
+import glob
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from fractions import Fraction
+from importlib.util import find_spec
+
+from billing import calculate_monthly_bills
+from fixed_point import QUANTITY_SCALE, parse_quantity, quantity_decimal
+from loadgen import FIELDNAMES, dst_changes, dst_moments
+from output import render_monthly_bills
+from preprocess import read_in_data
+from tariff import in_window, minute_of_day, resolve_tariff
+
+
+########################################################
+
+# differential.py
+
+# contains a differential correctness harness: every
+# alternate engine (columnar, sharded, incremental,
+# cached, streaming, pipeline, tariff comparison,
+# simulator) is run next to the reference path
+# (read_in_data -> parse_data -> calculate_monthly_bills)
+# on the datasets and on generated edge case files, and
+# its bills must match the reference to the cent; the
+# simulator's scenarios are checked against the reference
+# on the file edited the same way, and the throughput of
+# every engine is reported side by side
+
+########################################################
+
+
+# time-of-use window edges (minutes of the day) the generated files put rows and demand peaks on
+EDGE_MINUTES = (9 * 60, 14 * 60, 16 * 60, 21 * 60, 23 * 60)
+
+# test fixtures, kept out of tariffs/ so they are not offered as real schedules
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# tariff schedules checked by default: b19 and a test schedule with holidays, a demand ratchet and a window past midnight
+DEFAULT_TARIFFS = ('b19', os.path.join(FIXTURE_DIR, 'test_holiday_ratchet.json'))
+
+# 'HH:MM' times the generated scenarios' windows start and end at (windows may wrap past midnight)
+SCENARIO_TIMES = ('00:00', '06:00', '09:00', '14:00', '16:00', '21:00', '23:00')
+
+# billing cycle fields compared between the reference and an engine
+CYCLE_FIELDS = ('start_date', 'end_date', 'billing_days', 'days_in_season', 'energy_values', 'demand_values',
+                'customer_cents', 'demand_costs', 'energy_costs', 'demand_cents', 'energy_cents', 'total_cents')
+
+
+# bills the reference path must keep producing under KNOWN_BILLS_TARIFF, as {(dataset, dates whose rows are removed,
+# cycle): (billing days, customer, demand, total charge in cents)}: the last cycles of the datasets end minutes into
+# their start day and are billed one day with the demand charge prorated over the full cycle, and a cycle missing three
+# days of readings is still billed all of its 31 days
+KNOWN_BILLS_TARIFF = 'b19'
+KNOWN_BILLS = {
+    ('datasets/oct2022.csv', (), '11-2022'): (1, 5964, 24013, 30559),
+    ('datasets/mar2024.csv', (), '04-2024'): (1, 5964, 16650, 27228),
+    ('datasets/sept2024.csv', (), '10-2024'): (1, 5964, 14251, 20572),
+    ('datasets/may2025.csv', (), '06-2025'): (1, 5964, 86393, 161546),
+    ('datasets/mar2024.csv', (), '03-2024'): (31, 184869, 1646509, 3150899),
+    ('datasets/mar2024.csv', ('03-10-2024', '03-11-2024', '03-12-2024'), '03-2024'): (31, 184869, 1646509, 3019575),
+}
+
+
+# runs the reference path on a meter file, returns its priced billing cycles
+def reference_bills(filename, tariff):
+    billing_cycles = read_in_data(filename, tariff)
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+# returns the compared fields of a billing cycle
+def cycle_fields(cur_cycle):
+    fields = {}
+    for field in CYCLE_FIELDS:
+        value = getattr(cur_cycle, field)
+        fields[field] = dict(value) if isinstance(value, dict) else list(value) if hasattr(value, '__len__') and not isinstance(value, str) else value
+    return fields
+
+
+# returns a description of the first difference between the reference billing cycles of a file and an engine's
+# ({'mm-yyyy': BillingCycle}, {'mm-yyyy': total cents} for engines that only price totals, or the text of a batch
+# run's bills), None if they match
+def first_difference(expected, actual, filename):
+    if isinstance(actual, str):
+        expected_lines = f"===== Meter: {filename} =====\n{render_monthly_bills(expected)}".splitlines()
+        actual_lines = actual.splitlines()
+        for line, (expected_line, actual_line) in enumerate(zip(expected_lines, actual_lines), 1):
+            if actual_line != expected_line:
+                return f"line {line} {actual_line!r}, expected {expected_line!r}"
+        if len(actual_lines) != len(expected_lines):
+            return f"{len(actual_lines)} lines, expected {len(expected_lines)}"
+        return None
+    if list(actual) != list(expected):
+        return f"billing cycles {list(actual)}, expected {list(expected)}"
+    for key, cur_cycle in expected.items():
+        if isinstance(actual[key], int):
+            if actual[key] != cur_cycle.total_cents:
+                return f"{key} total_cents {actual[key]}, expected {cur_cycle.total_cents}"
+            continue
+        actual_fields = cycle_fields(actual[key])
+        for field, value in cycle_fields(cur_cycle).items():
+            if actual_fields[field] != value:
+                return f"{key} {field} {actual_fields[field]}, expected {value}"
+    return None
+
+
+# the engines compared to the reference: name : (prepare, read, needs numpy)
+# prepare(filename, tariff, workdir) does the untimed setup (e.g. converting or warming a cache) and returns
+# (source, file the reference bills to compare with); read(source, tariff) bills the source, timed, into
+# {'mm-yyyy': BillingCycle}, {'mm-yyyy': total cents} or bills text (see first_difference)
+
+def prepare_csv(filename, tariff, workdir):
+    return filename, filename
+
+
+def read_vectorized(filename, tariff):
+    from vectorized import read_in_data_vectorized
+    billing_cycles = read_in_data_vectorized(filename, tariff)
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+def prepare_columnar(filename, tariff, workdir):
+    from columnar import convert_csv
+    return convert_csv(filename, os.path.join(workdir, 'meter.ebc')), filename
+
+
+# read_in_data memory-maps .ebc files
+def read_columnar(filename, tariff):
+    return reference_bills(filename, tariff)
+
+
+def read_sharded(filename, tariff):
+    from sharded import read_in_data_sharded
+    billing_cycles = read_in_data_sharded(filename, tariff, workers=1, shards=7, min_shard_size=1) # small ranges, to test merging
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+# the first half of the file is billed and checkpointed (its last row without a line break, so it is billed but
+# not checkpointed), then the rest is appended
+def prepare_incremental(filename, tariff, workdir):
+    from incremental import read_in_data_incremental
+    with open(filename, 'rb') as file:
+        data = file.read()
+    cut = data.find(b'\n', len(data) // 2)
+    cut = len(data) if cut < 0 else cut - (data[cut - 1:cut] == b'\r')
+    copy = os.path.join(workdir, 'incremental.csv')
+    with open(copy, 'wb') as file:
+        file.write(data[:cut])
+    read_in_data_incremental(copy, copy + '.checkpoint', tariff) # kept in the work directory, not the user's cache
+    with open(copy, 'ab') as file:
+        file.write(data[cut:])
+    return copy, filename
+
+
+def read_incremental(filename, tariff):
+    from incremental import read_in_data_incremental
+    billing_cycles = read_in_data_incremental(filename, filename + '.checkpoint', tariff)
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+# the timed read is a cache hit
+def prepare_cache(filename, tariff, workdir):
+    from cache import cached_read_in_data
+    cached_read_in_data(filename, tariff, cache_dir=workdir)
+    return (filename, workdir), filename
+
+
+def read_cache(source, tariff):
+    from cache import cached_read_in_data
+    filename, cache_dir = source
+    billing_cycles = cached_read_in_data(filename, tariff, cache_dir=cache_dir)
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+def read_streaming(filename, tariff):
+    from preprocess import stream_in_data
+    billing_cycles = {cur_cycle.start_date[0:2] + '-' + cur_cycle.start_date[6:10]: cur_cycle for cur_cycle in stream_in_data(filename, tariff)}
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+def read_rollups(filename, tariff):
+    from preprocess import read_in_data_with_rollups
+    billing_cycles, _ = read_in_data_with_rollups(filename, tariff)
+    calculate_monthly_bills(billing_cycles, tariff)
+    return billing_cycles
+
+
+# bills the file through the asyncio pipeline (with a worker process), returns the text it writes
+def read_pipeline(filename, tariff):
+    from pipeline import run_pipeline
+    output, errors = io.StringIO(), io.StringIO()
+    failed, _, _ = asyncio.run(run_pipeline([filename], output, errors, tariff, readers=1, parsers=1, pricers=1))
+    if failed:
+        raise ValueError(errors.getvalue().strip())
+    return output.getvalue()
+
+
+def read_compare(filename, tariff):
+    from compare import compare_tariffs
+    keys, _, costs = compare_tariffs(filename, [tariff])
+    return dict(zip(keys, costs[:, 0].tolist()))
+
+
+def read_simulate(filename, tariff):
+    from simulate import LoadProfile
+    profile = LoadProfile(filename, tariff)
+    return dict(zip(profile.cycle_keys, profile.baseline().tolist()))
+
+
+# writes the file edited by one of a batch of seeded scenarios, the reference bills the edited file
+def prepare_scenarios(filename, tariff, workdir):
+    scenarios = scenarios_for(filename)
+    checked = random.Random(filename).randrange(len(scenarios))
+    edited = os.path.join(workdir, 'edited.csv')
+    write_edited(filename, edited, scenarios[checked], tariff)
+    return (filename, scenarios, checked), edited
+
+
+# bills the whole batch of scenarios, returns the checked scenario's totals
+def read_scenarios(source, tariff):
+    from simulate import LoadProfile
+    filename, scenarios, checked = source
+    profile = LoadProfile(filename, tariff)
+    return dict(zip(profile.cycle_keys, profile.simulate(scenarios)[checked].tolist()))
+
+
+ENGINES = {
+    'vectorized': (prepare_csv, read_vectorized, True),
+    'columnar': (prepare_columnar, read_columnar, True),
+    'sharded': (prepare_csv, read_sharded, False),
+    'incremental': (prepare_incremental, read_incremental, False),
+    'cache': (prepare_cache, read_cache, False),
+    'streaming': (prepare_csv, read_streaming, False),
+    'rollups': (prepare_csv, read_rollups, False),
+    'pipeline': (prepare_csv, read_pipeline, False),
+    'compare': (prepare_csv, read_compare, True),
+    'simulate': (prepare_csv, read_simulate, True),
+    'scenarios': (prepare_scenarios, read_scenarios, True),
+}
+
+
+# returns a seeded batch of scenarios (caps, load shifts and battery dispatch) sized to a meter file's peak demand
+def scenarios_for(filename):
+    from simulate import Cap, Shift, battery
+
+    rng = random.Random(os.path.basename(filename))
+    with open(filename, newline='') as file:
+        peak = max((parse_quantity(row['Peak Demand']) for row in csv.DictReader(file)), default=0) / QUANTITY_SCALE
+
+    def kw(low, high):
+        return round(peak * rng.uniform(low, high), 3)
+
+    def window():
+        return tuple(rng.sample(SCENARIO_TIMES, 2))
+
+    def season():
+        return rng.choice((None, None, 'summer', 'winter'))
+
+    scenarios = []
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.choice(('cap', 'shift', 'battery'))
+        if kind == 'cap':
+            scenarios.append(Cap(kw(0.2, 1.1), season()))
+        elif kind == 'shift':
+            scenarios.append(Shift(kw(0.05, 0.8), *window(), *window(), season(), above_kw=rng.choice((0, kw(0.1, 0.7))),
+                                   max_kwh=rng.choice((None, kw(0.1, 3))), efficiency=rng.choice((1.0, 0.9, 1.25))))
+        else:
+            scenarios.append(battery(kw(0.05, 0.5), kw(0.1, 2), window(), window(), above_kw=rng.choice((0, kw(0.2, 0.8))),
+                                     efficiency=rng.choice((0.8, 0.9, 1.0)), season=season()))
+    return scenarios
+
+
+# writes a meter file with a scenario applied to its rows, computed row by row in exact arithmetic independently of
+# simulate.py: a load change of delta kW over an interval of the file's most common length changes the row's demand
+# by delta and its usage by delta x the interval in hours, each rounded to whole millionths (half to even)
+def write_edited(filename, edited, scenario, tariff):
+    from simulate import Cap
+
+    with open(filename, newline='') as file:
+        reader = csv.DictReader(file)
+        fieldnames, rows = reader.fieldnames, list(reader)
+    usage = [parse_quantity(row['Usage'] or '') for row in rows]
+    demand = [parse_quantity(row['Peak Demand'] or '') for row in rows]
+    minutes = [minute_of_day(row['Start Date Time'][11:]) for row in rows]
+    steps = Counter(b - a for a, b in zip(minutes, minutes[1:]) if b > a)
+    interval = min(steps, key=lambda step: (-steps[step], step)) if steps else 60
+
+    def applies(row):
+        if scenario.season is None:
+            return True
+        start_datetime = row['Start Date Time']
+        month, date, year = int(start_datetime[0:2]), int(start_datetime[3:5]), int(start_datetime[6:10])
+        return tariff.classify(month, date, start_datetime[11:], year)[0] == scenario.season
+
+    def scaled(kw):
+        return Fraction(kw) * QUANTITY_SCALE
+
+    energy = [Fraction(0)] * len(rows) # load change x interval minutes, in millionths of kW minutes
+    if isinstance(scenario, Cap):
+        for i, row in enumerate(rows):
+            if applies(row):
+                energy[i] = -max(demand[i] - scaled(scenario.kw), 0) * interval
+    else:
+        start, end = minute_of_day(scenario.start), minute_of_day(scenario.end)
+        to_start, to_end = minute_of_day(scenario.to_start), minute_of_day(scenario.to_end)
+        days = {}
+        for i, row in enumerate(rows):
+            days.setdefault(row['Start Date Time'][:10], []).append(i)
+        for day_rows in days.values():
+            targets = [i for i in day_rows if applies(rows[i]) and in_window(minutes[i], to_start, to_end)]
+            if not targets:
+                continue
+            moved_total = 0
+            limit = None if scenario.max_kwh is None else scaled(scenario.max_kwh) * 60
+            for i in day_rows:
+                if applies(rows[i]) and in_window(minutes[i], start, end):
+                    moved = min(max(demand[i] - scaled(scenario.above_kw), 0), scaled(scenario.kw)) * interval
+                    if limit is not None:
+                        moved = min(moved, max(limit - moved_total, 0))
+                    moved_total += moved
+                    energy[i] -= moved
+            for i in targets:
+                energy[i] += moved_total * Fraction(scenario.efficiency) / len(targets)
+
+    with open(edited, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames, lineterminator='\r\n')
+        writer.writeheader()
+        for i, row in enumerate(rows):
+            if energy[i]:
+                row['Usage'] = str(quantity_decimal(round(usage[i] + energy[i] / 60)))
+                row['Peak Demand'] = str(quantity_decimal(round(demand[i] + energy[i] / interval)))
+            writer.writerow(row)
+
+
+# results of one engine over all checked files
+class EngineResults:
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.cycles = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.mismatches = [] # (file, description of the first difference)
+
+    # returns the rows billed per second
+    def throughput(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+# writes a generated interval data file covering the cases engines are most likely to get wrong:
+# cycles across the season changes (May -> June, September -> October), the ends of months and years,
+# rows and demand peaks on the time-of-use window edges, off-grid intervals, missing usage and demand values,
+# one column with more decimals than the other (columnar files store both columns as float64 then),
+# missing intervals and days and daylight saving time repeated and skipped hours
+# returns the number of rows (the same seed always writes the same file)
+def write_case(filename, seed):
+    rng = random.Random(seed)
+    year = rng.choice((2022, 2023, 2024))
+    month = rng.choice((4, 5, 5, 8, 9, 9, 12, 1, 2))
+    first = datetime(year, month, 1)
+    days_in_month = ((first + timedelta(days=32)).replace(day=1) - first).days
+    start = first.replace(day=rng.randint(1, days_in_month)) + timedelta(minutes=rng.choice((0, 0, rng.randrange(24 * 60))))
+    interval = rng.choice((5, 15, 15, 30, 60))
+    start -= timedelta(minutes=start.minute % interval - (rng.randrange(interval) if rng.random() < 0.2 else 0)) # mostly on the grid
+    end = start + timedelta(days=rng.choice((1, rng.randint(2, 40), rng.randint(30, 80))))
+    dst = rng.random() < 0.3
+    if dst and rng.random() < 0.5: # move the case to start a few days before a clock change (whole days keep the grid)
+        change = rng.choice(dst_changes(start.year))[0]
+        shift = timedelta(days=(change.date() - start.date()).days - rng.randint(1, 3))
+        start, end = start + shift, end + shift
+
+    gap_rate = rng.choice((0, 0, 0.01, 0.2))
+    blank_rate = rng.choice((0, 0, 0.02, 0.2))
+    dropped_days = {start.date() + timedelta(days=rng.randrange((end - start).days + 1)) for _ in range(rng.choice((0, 0, 3)))}
+    dropped_days.discard(start.date())
+    decimals = rng.choice((0, 1, 2, 3, 6))
+    precise_column = rng.choice((None, None, None, None, 'usage', 'demand')) # values with more than 6 decimals in one column
+    base_load = rng.choice((0.0, 5.0, 250.0, 5000.0))
+
+    # the rows on the grid, plus rows just before, on and after window edges (sorted in with the others)
+    moments = []
+    moment = start
+    while moment < end:
+        moments.append(moment)
+        moment += timedelta(minutes=interval)
+    if rng.random() < 0.4:
+        for _ in range(rng.randint(1, 20)):
+            day = start.replace(hour=0, minute=0) + timedelta(days=rng.randrange((end - start).days + 1))
+            for offset in (-1, 0, 1):
+                edge = day + timedelta(minutes=rng.choice(EDGE_MINUTES) + offset)
+                if start <= edge < end:
+                    moments.append(edge)
+        moments.sort()
+    if dst:
+        moments = list(dst_moments(moments))
+
+    def value(kw, column):
+        if rng.random() < blank_rate:
+            return ''
+        if column == precise_column: # digits past the millionths, clear of a rounding tie
+            return f"{round(kw, 6):.6f}{rng.choice(('1', '27', '123', '999'))}"
+        return f"{round(kw, decimals):.{decimals}f}"
+
+    rows = 0
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator='\r\n')
+        writer.writerow(FIELDNAMES)
+        for moment in moments:
+            if rows and (moment.date() in dropped_days or rng.random() < gap_rate):
+                continue
+            demand = base_load * rng.uniform(0.2, 1.0)
+            minute = moment.hour * 60 + moment.minute
+            if any(minute == edge or minute + interval == edge for edge in EDGE_MINUTES) and rng.random() < 0.3:
+                demand *= 3 # a peak right on (or right before) a window edge
+            usage = demand * interval / 60 if rng.random() < 0.9 else rng.uniform(0, base_load)
+            writer.writerow([moment.strftime("%m-%d-%Y %H:%M"), (moment + timedelta(minutes=interval)).strftime("%m-%d-%Y %H:%M"),
+                             value(usage, 'usage'), 'KWH', '60.0', 'FAHRENHEIT', value(demand, 'demand'), 'KW'])
+            rows += 1
+    return rows
+
+
+# returns the number of rows of a meter file
+def count_rows(filename):
+    with open(filename, 'rb') as file:
+        return max(0, sum(1 for line in file if line.strip()) - 1)
+
+
+# bills a meter file with the reference path and every engine, recording matches, mismatches and timings
+def check_file(filename, tariff, engines, results, workdir):
+    rows = count_rows(filename)
+    start = time.perf_counter()
+    expected = reference_bills(filename, tariff)
+    reference = results['reference']
+    reference.seconds += time.perf_counter() - start
+    reference.files, reference.cycles, reference.rows = reference.files + 1, reference.cycles + len(expected), reference.rows + rows
+
+    for name, (prepare, read, _) in engines.items():
+        engine_dir = tempfile.mkdtemp(prefix=name + '-', dir=workdir)
+        engine = results[name]
+        try:
+            source, reference_filename = prepare(filename, tariff, engine_dir)
+            start = time.perf_counter()
+            actual = read(source, tariff)
+            engine.seconds += time.perf_counter() - start
+            engine_expected = expected if reference_filename == filename else reference_bills(reference_filename, tariff)
+            difference = first_difference(engine_expected, actual, filename)
+        except Exception as e: # an engine that fails where the reference does not is a mismatch
+            difference = f"{type(e).__name__}: {e}"
+        finally:
+            shutil.rmtree(engine_dir, ignore_errors=True)
+        engine.files, engine.cycles, engine.rows = engine.files + 1, engine.cycles + len(expected), engine.rows + rows
+        if difference:
+            engine.mismatches.append((filename, difference))
+
+
+# checks the reference path against KNOWN_BILLS, returns [(file, description of the difference)]
+def check_known_bills(workdir):
+    here = os.path.dirname(os.path.abspath(__file__))
+    differences = []
+    for (dataset, removed_dates, key), expected in KNOWN_BILLS.items():
+        filename = os.path.join(here, dataset)
+        if removed_dates:
+            gapped = os.path.join(workdir, 'gapped-' + os.path.basename(dataset))
+            with open(filename, newline='') as source, open(gapped, 'w', newline='') as target:
+                target.writelines(line for line in source if not line.startswith(removed_dates))
+            filename = gapped
+
+        cur_cycle = reference_bills(filename, KNOWN_BILLS_TARIFF)[key]
+        actual = (cur_cycle.billing_days, cur_cycle.customer_cents, cur_cycle.demand_cents, cur_cycle.total_cents)
+        if actual != expected:
+            without = f" without {', '.join(removed_dates)}" if removed_dates else ''
+            differences.append((dataset, f"{key}{without}: (billing days, customer, demand, total cents) {actual}, expected {expected}"))
+    return differences
+
+
+# checks the reference path against KNOWN_BILLS, then every engine against the reference on the meter files and on
+# generated cases seed .. seed + cases - 1
+# generated cases are written to keep_dir when given, otherwise only the ones with mismatches are copied to failures_dir
+# returns {name: EngineResults} with the reference first
+def run_differential(filenames, tariffs, engine_names, cases=100, seed=0, keep_dir=None, failures_dir='differential_failures', progress=None):
+    engines = {name: ENGINES[name] for name in engine_names}
+    results = {name: EngineResults(name) for name in ('reference', *engines)}
+    if keep_dir:
+        os.makedirs(keep_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix='differential-') as workdir:
+        results['reference'].mismatches.extend(check_known_bills(workdir))
+        if progress:
+            print("  known bills: checked", file=progress)
+
+        inputs = [(filename, None) for filename in filenames]
+        inputs += [(os.path.join(keep_dir or workdir, f"case-{case_seed}.csv"), case_seed) for case_seed in range(seed, seed + cases)]
+
+        for filename, case_seed in inputs:
+            if case_seed is not None:
+                write_case(filename, case_seed)
+            mismatches = sum(len(engine.mismatches) for engine in results.values())
+            for tariff in tariffs:
+                check_file(filename, tariff, engines, results, workdir)
+
+            if case_seed is None:
+                if progress:
+                    print(f"  {filename}: checked", file=progress)
+            elif not keep_dir and sum(len(engine.mismatches) for engine in results.values()) > mismatches:
+                os.makedirs(failures_dir, exist_ok=True)
+                kept = shutil.copy(filename, failures_dir)
+                for engine in results.values():
+                    engine.mismatches = [(kept if mismatch_file == filename else mismatch_file, difference) for mismatch_file, difference in engine.mismatches]
+
+    return results
+
+
+# prints the matches, mismatches and throughput of every engine, returns the number of mismatches
+def print_results(results, output=sys.stdout):
+    reference = results['reference']
+    print(f"{'engine':<12} {'checks':>6} {'cycles':>7} {'mismatches':>10} {'rows/s':>12} {'vs reference':>13}", file=output)
+    for engine in results.values():
+        speedup = engine.throughput() / reference.throughput() if reference.throughput() else 0.0
+        print(f"{engine.name:<12} {engine.files:>6} {engine.cycles:>7} {len(engine.mismatches):>10} {engine.throughput():>12,.0f} "
+              f"{speedup:>12.2f}x", file=output)
+
+    mismatches = 0
+    for engine in results.values():
+        for filename, difference in engine.mismatches[:10]:
+            print(f"MISMATCH {engine.name}: {filename}: {difference}", file=output)
+        mismatches += len(engine.mismatches)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every fast engine against the reference path, to the cent, "
+                                                 "on meter files and generated edge cases.")
+    parser.add_argument('paths', nargs='*', default=['datasets/*.csv'], help="meter CSV files or glob patterns (default: datasets/*.csv)")
+    parser.add_argument('--cases', type=int, default=100, help="generated edge case files (default: 100)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first generated case (default: 0)")
+    parser.add_argument('--engines', default=','.join(ENGINES), help=f"comma separated engines to check (default: {','.join(ENGINES)})")
+    parser.add_argument('--keep', metavar='DIR', help="write the generated cases to DIR (by default only cases with mismatches "
+                                                      "are kept, in differential_failures/)")
+    parser.add_argument('-t', '--tariff', action='append', default=None,
+                        help=f"tariff schedule name or path, repeatable (default: {', '.join(DEFAULT_TARIFFS)})")
+    args = parser.parse_args()
+
+    engine_names = [name.strip() for name in args.engines.split(',') if name.strip()]
+    unknown = [name for name in engine_names if name not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engine(s) {', '.join(unknown)} (available: {', '.join(ENGINES)})")
+    if find_spec('numpy') is None:
+        skipped = [name for name in engine_names if ENGINES[name][2]]
+        if skipped:
+            print(f"Skipping {', '.join(skipped)} (requires numpy)", file=sys.stderr)
+        engine_names = [name for name in engine_names if not ENGINES[name][2]]
+
+    filenames = sorted({filename for path in args.paths for filename in glob.glob(path)})
+    tariffs = [resolve_tariff(tariff) for tariff in args.tariff or DEFAULT_TARIFFS]
+    results = run_differential(filenames, tariffs, engine_names, args.cases, args.seed, args.keep, progress=sys.stderr)
+    mismatches = print_results(results)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from batch import find_meter_files
+from billing import calculate_monthly_bills
+from cache import cached_read_in_data
+from fixed_point import QUANTITY_SCALE, format_fixed
+from preprocess import read_in_data
+from tariff import resolve_tariff
+
+
+########################################################
+
+# export.py
+
+# contains the bulk exporters that write the bills of many
+# meters as machine-readable tables: one row per billing
+# cycle and one row per line item, as CSV, JSON Lines or
+# Parquet (requires pyarrow)
+
+########################################################
+
+
+# table columns as (name, kind), kinds are text, int, cents, quantity (millionths) and rate (micro-dollars)
+CYCLE_COLUMNS = (('meter', 'text'), ('cycle', 'text'), ('start_date', 'text'), ('end_date', 'text'), ('billing_days', 'int'),
+                 ('summer_days', 'int'), ('winter_days', 'int'), ('customer_charge', 'cents'), ('demand_charge', 'cents'),
+                 ('energy_charge', 'cents'), ('total_charge', 'cents'))
+LINE_ITEM_COLUMNS = (('meter', 'text'), ('cycle', 'text'), ('charge', 'text'), ('season', 'text'), ('period', 'text'),
+                     ('quantity', 'quantity'), ('unit', 'text'), ('rate', 'rate'), ('cost', 'cents'))
+
+# decimal places of the fixed-point kinds
+DECIMALS = {'cents': 2, 'quantity': 6, 'rate': 6}
+
+# file extension of each export format
+EXTENSIONS = {'csv': '.csv', 'jsonl': '.jsonl', 'parquet': '.parquet'}
+
+
+# returns the billing cycle rows and line item rows of a priced meter (fixed-point values are left as integers)
+def bill_rows(meter, billing_cycles, tariff=None):
+    tariff = resolve_tariff(tariff)
+    cycles, line_items = [], []
+    for key, cur_cycle in billing_cycles.items():
+        cycles.append((meter, key, cur_cycle.start_date, cur_cycle.end_date, cur_cycle.billing_days, cur_cycle.days_in_season['summer'],
+                       cur_cycle.days_in_season['winter'], cur_cycle.customer_cents, cur_cycle.demand_cents, cur_cycle.energy_cents,
+                       cur_cycle.total_cents))
+
+        line_items.append((meter, key, 'customer', None, None, cur_cycle.billing_days * QUANTITY_SCALE, 'day', tariff.customer_rate_fixed,
+                           cur_cycle.customer_cents))
+        for code, (season, period) in enumerate(tariff.demand_layout):
+            line_items.append((meter, key, 'demand', season, period, cur_cycle.demand_values[code], 'kW', tariff.demand_rates_fixed[code],
+                               cur_cycle.demand_costs[code]))
+        for code, (season, period) in enumerate(tariff.energy_layout):
+            line_items.append((meter, key, 'energy', season, period, cur_cycle.energy_values[code], 'kWh', tariff.energy_rates_fixed[code],
+                               cur_cycle.energy_costs[code]))
+    return cycles, line_items
+
+
+# reads in and bills a single meter file, returning its rows (runs in a worker process)
+# returns (filename, cycle rows, line item rows, error message)
+def meter_bill_rows(filename, use_cache=True, tariff=None):
+    try:
+        billing_cycles = cached_read_in_data(filename, tariff) if use_cache else read_in_data(filename, tariff)
+        calculate_monthly_bills(billing_cycles, tariff)
+        meter = os.path.splitext(os.path.basename(filename))[0]
+        return (filename, *bill_rows(meter, billing_cycles, tariff), None)
+
+    except Exception as e: # a bad file is reported instead of stopping the run
+        return filename, None, None, f"{type(e).__name__}: {e}"
+
+
+# returns a function converting a row's values to text, fixed-point values as exact decimals
+def text_converter(columns):
+    kinds = [kind for _, kind in columns]
+
+    def convert(row):
+        return [format_fixed(value, DECIMALS[kind], grouping=False) if kind in DECIMALS and value is not None else value
+                for kind, value in zip(kinds, row)]
+    return convert
+
+
+# writes rows to a csv file
+class CsvTableWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='', buffering=1024 * 1024)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+        self.convert = text_converter(columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows(map(self.convert, rows))
+
+    def close(self):
+        self.file.close()
+
+
+# writes rows to a json lines file, fixed-point values as decimal strings
+class JsonLinesTableWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', buffering=1024 * 1024)
+        self.names = [name for name, _ in columns]
+        self.convert = text_converter(columns)
+
+    def write_rows(self, rows):
+        self.file.write(''.join(json.dumps(dict(zip(self.names, self.convert(row)))) + '\n' for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+# writes rows to a parquet file in row groups, fixed-point values as exact decimal columns
+class ParquetTableWriter:
+    ROW_GROUP_SIZE = 64 * 1024
+
+    def __init__(self, path, columns):
+        import pyarrow as pa # pyarrow is only needed for parquet exports
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.columns = columns
+        types = {'text': pa.string(), 'int': pa.int64(), **{kind: pa.decimal128(19, decimals) for kind, decimals in DECIMALS.items()}}
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.ROW_GROUP_SIZE:
+            self.flush()
+
+    # converts buffered rows into columns and writes them as one row group
+    def flush(self):
+        import pyarrow.compute as pc
+
+        pa = self.pa
+        arrays = []
+        for (name, kind), values in zip(self.columns, zip(*self.rows)):
+            if kind in DECIMALS:
+                # scale the integers into decimals without going through Decimal objects
+                decimals = DECIMALS[kind]
+                column = pa.array(values, pa.int64()).cast(pa.decimal128(19, 0))
+                column = pc.multiply(column, pa.scalar(Decimal(1).scaleb(-decimals), pa.decimal128(decimals + 1, decimals)))
+                arrays.append(column.cast(pa.decimal128(19, decimals)))
+            else:
+                arrays.append(pa.array(values, self.schema.field(name).type))
+        if arrays:
+            self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+# table writer of each export format
+TABLE_WRITERS = {'csv': CsvTableWriter, 'jsonl': JsonLinesTableWriter, 'parquet': ParquetTableWriter}
+
+
+# bills every meter file in a process pool and exports all billing cycles and line items
+# to cycles.<ext> and line_items.<ext> in the output directory
+# returns the number of files that could not be billed
+def export_bills(paths, output_dir, export_format='csv', workers=None, errors=sys.stderr, use_cache=True, tariff=None):
+    filenames = find_meter_files(paths)
+    os.makedirs(output_dir, exist_ok=True)
+    writer_class = TABLE_WRITERS[export_format]
+    cycle_writer = writer_class(os.path.join(output_dir, 'cycles' + EXTENSIONS[export_format]), CYCLE_COLUMNS)
+    line_item_writer = writer_class(os.path.join(output_dir, 'line_items' + EXTENSIONS[export_format]), LINE_ITEM_COLUMNS)
+    failed = 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for filename, cycles, line_items, error in executor.map(meter_bill_rows, filenames, [use_cache] * len(filenames),
+                                                                    [tariff] * len(filenames)):
+                if error:
+                    failed += 1
+                    print(f"Could not bill {filename}: {error}", file=errors)
+                    continue
+                cycle_writer.write_rows(cycles)
+                line_item_writer.write_rows(line_items)
+    finally:
+        cycle_writer.close()
+        line_item_writer.close()
+
+    print(f"Exported {len(filenames) - failed} of {len(filenames)} meter file(s) to {output_dir}", file=errors)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the bills of many meter files as CSV, JSON Lines or Parquet tables.")
+    parser.add_argument('paths', nargs='+', help="directories or glob patterns of meter CSV files (e.g. datasets/)")
+    parser.add_argument('-o', '--output-dir', default='exports', help="directory to write cycles.* and line_items.* to (default: exports)")
+    parser.add_argument('-f', '--format', choices=sorted(TABLE_WRITERS), default='csv', help="export format (default: csv)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--no-cache', action='store_true', help="always parse the csv files instead of reusing cached results")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    failed = export_bills(args.paths, args.output_dir, args.format, args.workers, use_cache=not args.no_cache, tariff=args.tariff)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
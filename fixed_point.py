@@ -0,0 +1,69 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+
+########################################################
+
+# fixed_point.py
+
+# contains the integer fixed-point units used for billing:
+# energy (kWh) and demand (kW) are counted in millionths,
+# rates in micro-dollars and charges in whole cents
+
+########################################################
+
+
+# millionths of a kWh / kW per kWh / kW, and micro-dollars per dollar
+QUANTITY_SCALE = 10 ** 6
+RATE_SCALE = 10 ** 6
+
+# millionths of a ratio (e.g. a demand ratchet percent of 0.75)
+RATIO_SCALE = 10 ** 6
+
+# quantity * rate is in 1e-12 dollars, this many of them make a cent
+CENT_SCALE = QUANTITY_SCALE * RATE_SCALE // 100
+
+
+# converts a numeric string (e.g. a csv Usage or Peak Demand value) into millionths, empty values are 0
+# (exact for values with up to 6 decimal places below 2e9 kWh, and the same rounding as vectorized.to_quantities)
+def parse_quantity(text):
+    return round(float(text) * QUANTITY_SCALE) if text else 0
+
+
+# converts a Decimal, string or int into an integer number of 1 / scale units, rounding half up
+def to_fixed(value, scale):
+    return int((Decimal(value) * scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+# converts millionths back into a Decimal quantity (for display)
+def quantity_decimal(quantity):
+    return Decimal(quantity).scaleb(-6)
+
+
+# converts cents back into a Decimal dollar amount (for display)
+def cents_decimal(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+# divides integers rounding half away from zero (like ROUND_HALF_UP), denominator must be positive
+def round_div(numerator, denominator):
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+# formats an integer number of 1 / 10 ** decimals units as a decimal, e.g. (123456, 2) -> '1,234.56' ('1234.56' without grouping)
+# (the same text as formatting the equivalent Decimal with ',.Nf' / '.Nf')
+def format_fixed(value, decimals, grouping=True):
+    whole, fraction = divmod(abs(value), 10 ** decimals)
+    return f"{'-' if value < 0 else ''}{whole:{',' if grouping else ''}}.{fraction:0{decimals}d}"
+
+
+# formats cents as a dollar amount without the dollar sign
+def format_cents(cents, grouping=True):
+    return format_fixed(cents, 2, grouping)
+
+
+# formats millionths of a kWh / kW as a quantity
+def format_quantity(quantity, grouping=True):
+    return format_fixed(quantity, 6, grouping)
@@ -0,0 +1,137 @@
+import csv
+import hashlib
+import os
+import pickle
+from itertools import chain
+
+from billing_cycle import ParseState
+from cache import private_state_path
+from preprocess import iter_billing_cycles
+from tariff import resolve_tariff
+
+
+########################################################
+
+# incremental.py
+
+# contains incremental billing for growing meter files:
+# a checkpoint of the parser state lets later runs read
+# only the rows appended since the previous run
+
+########################################################
+
+
+# bump when the checkpoint contents change
+CHECKPOINT_VERSION = 6
+
+# number of bytes before the checkpoint offset used to detect rewritten files
+TAIL_CHECK_SIZE = 4096
+
+
+# hashes the bytes of a file just before the given offset
+def tail_hash(file, offset):
+    start = max(0, offset - TAIL_CHECK_SIZE)
+    file.seek(start)
+    return hashlib.blake2b(file.read(offset - start), digest_size=16).hexdigest()
+
+
+# yields decoded complete lines from a binary file, keeping position[0] at the byte offset after the last one
+# (an unterminated last line may still be being written, so it is set aside in unterminated instead)
+def complete_lines(file, position, unterminated):
+    for line in file:
+        if not line.endswith(b'\n'):
+            unterminated.append(line.decode())
+            break
+        position[0] += len(line)
+        yield line.decode()
+
+
+# loads a checkpoint if it is still valid for the file, otherwise returns None
+def load_checkpoint(checkpoint_path, file, tariff):
+    try:
+        with open(checkpoint_path, 'rb') as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, AttributeError, TypeError): # missing or from an older version
+        return None
+    if not isinstance(checkpoint, dict):
+        return None
+
+    # the file must still start with the rows that were already billed
+    file_size = os.fstat(file.fileno()).st_size
+    if (checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint['tariff'] != tariff.fingerprint or file_size < checkpoint['offset']
+            or tail_hash(file, checkpoint['offset']) != checkpoint['tail_hash']):
+        return None
+    return checkpoint
+
+
+# writes a checkpoint atomically
+def save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = f"{checkpoint_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, checkpoint_path)
+
+
+# open and read in only the new rows of a csv file since the last checkpoint, then update the billing cycles
+# gives the same billing cycles as preprocess.read_in_data on the whole file
+# (the checkpoint is kept in the cache's private state directory unless a checkpoint_path is given, see
+# cache.private_state_path)
+def read_in_data_incremental(filename, checkpoint_path=None, tariff=None):
+    checkpoint_path = checkpoint_path or private_state_path(filename, '.checkpoint')
+    tariff = resolve_tariff(tariff)
+
+    with open(filename, 'rb') as file:
+        checkpoint = load_checkpoint(checkpoint_path, file, tariff)
+
+        if checkpoint:
+            # resume after the last billed row
+            header, state, billing_cycles = checkpoint['header'], checkpoint['state'], checkpoint['billing_cycles']
+            position = [checkpoint['offset']]
+            file.seek(position[0])
+        else:
+            # no valid checkpoint - parse the whole file
+            header_line = file.readline()
+            if not header_line.endswith(b'\n'):
+                return {}
+            header, state, billing_cycles = next(csv.reader([header_line.decode()])), None, {}
+            position = [len(header_line)]
+
+        unterminated = []
+        reader = csv.DictReader(complete_lines(file, position, unterminated), fieldnames=header)
+
+        if state is None:
+            # "peak" the first row to find the start day of every billing cycle
+            first_row = next(reader, None)
+            if first_row is not None:
+                state = ParseState(int(first_row['Start Date Time'][3:5]))
+                reader = chain([first_row], reader)
+
+        if state is not None:
+            # only the open billing cycle and the ones started by new rows are updated
+            update_billing_cycles(billing_cycles, reader, state, tariff)
+
+            # save checkpoint before the billing cycles are priced
+            save_checkpoint(checkpoint_path, {
+                'version': CHECKPOINT_VERSION,
+                'tariff': tariff.fingerprint,
+                'offset': position[0],
+                'tail_hash': tail_hash(file, position[0]),
+                'header': header,
+                'state': state,
+                'billing_cycles': billing_cycles
+            })
+
+        # the unterminated last line is billed in this run but left out of the checkpoint
+        if unterminated:
+            row = next(csv.DictReader(unterminated, fieldnames=header))
+            state = state or ParseState(int(row['Start Date Time'][3:5]))
+            update_billing_cycles(billing_cycles, [row], state, tariff)
+
+    return billing_cycles
+
+
+# parses rows on top of the parser state and stores the updated billing cycles by month
+def update_billing_cycles(billing_cycles, reader, state, tariff):
+    for cur_billing_cycle in iter_billing_cycles(reader, state.start_of_month, state, tariff):
+        key = (cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10])
+        billing_cycles[key] = cur_billing_cycle
@@ -0,0 +1,249 @@
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+
+########################################################
+
+# instrumentation.py
+
+# contains the opt-in metrics of the billing pipeline:
+# stage timers, rows/sec, per billing cycle timing and
+# allocations, Prometheus text export and the --profile
+# cProfile / tracemalloc snapshots (nothing is measured
+# unless metrics are enabled)
+
+########################################################
+
+
+# prefix of every exported metric name
+METRIC_PREFIX = 'electricity_bill'
+
+# the metrics being collected, or None when instrumentation is off
+# (hot paths read this once per call and only wrap their work when it is set)
+active = None
+
+
+# accumulated time of a pipeline stage (stages nest, e.g. parse includes csv_decode and classify)
+class StageTimer:
+    __slots__ = ('seconds', 'calls', 'rows')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0 # csv rows read while the stage was running
+
+
+# timing and allocations of one parsed billing cycle
+class CycleRecord:
+    __slots__ = ('key', 'seconds', 'rows', 'allocated_bytes', 'peak_bytes')
+
+    def __init__(self, key, seconds, rows, allocated_bytes, peak_bytes):
+        self.key = key
+        self.seconds = seconds
+        self.rows = rows
+        self.allocated_bytes = allocated_bytes # traced memory still held at the end of the cycle (None unless tracked)
+        self.peak_bytes = peak_bytes # highest traced memory while the cycle was parsed, above its start (None unless tracked)
+
+
+# stores the metrics collected during a run
+class Metrics:
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+        self.stages = {} # stage name : StageTimer
+        self.counters = {} # counter name : count
+        self.cycles = [] # CycleRecord of each parsed billing cycle, in parse order
+        self.rows_read = 0
+        self.cycle_start = None # (perf_counter, rows read, traced memory) when the current billing cycle started
+
+    # returns the timer of a stage, creating it on first use
+    def stage_timer(self, name):
+        timer = self.stages.get(name)
+        if timer is None:
+            timer = self.stages[name] = StageTimer()
+        return timer
+
+    # times the enclosed block as one call of a stage
+    @contextmanager
+    def stage(self, name):
+        timer = self.stage_timer(name)
+        rows_read, start = self.rows_read, time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds += time.perf_counter() - start
+            timer.calls += 1
+            timer.rows += self.rows_read - rows_read
+
+    # adds to a counter
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # returns a function timing each call of a function as a call of a stage
+    def timed(self, name, function):
+        timer, clock = self.stage_timer(name), time.perf_counter
+
+        def timed_function(*args):
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                timer.seconds += clock() - start
+                timer.calls += 1
+        return timed_function
+
+    # yields the rows of a reader, timing each read as a call of a stage and counting the rows read
+    def timed_rows(self, name, reader):
+        timer, clock = self.stage_timer(name), time.perf_counter
+        rows = iter(reader)
+        while True:
+            start = clock()
+            row = next(rows, None)
+            timer.seconds += clock() - start
+            if row is None:
+                return
+            timer.calls += 1
+            timer.rows += 1
+            self.rows_read += 1
+            yield row
+
+    # marks the start of a billing cycle's rows
+    def start_cycle(self):
+        traced = 0
+        tracemalloc = self.track_allocations and tracing()
+        if tracemalloc:
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.cycle_start = (time.perf_counter(), self.rows_read, traced)
+
+    # records the timing and allocations of a finalized billing cycle
+    # (a cycle's time runs from its first row to its finalization, so a streaming consumer's time is included)
+    def finish_cycle(self, cur_cycle):
+        if self.cycle_start is None: # cycle resumed from a checkpoint
+            self.start_cycle()
+        start, rows_read, traced = self.cycle_start
+        allocated = peak = None
+        tracemalloc = self.track_allocations and tracing()
+        if tracemalloc:
+            current, highest = tracemalloc.get_traced_memory()
+            allocated, peak = current - traced, highest - traced
+        key = cur_cycle.start_date[0:2] + '-' + cur_cycle.start_date[6:10]
+        self.cycles.append(CycleRecord(key, time.perf_counter() - start, self.rows_read - rows_read, allocated, peak))
+        self.count('cycles_parsed')
+        self.cycle_start = None
+
+    # returns the metrics in the Prometheus text exposition format
+    def prometheus_text(self):
+        lines = []
+
+        def family(name, kind, description, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{label}="{escape_label(str(text))}"' for label, text in labels)
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}" if label_text else f"{METRIC_PREFIX}_{name} {value}")
+
+        stages = sorted(self.stages.items())
+        family('stage_seconds_total', 'counter', "Time spent in each pipeline stage.",
+               [((('stage', name),), f"{timer.seconds:.6f}") for name, timer in stages])
+        family('stage_calls_total', 'counter', "Calls of each pipeline stage.",
+               [((('stage', name),), timer.calls) for name, timer in stages])
+        family('stage_rows_total', 'counter', "CSV rows read during each pipeline stage.",
+               [((('stage', name),), timer.rows) for name, timer in stages])
+        family('stage_rows_per_second', 'gauge', "CSV rows read per second of each pipeline stage.",
+               [((('stage', name),), f"{timer.rows / timer.seconds:.1f}") for name, timer in stages if timer.rows and timer.seconds])
+        family('events_total', 'counter', "Counted pipeline events.",
+               [((('event', name),), count) for name, count in sorted(self.counters.items())])
+        family('cycle_parse_seconds', 'gauge', "Time from the first row of each billing cycle to its finalization.",
+               [((('cycle', record.key),), f"{record.seconds:.6f}") for record in self.cycles])
+        family('cycle_rows', 'gauge', "CSV rows of each billing cycle.",
+               [((('cycle', record.key),), record.rows) for record in self.cycles])
+        if self.track_allocations:
+            family('cycle_allocated_bytes', 'gauge', "Traced memory still allocated at the end of each billing cycle.",
+                   [((('cycle', record.key),), record.allocated_bytes) for record in self.cycles if record.allocated_bytes is not None])
+            family('cycle_peak_bytes', 'gauge', "Highest traced memory while each billing cycle was parsed, above its start.",
+                   [((('cycle', record.key),), record.peak_bytes) for record in self.cycles if record.peak_bytes is not None])
+        return '\n'.join(lines) + '\n'
+
+    # writes the metrics to a Prometheus text file (e.g. for the node exporter's textfile collector)
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, path) # atomic so a scraper never reads a partial file
+
+    # returns the stage timers as lines of text
+    def summary_lines(self):
+        lines = []
+        for name, timer in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            rate = f", {timer.rows / timer.seconds:,.0f} rows/s" if timer.rows and timer.seconds else ''
+            lines.append(f"{name}: {timer.seconds:.3f} s in {timer.calls:,} call(s){rate}")
+        if self.cycles:
+            slowest = max(self.cycles, key=lambda record: record.seconds)
+            lines.append(f"billing cycles: {len(self.cycles)}, slowest {slowest.key} ({slowest.seconds:.3f} s, {slowest.rows:,} rows)")
+        return lines
+
+
+# returns the tracemalloc module if it is tracing allocations, None otherwise
+# (tracemalloc and cProfile are only imported when profiling, to keep startup fast)
+def tracing():
+    import tracemalloc
+    return tracemalloc if tracemalloc.is_tracing() else None
+
+
+# escapes a Prometheus label value
+def escape_label(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# starts collecting metrics (allocations are only tracked per billing cycle while tracemalloc is tracing)
+def enable(track_allocations=False):
+    global active
+    active = Metrics(track_allocations)
+    return active
+
+
+# stops collecting metrics, returning the metrics collected
+def disable():
+    global active
+    metrics, active = active, None
+    return metrics
+
+
+# times the enclosed block as a stage when metrics are enabled (a shared no-op context otherwise)
+def stage(name):
+    return active.stage(name) if active is not None else NO_STAGE
+
+
+NO_STAGE = nullcontext()
+
+
+# adds to a counter when metrics are enabled
+def count(name, n=1):
+    if active is not None:
+        active.count(name, n)
+
+
+# profiles the enclosed block: collects metrics with per-cycle allocations, and writes the
+# cProfile stats (profile.prof), tracemalloc snapshot (allocations.tracemalloc) and metrics (metrics.prom)
+# to the output directory when the block ends
+@contextmanager
+def profile_run(output_dir):
+    import cProfile
+    import tracemalloc
+
+    os.makedirs(output_dir, exist_ok=True)
+    metrics = enable(track_allocations=True)
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield metrics
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        disable()
+        profiler.dump_stats(os.path.join(output_dir, 'profile.prof'))
+        snapshot.dump(os.path.join(output_dir, 'allocations.tracemalloc'))
+        metrics.write_prometheus(os.path.join(output_dir, 'metrics.prom'))
@@ -0,0 +1,135 @@
+import argparse
+import csv
+import math
+import random
+from datetime import datetime, timedelta
+
+
+########################################################
+
+# loadgen.py
+
+# contains a generator of synthetic interval data csv
+# files in the same layout as the files in datasets/
+
+########################################################
+
+
+# columns of the interval data csv files
+FIELDNAMES = ['Start Date Time', 'End Date Time', 'Usage', 'Usage Unit', 'Avg. Temperature', 'Temperature Unit', 'Peak Demand', 'Demand Unit']
+
+# supported interval lengths in minutes
+INTERVAL_LENGTHS = (1, 5, 15, 60)
+
+
+# returns the date of the n-th sunday of a month (used for daylight saving time changes)
+def nth_sunday(year, month, n):
+    first = datetime(year, month, 1)
+    return first + timedelta(days=(6 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+# returns the (start, end) of the hour skipped in spring and the hour repeated in fall (US rules)
+def dst_changes(year):
+    spring = nth_sunday(year, 3, 2) + timedelta(hours=2)
+    fall = nth_sunday(year, 11, 1) + timedelta(hours=1)
+    return (spring, spring + timedelta(hours=1)), (fall, fall + timedelta(hours=1))
+
+
+# yields the local clock times of sorted moments with daylight saving time: the spring forward hour never happens and,
+# as the clocks go back, the whole fall back hour is read again after its first pass (01:00..01:45, 01:00..01:45)
+def dst_moments(moments):
+    repeated = []
+    for moment in moments:
+        spring, fall = dst_changes(moment.year)
+        if repeated and not fall[0] <= moment < fall[1]:
+            yield from repeated
+            repeated = []
+        if spring[0] <= moment < spring[1]:
+            continue
+        if fall[0] <= moment < fall[1]:
+            repeated.append(moment)
+        yield moment
+    yield from repeated
+
+
+# yields the moments from start (inclusive) to end (exclusive) step apart
+def grid_moments(start, end, step):
+    moment = start
+    while moment < end:
+        yield moment
+        moment += step
+
+
+# returns a realistic demand (kW) for a point in time: a seasonal base load, a weekday
+# business hours shape, an afternoon cooling peak in summer and some noise
+def demand_at(moment, temperature, rng, base_load):
+    hour = moment.hour + moment.minute / 60
+    business_hours = 1.0 if 7 <= hour < 19 and moment.weekday() < 5 else 0.0
+    daily_shape = 0.55 + 0.35 * business_hours + 0.10 * math.sin(math.pi * hour / 24)
+    cooling = max(0.0, temperature - 65) * 0.012
+    return base_load * (daily_shape + cooling) * rng.uniform(0.9, 1.1)
+
+
+# returns an average temperature (F) for a day of the year
+def temperature_on(moment, rng):
+    day_of_year = moment.timetuple().tm_yday
+    return round(60 - 12 * math.cos(2 * math.pi * (day_of_year - 15) / 365) + rng.uniform(-4, 4))
+
+
+# yields interval data rows from start for the given number of years
+# gap_rate is the chance that an interval is missing, dst repeats/skips the daylight saving time hours
+def generate_rows(start, years, interval_length, gap_rate=0.0, dst=False, seed=0, base_load=250.0):
+    rng = random.Random(seed)
+    step = timedelta(minutes=interval_length)
+    try:
+        end = start.replace(year=start.year + years)
+    except ValueError: # a Feb 29 start ends on Feb 28 of a year that is not a leap year
+        end = start.replace(year=start.year + years, day=28)
+    moments = grid_moments(start, end, step)
+    if dst:
+        moments = dst_moments(moments)
+
+    temperature_day, temperature = None, None
+    first_rows = 1 # never drop the first row, its date sets the start day of every billing cycle (see preprocess.read_rows)
+    for moment in moments:
+        if moment.date() != temperature_day:
+            temperature_day, temperature = moment.date(), temperature_on(moment, rng)
+
+        if first_rows or rng.random() >= gap_rate:
+            first_rows = 0
+            demand = demand_at(moment, temperature, rng, base_load)
+            usage = demand * interval_length / 60
+            yield [moment.strftime("%m-%d-%Y %H:%M"), (moment + step).strftime("%m-%d-%Y %H:%M"), f"{usage:.2f}", 'KWH',
+                   f"{temperature:.1f}", 'FAHRENHEIT', f"{demand:.2f}", 'KW']
+
+
+# writes a synthetic interval data csv file
+def write_csv(filename, start, years, interval_length, gap_rate=0.0, dst=False, seed=0):
+    rows = 0
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator='\r\n')
+        writer.writerow(FIELDNAMES)
+        for row in generate_rows(start, years, interval_length, gap_rate, dst, seed):
+            writer.writerow(row)
+            rows += 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic interval data CSV file.")
+    parser.add_argument('filename', help="CSV file to write (e.g. raw_datasets/large.csv)")
+    parser.add_argument('--start', default='01-05-2015', help="first day of data, mm-dd-yyyy (default: 01-05-2015)")
+    parser.add_argument('--years', type=int, default=1, help="number of years of data (default: 1)")
+    parser.add_argument('--interval', type=int, choices=INTERVAL_LENGTHS, default=15, help="interval length in minutes (default: 15)")
+    parser.add_argument('--gap-rate', type=float, default=0.0, help="fraction of intervals to leave out (default: 0)")
+    parser.add_argument('--dst', action='store_true', help="skip the spring forward hour and repeat the fall back hour")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%m-%d-%Y")
+    rows = write_csv(args.filename, start, args.years, args.interval, args.gap_rate, args.dst, args.seed)
+    print(f"Wrote {rows:,} rows to {args.filename}")
+
+
+if __name__ == '__main__':
+    main()
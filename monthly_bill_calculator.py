@@ -1,6 +1,15 @@
-from billing import calculate_monthly_bills
-from preprocess import open_valid_file, read_in_data
-from output import print_monthly_bills, query_bill_details
+import argparse
+import csv
+import sys
+from contextlib import nullcontext
+
+import instrumentation
+
+from billing import calculate_monthly_bills, calculate_bill, cycle_max_demand, ratchet_demand
+from cache import cached_read_in_data
+from preprocess import check_data_file, open_valid_file, read_in_data, stream_in_data
+from output import print_bill_details, print_monthly_bills, print_monthly_bills_header, print_bill_summary, query_bill_details
+from tariff import resolve_tariff
 
 
 ########################################################
@@ -15,29 +24,139 @@ from output import print_monthly_bills, query_bill_details
 
 # main function - calls function to run calculator
 def main():
-    run_calculator()
+    parser = argparse.ArgumentParser(description="Calculate monthly electricity bills from interval usage data. "
+                                                 "Without a filename the calculator asks for one and for the bills to show in detail.")
+    parser.add_argument('filename', nargs='?', help="CSV (or .ebc) file to bill without prompting")
+    parser.add_argument('--details', metavar='MM-YYYY', action='append', default=[],
+                        help="also print the detailed bill of this billing cycle (repeatable, or 'all')")
+    parser.add_argument('--no-cache', action='store_true', help="always parse the file instead of reusing cached results")
+    parser.add_argument('--workers', type=int, default=1, help="parse the file in this many worker processes (0 for one per CPU, default: 1)")
+    parser.add_argument('--stream', metavar='FILENAME', help="bill a (very large) CSV file cycle by cycle and print each bill as soon as it is complete")
+    parser.add_argument('--incremental', metavar='FILENAME', help="bill a growing CSV file, reading only the rows appended since the last run")
+    parser.add_argument('--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    parser.add_argument('--metrics', metavar='FILENAME', help="time the pipeline stages and billing cycles and write the metrics to this file in Prometheus text format")
+    parser.add_argument('--profile', metavar='DIRECTORY', help="profile the run and write cProfile stats, a tracemalloc snapshot and the metrics to this directory")
+    args = parser.parse_args()
+
+    # --stream and --incremental name their own file and print every bill, so they cannot take a filename or --details
+    for option, value in (('--stream', args.stream), ('--incremental', args.incremental)):
+        if value and args.filename:
+            parser.error(f"{option} takes the file to bill, drop the extra filename '{args.filename}'")
+        if value and args.details:
+            parser.error(f"{option} prints every bill, --details cannot be used with it")
+    if args.stream and args.incremental:
+        parser.error("--stream and --incremental cannot be used together")
+
+    # the file to bill without prompting gets the same checks as a file entered at the prompt
+    # (a growing --incremental file may not have rows yet)
+    filename = args.filename or args.stream
+    if filename:
+        try:
+            check_data_file(filename)
+        except FileNotFoundError:
+            parser.error(f"file not found: {filename}")
+        except OSError as e:
+            parser.error(f"cannot read {filename}: {e.strerror}")
+        except (csv.Error, ValueError) as e:
+            parser.error(f"invalid CSV {filename}: {e}")
+
+    # load and compile the tariff schedule once
+    tariff = resolve_tariff(args.tariff)
+
+    status = 0
+
+    # metrics are only collected when asked for
+    if args.profile:
+        measuring = instrumentation.profile_run(args.profile)
+    elif args.metrics:
+        measuring = nullcontext(instrumentation.enable())
+    else:
+        measuring = nullcontext()
+
+    with measuring as metrics:
+        if args.stream:
+            run_streaming_calculator(args.stream, tariff)
+        elif args.incremental:
+            run_incremental_calculator(args.incremental, tariff)
+        elif args.filename:
+            status = run_file_calculator(args.filename, args.details, tariff, use_cache=not args.no_cache, workers=args.workers or None)
+        else:
+            run_calculator(tariff)
+
+    if metrics is not None:
+        if args.metrics:
+            metrics.write_prometheus(args.metrics)
+        for line in metrics.summary_lines():
+            print(line, file=sys.stderr)
+    sys.exit(status)
 
 
 # runs the monthly bill calculator
-def run_calculator():
+def run_calculator(tariff=None):
     print("Welcome to the Monthly Bill Calculator!")
     print("Please enter the filename of the CSV data to process:")
 
     # take in filename from user and validate
     filename = open_valid_file()
     print("Loading in data...")
-    read_in_data(filename)
 
-    # read in data from csv file and parse into billing cycles
-    billing_cycles = read_in_data(filename)
+    # read in data from csv file and parse into billing cycles (reusing cached results for unchanged files)
+    billing_cycles = cached_read_in_data(filename, tariff)
 
     # calculate billing details for every billing cycle
-    calculate_monthly_bills(billing_cycles)
+    calculate_monthly_bills(billing_cycles, tariff)
 
     # print summary of monthly bills for all billing cycles
     print_monthly_bills(billing_cycles)
     # query loop - while user input is not 'q' continue to ask for month-year to show billing details for that month
-    query_bill_details(billing_cycles)
+    query_bill_details(billing_cycles, tariff)
+
+
+# bills a file without prompting: prints all monthly bills, then the detailed bills asked for ('all' for every cycle)
+# returns the exit status (1 if a detailed bill was asked for a billing cycle that is not in the file)
+# (with more than one worker, the file is parsed in parallel byte ranges, see sharded.py)
+def run_file_calculator(filename, details=(), tariff=None, use_cache=True, workers=1):
+    if use_cache:
+        billing_cycles = cached_read_in_data(filename, tariff, workers=workers)
+    elif workers == 1:
+        billing_cycles = read_in_data(filename, tariff)
+    else:
+        from sharded import read_in_data_sharded
+        billing_cycles = read_in_data_sharded(filename, tariff, workers)
+    calculate_monthly_bills(billing_cycles, tariff)
+    print_monthly_bills(billing_cycles)
+
+    status = 0
+    for key in (list(billing_cycles) if 'all' in details else details):
+        if key in billing_cycles:
+            print_bill_details(billing_cycles, key, tariff)
+        else:
+            print(f"No billing cycle found for {key}", file=sys.stderr)
+            status = 1
+    return status
+
+
+# bills a csv file one billing cycle at a time with constant memory
+# each bill is printed as soon as its billing cycle is complete
+def run_streaming_calculator(filename, tariff=None):
+    tariff = resolve_tariff(tariff)
+    demand_history = [] # highest demand of each billed cycle, for demand ratchets
+    print_monthly_bills_header()
+    for cur_cycle in stream_in_data(filename, tariff):
+        calculate_bill(cur_cycle, tariff, ratchet_demand(tariff, demand_history))
+        demand_history.append(cycle_max_demand(cur_cycle, tariff))
+        del demand_history[:-tariff.ratchet_cycles or None]
+        print_bill_summary(cur_cycle)
+
+
+# bills a growing csv file, parsing only rows appended since the last run (see incremental.py)
+def run_incremental_calculator(filename, tariff=None):
+    from incremental import read_in_data_incremental # only imported in incremental mode, to keep startup fast
+
+    billing_cycles = read_in_data_incremental(filename, tariff=tariff)
+    calculate_monthly_bills(billing_cycles, tariff)
+    print_monthly_bills(billing_cycles)
 
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,19 @@
+import sys
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
-from tariff_rates import B19Rates
+from functools import lru_cache
+
+import instrumentation
+from billing import demand_proration_days
+from fixed_point import format_cents, format_quantity, round_div
+from tariff import full_cycle_days, resolve_tariff
 
 ########################################################
 
 # output.py
 
-# contains function definitions to display monthly bill
-# summaries and breakdowns for user
+# contains function definitions to render and display
+# monthly bill summaries and breakdowns for user (each
+# bill is built as one string and written at once)
 
 ########################################################
 
@@ -24,134 +30,156 @@ period_display = {
 }
 
 
+# headings of the bill summaries, the detailed bill and its breakdown
+MONTHLY_BILLS_HEADER = "\n * * * * * Monthly Bill Details * * * * *  \n\n"
+BILL_DETAILS_HEADER = "\n * * * * * Detailed Bill Information * * * * * \n\n"
+BILLING_BREAKDOWN_HEADER = "\n  Billing Breakdown: \n\n"
+
+
 # print summary of monthly bills for all billing cycles
 def print_monthly_bills(billing_cycles):
+    sys.stdout.write(render_monthly_bills(billing_cycles))
 
-    print('\n', "* * * * * Monthly Bill Details * * * * * ", '\n')
 
-    INDENT = " " * 2
-
-    for cycle in billing_cycles:
-        cur_cycle = billing_cycles[cycle]
-        print(f"Bill for: {cur_cycle.start_date} to {cur_cycle.end_date} ({cur_cycle.billing_days} billing day(s))")
+# print heading shown above the monthly bill summaries
+def print_monthly_bills_header():
+    sys.stdout.write(MONTHLY_BILLS_HEADER)
 
-        print(f"{INDENT}Customer Charge: ${cur_cycle.customer_charge:,.2f}")
-        print(f"{INDENT}Demand Charge: ${cur_cycle.demand_charge:,.2f}")
-        print(f"{INDENT}Energy Charge: ${cur_cycle.energy_charge:,.2f}")
 
-        line = '  ' + ('-' * (15 + len(str(cur_cycle.total_charge))))
-        print(line)
-        print(f"{INDENT}Total Charge: ${cur_cycle.total_charge:,.2f}", '\n')
+# print summary of the monthly bill for a single billing cycle
+def print_bill_summary(cur_cycle):
+    with instrumentation.stage('render'):
+        text = render_bill_summary(cur_cycle)
+    sys.stdout.write(text)
 
 
 # print detailed bill information for a specific billing cycle
-def print_bill_details(billing_cycles, user_input):
-    print('\n', "* * * * * Detailed Bill Information * * * * *", '\n')
+def print_bill_details(billing_cycles, user_input, tariff=None):
+    sys.stdout.write(render_bill_details(billing_cycles, user_input, tariff))
+
 
+# display rate details for a season
+def display_season_rates(cur_cycle, season, tariff=None):
+    sys.stdout.write(render_season_rates(cur_cycle, season, tariff))
+
+
+# returns the summaries of monthly bills for all billing cycles as one string
+def render_monthly_bills(billing_cycles):
+    with instrumentation.stage('render'):
+        return MONTHLY_BILLS_HEADER + ''.join(render_bill_summary(cur_cycle) for cur_cycle in billing_cycles.values())
+
+
+# returns the total line of a bill, underlined to the width of the total charge
+def render_total(cur_cycle):
     INDENT = " " * 2
+    line = '  ' + ('-' * (15 + len(format_cents(cur_cycle.total_cents, grouping=False))))
+    return f"{line}\n{INDENT}Total Charge: ${format_cents(cur_cycle.total_cents)} \n\n"
 
-    cur_cycle = billing_cycles[user_input]
-    print(f"{INDENT}Start Date: {cur_cycle.start_date}")
-    print(f"{INDENT}End Date: {cur_cycle.end_date}")
-    print(f"{INDENT}Billing Days: {cur_cycle.billing_days} days (Summer Days: {cur_cycle.days_in_season['summer']}, Winter Days: {cur_cycle.days_in_season['winter']})")
 
-    month = int(cur_cycle.start_date[0:2])
-    day = int(cur_cycle.start_date[3:5])
+# returns a note line for a billing cycle shorter than a full cycle (e.g. the last cycle of a file that ends
+# mid-cycle): its demand charges are prorated over the days of a full cycle, see billing.demand_proration_days
+def render_partial_note(cur_cycle):
+    days = full_cycle_days(cur_cycle.start_date)
+    if cur_cycle.billing_days >= days:
+        return ''
+    return f"  Partial billing cycle: {cur_cycle.billing_days} of {days} days, demand charges are prorated over the full cycle\n"
 
-    summer_start = (6, 1)
-    summer_end = (9, 30)
 
-    print('\n', " Billing Breakdown:", '\n')
-    if summer_start <= (month, day) <= summer_end:
-        display_summer_rates(cur_cycle)
-        if (9, 2) <= (month, day) <= (9, 30): # if start dates fall between Sept 2 - Sept 30 show winter rates as well
-            display_winter_rates(cur_cycle)
-    else:
-        display_winter_rates(cur_cycle)
-        if (5, 2) <= (month, day) <= (5, 31): # if start dates fall between May 2 - May 31 show summer rates as well
-            display_summer_rates(cur_cycle)
+# returns the summary of the monthly bill for a single billing cycle
+def render_bill_summary(cur_cycle):
 
-    line = '  ' + ('-' * (15 + len(str(cur_cycle.total_charge))))
-    print(line)
-    print(f"{INDENT}Total Charge: ${cur_cycle.total_charge:,.2f}", '\n')
+    INDENT = " " * 2
 
+    return (f"Bill for: {cur_cycle.start_date} to {cur_cycle.end_date} ({cur_cycle.billing_days} billing day(s))\n"
+            + render_partial_note(cur_cycle) +
+            f"{INDENT}Customer Charge: ${format_cents(cur_cycle.customer_cents)}\n"
+            f"{INDENT}Demand Charge: ${format_cents(cur_cycle.demand_cents)}\n"
+            f"{INDENT}Energy Charge: ${format_cents(cur_cycle.energy_cents)}\n"
+            + render_total(cur_cycle))
 
-# display winter rate details
-def display_winter_rates(cur_cycle):
-    print("  Winter Rates")
 
-    INDENT = " " * 4
+# returns detailed bill information for a specific billing cycle
+def render_bill_details(billing_cycles, key, tariff=None):
 
-    # print customer charge details
-    print("  > Customer Charge:")
-    days = cur_cycle.days_in_season['winter']
-    rate = B19Rates['customer_charge_rates']['mandatory']
-    customer_charge_winter = Decimal(cur_cycle.customer_charge / cur_cycle.billing_days * cur_cycle.days_in_season['winter'])
-    amount = customer_charge_winter.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    print(f"{INDENT}{days} days @ ${rate:.5f} per day -> ${amount:,.2f}")
-
-    # print demand charge details
-    print("  > Demand Charge:")
-    winter_demand_charge = 0
-    for period in cur_cycle.demand_charge_periods['winter']:
-        value = cur_cycle.demand_charge_periods['winter'][period].value
-        rate = B19Rates['demand_charge_rates']['winter'][period]
-        demand_amount = cur_cycle.demand_charge_periods['winter'][period].cost
-        winter_demand_charge += demand_amount
-        print(f"{INDENT}{period_display[period]}: {value:,.6f} kW @ ${rate:,.5f} per kW for {days} winter days / {cur_cycle.billing_days} billing days -> ${demand_amount:,.2f}")
-    print(f"{INDENT}Total Winter Demand Charge: ${winter_demand_charge:,.2f}")
-
-    # print energy charge details
-    print("  > Energy Charge:")
-    winter_energy_charge = 0
-    for period in cur_cycle.energy_charge_periods['winter']:
-        value = cur_cycle.energy_charge_periods['winter'][period].value
-        rate = B19Rates['energy_charge_rates']['winter'][period]
-        energy_amount = cur_cycle.energy_charge_periods['winter'][period].cost
-        winter_energy_charge += energy_amount
-        print(f"{INDENT}{period_display[period]}: {value:,.6f} kWh @ ${rate:,.5f} per kWh -> ${energy_amount:,.2f}")
-    print(f"{INDENT}Total Winter Energy Charge: ${winter_energy_charge:,.2f}")
-
-
-# display summer rate details
-def display_summer_rates(cur_cycle):
-    print("  Summer Rates")
+    with instrumentation.stage('render'):
+        return build_bill_details(billing_cycles, key, tariff)
 
-    INDENT = " " * 4
 
-    # print customer charge details
-    print("  > Customer Charge:")
-    days = cur_cycle.days_in_season['summer']
-    rate = B19Rates['customer_charge_rates']['mandatory']
-    customer_charge_summer = Decimal(cur_cycle.customer_charge / cur_cycle.billing_days * cur_cycle.days_in_season['summer'])
-    amount = customer_charge_summer.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    print(f"{INDENT}{days} days @ ${rate:.5f} per day -> ${amount:,.2f}")
-
-    # print demand charge details
-    print("  > Demand Charge:")
-    summer_demand_charge = 0
-    for period in cur_cycle.demand_charge_periods['summer']:
-        value = cur_cycle.demand_charge_periods['summer'][period].value
-        rate = B19Rates['demand_charge_rates']['summer'][period]
-        demand_amount = cur_cycle.demand_charge_periods['summer'][period].cost
-        summer_demand_charge += demand_amount
-        print(f"{INDENT}{period_display[period]}: {value:,.6f} kW @ ${rate:,.5f} per kW for {days} summer days / {cur_cycle.billing_days} billing days -> ${demand_amount:,.2f}")
-    print(f"{INDENT}Total Summer Demand Charge: ${summer_demand_charge:,.2f}")
-
-    # print energy charge details
-    print("  > Energy Charge:")
-    summer_energy_charge = 0
-    for period in cur_cycle.energy_charge_periods['summer']:
-        value = cur_cycle.energy_charge_periods['summer'][period].value
-        rate = B19Rates['energy_charge_rates']['summer'][period]
-        energy_amount = cur_cycle.energy_charge_periods['summer'][period].cost
-        summer_energy_charge += energy_amount
-        print(f"{INDENT}{period_display[period]}: {value:,.6f} kWh @ ${rate:,.5f} per kWh -> ${energy_amount:,.2f}")
-    print(f"{INDENT}Total Summer Energy Charge: ${summer_energy_charge:,.2f}")
+# builds the detailed bill text of render_bill_details
+def build_bill_details(billing_cycles, key, tariff):
+
+    INDENT = " " * 2
+    tariff = resolve_tariff(tariff)
+
+    cur_cycle = billing_cycles[key]
+    parts = [BILL_DETAILS_HEADER,
+             f"{INDENT}Start Date: {cur_cycle.start_date}\n",
+             f"{INDENT}End Date: {cur_cycle.end_date}\n",
+             f"{INDENT}Billing Days: {cur_cycle.billing_days} days (Summer Days: {cur_cycle.days_in_season['summer']}, Winter Days: {cur_cycle.days_in_season['winter']})\n",
+             BILLING_BREAKDOWN_HEADER]
+
+    # show rates for every season a full billing cycle from the start date would cover
+    # (e.g. start dates between Sept 2 - Sept 30 show winter rates as well)
+    for season in tariff.seasons_in_cycle(cur_cycle.start_date):
+        parts.append(render_season_rates(cur_cycle, season, tariff))
+
+    parts.append(render_total(cur_cycle))
+    return ''.join(parts)
+
+
+# formats the rates of a tariff once: {'customer': text, 'demand' / 'energy': {season: {period: text}}}
+@lru_cache(maxsize=None)
+def rate_labels(tariff):
+    rates = tariff.rates
+    return {
+        'customer': f"{tariff.customer_charge_rate:.5f}",
+        'demand': {season: {period: f"{rates['demand_charge_rates'][season].get(period, 0):,.5f}" for period in periods}
+                   for season, periods in tariff.demand_periods.items()},
+        'energy': {season: {period: f"{rates['energy_charge_rates'][season].get(period, 0):,.5f}" for period in periods}
+                   for season, periods in tariff.energy_periods.items()}
+    }
+
+
+# returns rate details for a season
+def render_season_rates(cur_cycle, season, tariff=None):
+
+    INDENT = " " * 4
+    tariff = resolve_tariff(tariff)
+    labels = rate_labels(tariff)
+    days = cur_cycle.days_in_season[season]
+    lines = [f"  {season.capitalize()} Rates"]
+
+    # customer charge details
+    lines.append("  > Customer Charge:")
+    amount = round_div(cur_cycle.customer_cents * days, cur_cycle.billing_days)
+    lines.append(f"{INDENT}{days} days @ ${labels['customer']} per day -> ${format_cents(amount)}")
+
+    # demand charge details
+    lines.append("  > Demand Charge:")
+    proration_days = demand_proration_days(cur_cycle.start_date, cur_cycle.billing_days)
+    proration_label = f"{proration_days} billing days" if proration_days == cur_cycle.billing_days else f"{proration_days} days of a full cycle"
+    season_demand_charge = 0
+    for period, code in cur_cycle.demand_index[season].items():
+        demand_amount = cur_cycle.demand_costs[code]
+        season_demand_charge += demand_amount
+        lines.append(f"{INDENT}{period_display.get(period, period)}: {format_quantity(cur_cycle.demand_values[code])} kW @ ${labels['demand'][season][period]} per kW "
+                     f"for {days} {season} days / {proration_label} -> ${format_cents(demand_amount)}")
+    lines.append(f"{INDENT}Total {season.capitalize()} Demand Charge: ${format_cents(season_demand_charge)}")
+
+    # energy charge details
+    lines.append("  > Energy Charge:")
+    season_energy_charge = 0
+    for period, code in cur_cycle.energy_index[season].items():
+        energy_amount = cur_cycle.energy_costs[code]
+        season_energy_charge += energy_amount
+        lines.append(f"{INDENT}{period_display.get(period, period)}: {format_quantity(cur_cycle.energy_values[code])} kWh @ ${labels['energy'][season][period]} per kWh -> ${format_cents(energy_amount)}")
+    lines.append(f"{INDENT}Total {season.capitalize()} Energy Charge: ${format_cents(season_energy_charge)}")
+
+    return '\n'.join(lines) + '\n'
 
 
 # query billing details for specific month-year or quit
-def query_bill_details(billing_cycles):
+def query_bill_details(billing_cycles, tariff=None):
 
     # validate mm-yyyy provided by user
     def is_valid_mm_yyyy(value: str) -> bool:
@@ -177,7 +205,7 @@ def query_bill_details(billing_cycles):
             user_input = input("Enter here: ").strip()
             continue
 
-        print_bill_details(billing_cycles, user_input)
+        print_bill_details(billing_cycles, user_input, tariff)
 
         print('\n', "Would you like to see more detailed billing information? (enter month and year in the format 'mm-yyyy' for a specific month, or 'q' to quit)")
         user_input = input("Enter here: ").strip()
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from batch import find_meter_files
+from billing import calculate_monthly_bills
+from output import render_monthly_bills
+from preprocess import parse_data, read_in_data, read_rows
+
+
+########################################################
+
+# pipeline.py
+
+# contains an asyncio batch pipeline that overlaps the
+# stages of billing many meter files: read (threads),
+# parse (processes), price (threads) and emit, connected
+# by bounded queues so a slow stage holds back the ones
+# before it instead of filling memory
+
+########################################################
+
+
+# time spent working by the tasks of a pipeline stage
+class StageStats:
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.items = 0
+        self.busy = 0.0 # seconds, summed over the stage's tasks
+
+    # returns the share of the stage's capacity (tasks x wall time) spent working
+    def utilization(self, wall):
+        return self.busy / (wall * self.concurrency) if wall else 0.0
+
+
+# reads a meter file's bytes (runs in a thread), columnar files are left to be memory-mapped by the parse stage
+def read_file(filename):
+    if filename.endswith('.ebc'):
+        return None
+    with open(filename, 'rb') as file:
+        return file.read()
+
+
+# parses a meter file's bytes into billing cycles (runs in a worker process)
+def parse_file_data(filename, data, tariff=None):
+    if data is None:
+        return read_in_data(filename, tariff)
+    reader, start_of_month = read_rows(io.StringIO(data.decode(), newline=''))
+    return parse_data(reader, start_of_month, tariff)
+
+
+# prices billing cycles and renders their bills (runs in a thread)
+def price_bills(billing_cycles, tariff=None):
+    calculate_monthly_bills(billing_cycles, tariff)
+    return render_monthly_bills(billing_cycles)
+
+
+# runs concurrency tasks that take (index, filename, value, error) items from inbox, apply work to the value
+# and put the result on outbox; a failed item keeps its error and skips the later stages' work
+# once inbox is exhausted (one None per task), sends one None per downstream task
+async def run_stage(stats, inbox, outbox, work, downstream):
+
+    async def worker():
+        while (item := await inbox.get()) is not None:
+            index, filename, value, error = item
+            if error is None:
+                start = time.perf_counter()
+                try:
+                    value = await work(filename, value)
+                except Exception as e: # a bad file is reported instead of stopping the run
+                    value, error = None, f"{type(e).__name__}: {e}"
+                stats.busy += time.perf_counter() - start
+                stats.items += 1
+            await outbox.put((index, filename, value, error)) # waits while the next stage is behind (backpressure)
+
+    await asyncio.gather(*(worker() for _ in range(stats.concurrency)))
+    for _ in range(downstream):
+        await outbox.put(None)
+
+
+# writes the bills in filename order as they complete, returns the number of files that could not be billed
+async def emit_bills(stats, inbox, output, errors, writer):
+    loop = asyncio.get_running_loop()
+    pending = {} # index : (filename, bills, error) finished ahead of an earlier file
+    next_index, failed = 0, 0
+
+    while (item := await inbox.get()) is not None:
+        index, filename, bills, error = item
+        pending[index] = (filename, bills, error)
+        while next_index in pending:
+            filename, bills, error = pending.pop(next_index)
+            next_index += 1
+            if error:
+                failed += 1
+                print(f"Could not bill {filename}: {error}", file=errors)
+                continue
+            start = time.perf_counter()
+            await loop.run_in_executor(writer, output.write, f"===== Meter: {filename} =====\n{bills}")
+            stats.busy += time.perf_counter() - start
+            stats.items += 1
+    return failed
+
+
+# bills meter files through the read -> parse -> price -> emit pipeline, writing all bills to one output
+# in filename order (the same text as batch.run_batch); each stage runs its own number of tasks and holds
+# at most queue_size files for the next stage
+# returns (number of files that could not be billed, [StageStats], wall seconds)
+async def run_pipeline(filenames, output=sys.stdout, errors=sys.stderr, tariff=None, readers=4, parsers=None, pricers=2, queue_size=8):
+    loop = asyncio.get_running_loop()
+    parsers = parsers or os.cpu_count() or 1
+    stats = [StageStats('read', readers), StageStats('parse', parsers), StageStats('price', pricers), StageStats('emit', 1)]
+    read_stats, parse_stats, price_stats, emit_stats = stats
+
+    filename_queue = asyncio.Queue()
+    for index, filename in enumerate(filenames):
+        filename_queue.put_nowait((index, filename, None, None))
+    for _ in range(readers):
+        filename_queue.put_nowait(None)
+    data_queue, cycle_queue, bill_queue = asyncio.Queue(queue_size), asyncio.Queue(queue_size), asyncio.Queue(queue_size)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(readers, 'read') as read_executor, ProcessPoolExecutor(parsers) as parse_executor, \
+            ThreadPoolExecutor(pricers, 'price') as price_executor, ThreadPoolExecutor(1, 'emit') as emit_executor:
+
+        async def read(filename, _):
+            return await loop.run_in_executor(read_executor, read_file, filename)
+
+        async def parse(filename, data):
+            return await loop.run_in_executor(parse_executor, parse_file_data, filename, data, tariff)
+
+        async def price(filename, billing_cycles):
+            return await loop.run_in_executor(price_executor, price_bills, billing_cycles, tariff)
+
+        *_, failed = await asyncio.gather(
+            run_stage(read_stats, filename_queue, data_queue, read, parsers),
+            run_stage(parse_stats, data_queue, cycle_queue, parse, pricers),
+            run_stage(price_stats, cycle_queue, bill_queue, price, 1),
+            emit_bills(emit_stats, bill_queue, output, errors, emit_executor))
+
+    return failed, stats, time.perf_counter() - start
+
+
+# bills every meter file in the paths through the pipeline and reports how busy each stage was
+# returns the number of files that could not be billed
+def run_pipeline_batch(paths, output=sys.stdout, errors=sys.stderr, tariff=None, readers=4, parsers=None, pricers=2, queue_size=8):
+    filenames = find_meter_files(paths)
+    failed, stats, wall = asyncio.run(run_pipeline(filenames, output, errors, tariff, readers, parsers, pricers, queue_size))
+
+    print(f"Billed {len(filenames) - failed} of {len(filenames)} meter file(s) in {wall:.2f} s", file=errors)
+    for stage in stats:
+        print(f"  {stage.name}: {stage.items} file(s), {stage.busy:.2f} s busy over {stage.concurrency} task(s) "
+              f"({stage.utilization(wall):.0%} utilized)", file=errors)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bill every meter CSV in a directory or glob pattern, overlapping reading, parsing and pricing.")
+    parser.add_argument('paths', nargs='+', help="directories or glob patterns of meter CSV files (e.g. datasets/)")
+    parser.add_argument('-o', '--output', default=None, help="file to write the combined bills to (default: stdout)")
+    parser.add_argument('--readers', type=int, default=4, help="files read at once (threads, default: 4)")
+    parser.add_argument('--parsers', type=int, default=None, help="files parsed at once (processes, default: number of CPUs)")
+    parser.add_argument('--pricers', type=int, default=2, help="files priced and rendered at once (threads, default: 2)")
+    parser.add_argument('--queue-size', type=int, default=8, help="files each stage may hold for the next one (default: 8)")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    options = dict(tariff=args.tariff, readers=args.readers, parsers=args.parsers, pricers=args.pricers, queue_size=args.queue_size)
+    if args.output:
+        with open(args.output, 'w') as output:
+            failed = run_pipeline_batch(args.paths, output, **options)
+    else:
+        failed = run_pipeline_batch(args.paths, **options)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 import csv
-from billing_cycle import BillingCycle
-from datetime import datetime
+
+import instrumentation
+from billing_cycle import BillingCycle, ParseState
 from itertools import chain
 
-from billing import update_energy_charge_periods, update_demand_charge_periods, finialize_billing_cycle
+from billing import update_energy_charge_periods, update_demand_charge_periods, finialize_billing_cycle, cycle_billing_days, last_cycle_end_day
+from fixed_point import parse_quantity
+from tariff import minute_of_day, resolve_tariff
+from timestamps import TimestampDecoder
 
 
 ########################################################
@@ -21,18 +25,7 @@ def open_valid_file():
     while True:
         filename = input("Enter CSV filename: ")
         try:
-            with open(filename, newline='') as file:
-                reader = csv.DictReader(file)
-
-                # Ensure header row exists
-                if reader.fieldnames is None:
-                    raise ValueError("Missing header row")
-
-                # Ensure csv is not empty
-                try:
-                    next(reader)
-                except StopIteration:
-                    raise ValueError("CSV is empty")
+            check_data_file(filename)
 
             # success - return filename
             return filename
@@ -45,73 +38,164 @@ def open_valid_file():
             print(f"Invalid CSV: {e}. Please try again.")
 
 
-# open and read in data from csv file, then parse data into billing cycles
-def read_in_data(filename):
+# checks that a file can be billed: it can be opened and, unless it is a columnar .ebc file (checked when it is
+# read), it has a header row and at least one data row
+# raises FileNotFoundError, PermissionError, csv.Error or ValueError otherwise
+def check_data_file(filename):
+    if filename.endswith('.ebc'):
+        with open(filename, 'rb'):
+            return
+
     with open(filename, newline='') as file:
         reader = csv.DictReader(file)
-        # "peak" the first row
-        first_row = next(reader)
-        start_of_month = int(first_row['Start Date Time'][3:5])
-        # prepend iterator back to restart at first entry
-        reader = chain([first_row], reader)
 
-        return parse_data(reader, start_of_month)
+        # Ensure header row exists
+        if reader.fieldnames is None:
+            raise ValueError("Missing header row")
+
+        # Ensure csv is not empty
+        try:
+            next(reader)
+        except StopIteration:
+            raise ValueError("CSV is empty")
+
+
+# opens a csv file and yields each row, starting with the "peeked" first row
+# (the first row's date determines the start day of every billing cycle)
+def read_rows(file):
+    reader = csv.DictReader(file)
+    # "peak" the first row (a ValueError, like open_valid_file's, rather than StopIteration, which generators such as
+    # stream_in_data would turn into a RuntimeError)
+    first_row = next(reader, None)
+    if first_row is None:
+        raise ValueError("Missing header row" if reader.fieldnames is None else "CSV is empty")
+    start_of_month = int(first_row['Start Date Time'][3:5])
+    # prepend iterator back to restart at first entry
+    return chain([first_row], reader), start_of_month
+
+
+# open and read in data from csv file, then parse data into billing cycles
+def read_in_data(filename, tariff=None):
+    # columnar binary files (see columnar.py) are memory-mapped instead of parsed row by row
+    if filename.endswith('.ebc'):
+        from columnar import read_in_columnar # numpy is only needed for columnar files
+        return read_in_columnar(filename, tariff)
+
+    with instrumentation.stage('parse'), open(filename, newline='') as file:
+        reader, start_of_month = read_rows(file)
+        return parse_data(reader, start_of_month, tariff)
+
+
+# open csv file and yield each billing cycle as soon as it is finalized
+# (only the billing cycle being built is held in memory)
+def stream_in_data(filename, tariff=None):
+    with open(filename, newline='') as file:
+        reader, start_of_month = read_rows(file)
+        yield from iter_billing_cycles(reader, start_of_month, tariff=tariff)
+
+
+# open and read in data from csv file, then parse data into billing cycles
+# returns (billing cycles, timestamps.IntervalReport with the interval length, gaps and duplicates of the file)
+def read_in_data_with_report(filename, tariff=None):
+    with open(filename, newline='') as file:
+        reader, start_of_month = read_rows(file)
+        state = ParseState(start_of_month)
+        return parse_data(reader, start_of_month, tariff, state), state.report
+
+
+# open and read in data from csv file, then parse data into billing cycles
+# returns (billing cycles, rollups.RollupStore of the hourly, daily and per-cycle time-of-use totals and peaks)
+def read_in_data_with_rollups(filename, tariff=None):
+    from rollups import RollupStore
+
+    rollups = RollupStore(resolve_tariff(tariff))
+    with open(filename, newline='') as file:
+        reader, start_of_month = read_rows(file)
+        return parse_data(reader, start_of_month, tariff, rollups=rollups), rollups
 
 
-# parse data into billing cycles
-def parse_data(reader, start_of_month):
+# parse data into billing cycles (a ParseState can be given to keep the final state and its report,
+# a rollups.RollupStore to also record the rows' totals and peaks in it)
+def parse_data(reader, start_of_month, tariff=None, state=None, rollups=None):
 
     billing_cycles = {} # month (int) : BillingCycle - store each billing cycle by month
-    billing_days = 0
-    days_summer, days_winter = 0, 0
-    prev_date = None
-    cur_billing_cycle = None
-    interval_length = None
-    cycles_created = set()
-    summer_start, summer_end = (6, 1), (9, 30)
+    for cur_billing_cycle in iter_billing_cycles(reader, start_of_month, state, tariff, rollups):
+        key = (cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10])
+        billing_cycles[key] = cur_billing_cycle
+
+    return billing_cycles
+
+
+# parse data into billing cycles, yielding each billing cycle once it is finalized
+# when a ParseState is given, parsing resumes from it and it is updated with the final state
+# (the last, still open billing cycle is finalized and yielded as well)
+# when a rollups.RollupStore is given, every row is also recorded in it
+def iter_billing_cycles(reader, start_of_month, state=None, tariff=None, rollups=None):
+
+    tariff = resolve_tariff(tariff)
+    if state is None:
+        state = ParseState(start_of_month)
+
+    cycle_start_day, prev_minute = state.cycle_start_day, state.prev_minute
+    prev_date = state.prev_date
+    cur_billing_cycle = state.cur_billing_cycle
+    cycles_created = state.cycles_created
+    report = state.report
+    decode_date = TimestampDecoder().decode_date
+    classify_codes = tariff.classify_codes
+
+    # with metrics enabled, time the csv reads and the time-of-use classification (no per-row cost otherwise)
+    metrics = instrumentation.active
+    if metrics is not None:
+        reader = metrics.timed_rows('csv_decode', reader)
+        classify_codes = metrics.timed('classify', classify_codes)
 
     for row in reader:
         start_datetime = row['Start Date Time']
-        year = int(start_datetime[6:10])
-        month, date, time = int(start_datetime[0:2]), int(start_datetime[3:5]), start_datetime[11:]
+        year, month, date, day = decode_date(start_datetime)
+        time = start_datetime[11:]
 
-        # determine interval length based on first two entries
-        if not interval_length and prev_date:
-            interval_length = 60 // int((datetime.strptime(start_datetime, "%m-%d-%Y %H:%M") - datetime.strptime(prev_date, "%m-%d-%Y %H:%M")).total_seconds() // 60)
+        # track the steps between timestamps (interval length, gaps, duplicates)
+        minute = day * 24 * 60 + minute_of_day(time)
+        report.observe(minute, start_datetime)
 
         # Check if we need to start a new billing cycle
         if date == start_of_month and (month, year) not in cycles_created:
             cycles_created.add((month, year)) # make sure we only create one billing cycle per month-year
             if cur_billing_cycle:
-                finialize_billing_cycle(cur_billing_cycle, billing_days, days_summer, days_winter, prev_date, interval_length)
-                key = (cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10])
-                billing_cycles[key] = cur_billing_cycle
+                finialize_billing_cycle(cur_billing_cycle, cycle_billing_days(cycle_start_day, day), prev_date, tariff)
+                if metrics is not None:
+                    metrics.finish_cycle(cur_billing_cycle)
+                yield cur_billing_cycle
+            if metrics is not None:
+                metrics.start_cycle()
+            if rollups is not None:
+                rollups.start_cycle(start_datetime[0:2] + '-' + start_datetime[6:10])
 
-            billing_days = 0
-            days_summer, days_winter = 0, 0
+            cycle_start_day = day
 
             new_billing_cycle = BillingCycle(start_datetime[:10])
             cur_billing_cycle = new_billing_cycle
-            cur_billing_cycle.initialize_energy_charge_periods(cur_billing_cycle)
-            cur_billing_cycle.initialize_demand_charge_periods(cur_billing_cycle)
+            cur_billing_cycle.initialize_energy_charge_periods(cur_billing_cycle, tariff)
+            cur_billing_cycle.initialize_demand_charge_periods(cur_billing_cycle, tariff)
 
-        # increment billing days and seasonal days (will offset later based on interval length)
-        billing_days += 1
-        if summer_start <= (month, date) <= summer_end:
-            days_summer += 1
-        else:
-            days_winter += 1
+        # update the energy and demand charge values (in millionths of a kWh / kW), the row is classified once for all of them
+        usage, demand = parse_quantity(row['Usage'] or ''), parse_quantity(row['Peak Demand'] or '')
+        codes = classify_codes(month, date, time, year)
+        update_energy_charge_periods(cur_billing_cycle, codes, usage)
+        update_demand_charge_periods(cur_billing_cycle, codes, demand)
+        if rollups is not None:
+            rollups.observe(minute, start_datetime, usage, demand, codes)
 
-        # update the energy and demand charge values
-        usage, demand = float(row['Usage'] or 0.0), float(row['Peak Demand'] or 0.0)
-        update_energy_charge_periods(cur_billing_cycle, month, date, time, usage)
-        update_demand_charge_periods(cur_billing_cycle, month, date, time, demand)
+        prev_date, prev_minute = start_datetime, minute
 
-        prev_date = start_datetime
+    # save state so parsing can be resumed with more rows
+    state.cycle_start_day, state.prev_minute = cycle_start_day, prev_minute
+    state.prev_date = prev_date
+    state.cur_billing_cycle = cur_billing_cycle
 
     # finalize last billing cycle
-    finialize_billing_cycle(cur_billing_cycle, billing_days, days_summer, days_winter, prev_date, interval_length)
-    key = (cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10])
-    billing_cycles[key] = cur_billing_cycle
-
-    return billing_cycles
\ No newline at end of file
+    finialize_billing_cycle(cur_billing_cycle, cycle_billing_days(cycle_start_day, last_cycle_end_day(prev_minute)), prev_date, tariff)
+    if metrics is not None:
+        metrics.finish_cycle(cur_billing_cycle)
+    yield cur_billing_cycle
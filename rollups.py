@@ -0,0 +1,273 @@
+import argparse
+import os
+import pickle
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from fixed_point import format_cents, format_quantity
+from tariff import resolve_tariff
+from timestamps import TimestampDecoder
+
+
+########################################################
+
+# rollups.py
+
+# contains the rollup store built while a meter file is
+# parsed: hourly and daily energy totals and demand peaks
+# (with the interval that set each peak), and each billing
+# cycle's totals and peaks per time-of-use period, so load
+# profiles and peak attribution are answered by range in
+# O(log n) without parsing the intervals again
+
+########################################################
+
+
+# bump when the saved rollup store contents change
+ROLLUP_VERSION = 1
+
+
+# energy totals and demand peaks of consecutive fixed-size time buckets (e.g. hours or days)
+# bucket starts are in epoch minutes, energy and demand in millionths of a kWh / kW
+class Rollup:
+    def __init__(self, size):
+        self.size = size # bucket length in minutes
+        self.starts = array('q') # ascending
+        self.energy = array('q')
+        self.intervals = array('q')
+        self.peaks = array('q')
+        self.peak_at = [] # timestamp of the first interval that set each bucket's peak
+        self.position = -1 # bucket the last interval went to
+        self.prefix = self.tree = None # range query indexes, built on the first query after new intervals
+
+    # adds an interval to the bucket it starts in
+    def add(self, minute, timestamp, usage, demand):
+        start = minute - minute % self.size
+        position = self.position
+        if position < 0 or self.starts[position] != start:
+            position = self.position = self.bucket(start)
+        self.energy[position] += usage
+        self.intervals[position] += 1
+        if demand > self.peaks[position] or self.intervals[position] == 1:
+            self.peaks[position] = demand
+            self.peak_at[position] = timestamp
+        self.prefix = None
+
+    # returns the position of the bucket starting at a minute, adding it if needed
+    # (rows going back in time, e.g. when daylight saving time ends, go to an earlier bucket)
+    def bucket(self, start):
+        position = len(self.starts)
+        if position and start <= self.starts[-1]:
+            position = bisect_left(self.starts, start)
+            if self.starts[position] == start:
+                return position
+        self.starts.insert(position, start)
+        self.energy.insert(position, 0)
+        self.intervals.insert(position, 0)
+        self.peaks.insert(position, 0)
+        self.peak_at.insert(position, None)
+        return position
+
+    # builds the energy running totals and a segment tree of the positions of the highest peaks
+    def build_index(self):
+        n, peaks = len(self.starts), self.peaks
+        self.prefix = list(accumulate(self.energy, initial=0))
+        tree = [0] * n + list(range(n))
+        for node in range(n - 1, 0, -1):
+            tree[node] = higher_peak(peaks, tree[2 * node], tree[2 * node + 1])
+        self.tree = tree
+
+    # returns the (first, last + 1) positions of the buckets starting in [start, end) epoch minutes
+    def positions(self, start=None, end=None):
+        if self.prefix is None:
+            self.build_index()
+        first = bisect_left(self.starts, start) if start is not None else 0
+        last = bisect_left(self.starts, end) if end is not None else len(self.starts)
+        return first, max(first, last)
+
+    # returns the energy total of the buckets starting in [start, end)
+    def total(self, start=None, end=None):
+        first, last = self.positions(start, end)
+        return self.prefix[last] - self.prefix[first]
+
+    # returns (peak demand, timestamp of the interval that set it) of the buckets starting in [start, end),
+    # the earliest one on ties, or (0, None) if there are none
+    def peak(self, start=None, end=None):
+        first, last = self.positions(start, end)
+        n, tree, best = len(self.starts), self.tree, -1
+        first, last = first + n, last + n
+        while first < last:
+            if first & 1:
+                best = higher_peak(self.peaks, best, tree[first])
+                first += 1
+            if last & 1:
+                last -= 1
+                best = higher_peak(self.peaks, best, tree[last])
+            first, last = first // 2, last // 2
+        return (self.peaks[best], self.peak_at[best]) if best >= 0 else (0, None)
+
+    # returns (bucket start, energy, intervals, peak demand, peak timestamp) of the buckets starting in [start, end)
+    def series(self, start=None, end=None):
+        first, last = self.positions(start, end)
+        return [(self.starts[i], self.energy[i], self.intervals[i], self.peaks[i], self.peak_at[i]) for i in range(first, last)]
+
+
+# returns the position with the higher peak, the earlier one on ties (-1 means no position)
+def higher_peak(peaks, a, b):
+    if a < 0:
+        return b
+    if peaks[a] > peaks[b] or (peaks[a] == peaks[b] and a < b):
+        return a
+    return b
+
+
+# energy totals and demand peaks of one billing cycle per time-of-use period, in the tariff's layout order
+class CycleRollup:
+    __slots__ = ('energy', 'intervals', 'peaks', 'peak_at')
+
+    def __init__(self, tariff):
+        self.energy = array('q', bytes(8 * len(tariff.energy_layout)))
+        self.intervals = array('q', bytes(8 * len(tariff.energy_layout)))
+        self.peaks = array('q', bytes(8 * len(tariff.demand_layout)))
+        self.peak_at = [None] * len(tariff.demand_layout) # first interval that set each demand period's peak
+
+
+# stores the hourly, daily and per billing cycle rollups of a meter file
+class RollupStore:
+    def __init__(self, tariff):
+        self.tariff = tariff # only kept while intervals are recorded, saved stores answer queries
+        self.tariff_fingerprint = tariff.fingerprint
+        self.energy_layout, self.demand_layout = tariff.energy_layout, tariff.demand_layout
+        self.hourly = Rollup(60)
+        self.daily = Rollup(24 * 60)
+        self.cycles = {} # 'mm-yyyy' : CycleRollup
+        self.cur_cycle = None
+
+    def __getstate__(self):
+        return {**self.__dict__, 'tariff': None, 'cur_cycle': None}
+
+    # starts the rollup of a billing cycle
+    def start_cycle(self, key):
+        self.cur_cycle = self.cycles[key] = CycleRollup(self.tariff)
+
+    # records an interval (minute since the epoch, 'mm-dd-yyyy HH:MM' timestamp, usage and demand in millionths
+    # and its Tariff.classify_codes)
+    def observe(self, minute, timestamp, usage, demand, codes):
+        self.hourly.add(minute, timestamp, usage, demand)
+        self.daily.add(minute, timestamp, usage, demand)
+
+        energy_code, demand_code, all_hours_code = codes
+        cur_cycle = self.cur_cycle
+        cur_cycle.energy[energy_code] += usage
+        cur_cycle.intervals[energy_code] += 1
+        for code in (demand_code, all_hours_code):
+            if code >= 0 and (demand > cur_cycle.peaks[code] or cur_cycle.peak_at[code] is None):
+                cur_cycle.peaks[code] = demand
+                cur_cycle.peak_at[code] = timestamp
+
+    # returns [(season, period, peak demand, timestamp of the interval that set it)] of a billing cycle's demand periods
+    def cycle_peaks(self, key):
+        cur_cycle = self.cycles[key]
+        return [(season, period, cur_cycle.peaks[code], cur_cycle.peak_at[code]) for code, (season, period) in enumerate(self.demand_layout)]
+
+    # returns [(season, period, energy, intervals)] of a billing cycle's energy periods
+    def cycle_energy(self, key):
+        cur_cycle = self.cycles[key]
+        return [(season, period, cur_cycle.energy[code], cur_cycle.intervals[code]) for code, (season, period) in enumerate(self.energy_layout)]
+
+    # saves the store for later queries (source is what identifies the parsed file, e.g. its size and mtime)
+    def save(self, path, source):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({'version': ROLLUP_VERSION, 'source': source, 'store': self}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path) # atomic so a concurrent reader never sees a partial store
+
+
+# returns what identifies the contents of a meter file for saved rollups
+def file_source(filename):
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+# returns a meter file's rollup store, parsing the file only when no saved store matches it and the tariff
+# (stores are saved in the cache's private state directory, see cache.private_state_path)
+def load_rollups(filename, tariff=None):
+    return load_rollups_with_cycles(filename, tariff)[0]
+
+
+# returns (rollup store, billing cycles parsed with it or None when the saved store was used), see load_rollups
+def load_rollups_with_cycles(filename, tariff=None):
+    from cache import private_state_path
+    from preprocess import read_in_data_with_rollups
+
+    tariff = resolve_tariff(tariff)
+    path = private_state_path(filename, '.rollups')
+    try:
+        with open(path, 'rb') as file:
+            saved = pickle.load(file)
+        if isinstance(saved, dict) and saved['version'] == ROLLUP_VERSION and saved['source'] == file_source(filename) and saved['store'].tariff_fingerprint == tariff.fingerprint:
+            return saved['store'], None
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, KeyError, AttributeError, TypeError):
+        pass
+
+    source = file_source(filename)
+    billing_cycles, rollups = read_in_data_with_rollups(filename, tariff)
+    try:
+        rollups.save(path, source)
+    except OSError: # saving is best effort
+        pass
+    return rollups, billing_cycles
+
+
+# converts an 'mm-dd-yyyy' date into epoch minutes at its midnight
+def date_minute(value):
+    return TimestampDecoder().decode(value + ' 00:00')
+
+
+# formats epoch minutes as an 'mm-dd-yyyy HH:MM' timestamp
+def minute_timestamp(minute):
+    from datetime import datetime, timezone
+    return datetime.fromtimestamp(minute * 60, timezone.utc).strftime('%m-%d-%Y %H:%M')
+
+
+def main():
+    from billing import calculate_monthly_bills
+    from cache import cached_read_in_data
+
+    parser = argparse.ArgumentParser(description="Show load profiles and demand peaks of a meter file from its rollups.")
+    parser.add_argument('filename', help="interval data CSV file")
+    parser.add_argument('--daily', action='store_true', help="show the daily energy totals and peaks")
+    parser.add_argument('--hourly', action='store_true', help="show the hourly energy totals and peaks")
+    parser.add_argument('--from', dest='start', metavar='MM-DD-YYYY', help="first day to show (default: first day of data)")
+    parser.add_argument('--to', dest='end', metavar='MM-DD-YYYY', help="last day to show (default: last day of data)")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    tariff = resolve_tariff(args.tariff)
+    rollups, billing_cycles = load_rollups_with_cycles(args.filename, tariff)
+    start = date_minute(args.start) if args.start else None
+    end = date_minute(args.end) + 24 * 60 if args.end else None
+
+    if args.daily or args.hourly:
+        rollup = rollups.hourly if args.hourly else rollups.daily
+        for bucket_start, energy, intervals, peak, peak_at in rollup.series(start, end):
+            print(f"{minute_timestamp(bucket_start)}  {format_quantity(energy):>18} kWh  peak {format_quantity(peak):>14} kW at {peak_at}  ({intervals} intervals)")
+        peak, peak_at = rollup.peak(start, end)
+        print(f"Total: {format_quantity(rollup.total(start, end))} kWh, peak {format_quantity(peak)} kW at {peak_at}")
+        return
+
+    # demand charge attribution: the interval that set each billed demand and what it cost
+    # (the billing cycles parsed with the rollups, or through the cache when the saved rollups were used)
+    if billing_cycles is None:
+        billing_cycles = cached_read_in_data(args.filename, tariff)
+    calculate_monthly_bills(billing_cycles, tariff)
+    for key, cur_cycle in billing_cycles.items():
+        print(f"Bill for: {cur_cycle.start_date} to {cur_cycle.end_date}")
+        for code, (season, period, peak, peak_at) in enumerate(rollups.cycle_peaks(key)):
+            if peak_at:
+                print(f"  {season} {period}: {format_quantity(peak)} kW at {peak_at} -> ${format_cents(cur_cycle.demand_costs[code])}")
+
+
+if __name__ == '__main__':
+    main()
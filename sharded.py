@@ -0,0 +1,205 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from billing import cycle_billing_days, finialize_billing_cycle, last_cycle_end_day
+from billing_cycle import BillingCycle
+from fixed_point import parse_quantity
+from preprocess import read_in_data, read_rows
+from tariff import resolve_tariff
+from timestamps import TimestampDecoder
+
+
+########################################################
+
+# sharded.py
+
+# contains sharded parsing of a single large csv file:
+# the file is split into byte ranges at row boundaries,
+# worker processes sum energy and take demand maxima per
+# billing cycle in each range, and the partial cycles are
+# merged in file order into the same billing cycles as
+# preprocess.read_in_data (rows must not contain quoted
+# line breaks, which interval data files never do)
+
+########################################################
+
+
+# smallest byte range worth sending to a worker process
+MIN_SHARD_SIZE = 1024 * 1024
+
+
+# the rows of a byte range that belong to one billing cycle (or to the cycle open when the range starts)
+# key is the (month, year) of a row that starts a billing cycle unless an earlier range already started it,
+# None for the rows before the first such row of the range
+class CycleSegment:
+    __slots__ = ('key', 'first_timestamp', 'last_timestamp', 'energy_values', 'demand_values')
+
+    def __init__(self, key, first_timestamp, tariff):
+        self.key = key
+        self.first_timestamp = first_timestamp
+        self.last_timestamp = first_timestamp
+        self.energy_values = array('q', bytes(8 * len(tariff.energy_layout)))
+        self.demand_values = array('q', bytes(8 * len(tariff.demand_layout)))
+
+    # adds the rows of a later segment of the same billing cycle
+    def merge(self, other):
+        self.last_timestamp = other.last_timestamp
+        for code, value in enumerate(other.energy_values):
+            self.energy_values[code] += value
+        for code, value in enumerate(other.demand_values):
+            self.demand_values[code] = max(self.demand_values[code], value)
+
+    # converts the merged rows of a billing cycle into a finalized BillingCycle
+    # (end_day is the day after the cycle ends, see billing.cycle_billing_days)
+    def billing_cycle(self, tariff, end_day):
+        cur_billing_cycle = BillingCycle(self.first_timestamp[:10])
+        cur_billing_cycle.initialize_energy_charge_periods(cur_billing_cycle, tariff)
+        cur_billing_cycle.initialize_demand_charge_periods(cur_billing_cycle, tariff)
+        cur_billing_cycle.energy_values[:] = self.energy_values
+        cur_billing_cycle.demand_values[:] = self.demand_values
+        start_day = TimestampDecoder().decode_date(self.first_timestamp)[3]
+        finialize_billing_cycle(cur_billing_cycle, cycle_billing_days(start_day, end_day), self.last_timestamp, tariff)
+        return cur_billing_cycle
+
+
+# returns the byte offsets splitting the rows after the header into at most shards ranges of at least min_size bytes,
+# starting at row boundaries
+def shard_offsets(filename, data_start, shards, min_size=MIN_SHARD_SIZE):
+    size = os.path.getsize(filename)
+    shards = max(1, min(shards, (size - data_start) // min_size))
+    offsets = [data_start]
+    with open(filename, 'rb') as file:
+        for shard in range(1, shards):
+            file.seek(data_start + (size - data_start) * shard // shards - 1)
+            file.readline() # move to the start of the next row (the one before may end exactly at the split)
+            if file.tell() > offsets[-1] and file.tell() < size:
+                offsets.append(file.tell())
+    offsets.append(size)
+    return offsets
+
+
+# yields the decoded lines of a byte range that starts at a row boundary
+def range_lines(filename, start, end):
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        position = start
+        for line in file:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode()
+
+
+# parses the rows of a byte range into CycleSegments in file order (runs in a worker process)
+# with the same classification as preprocess.iter_billing_cycles
+def parse_shard(filename, start, end, fieldnames, start_of_month, tariff=None):
+    tariff = resolve_tariff(tariff)
+    decode_date = TimestampDecoder().decode_date
+    classify_codes = tariff.classify_codes
+
+    segments = []
+    keys_seen = set() # (month, year) of the rows that could start a billing cycle
+    segment = None
+    for row in csv.DictReader(range_lines(filename, start, end), fieldnames=fieldnames):
+        start_datetime = row['Start Date Time']
+        year, month, date, _ = decode_date(start_datetime)
+
+        # the first row of a (month, year) on the start day starts a billing cycle, unless an earlier range had one
+        starts_cycle = date == start_of_month and (month, year) not in keys_seen
+        if starts_cycle or segment is None:
+            if starts_cycle:
+                keys_seen.add((month, year))
+            segment = CycleSegment((month, year) if starts_cycle else None, start_datetime, tariff)
+            segments.append(segment)
+            energy_values, demand_values = segment.energy_values, segment.demand_values
+
+        energy_code, demand_code, all_hours_code = classify_codes(month, date, start_datetime[11:], year)
+        energy_values[energy_code] += parse_quantity(row['Usage'] or '')
+        demand = parse_quantity(row['Peak Demand'] or '')
+        if demand_code >= 0 and demand > demand_values[demand_code]:
+            demand_values[demand_code] = demand
+        if all_hours_code >= 0 and demand > demand_values[all_hours_code]:
+            demand_values[all_hours_code] = demand
+
+        segment.last_timestamp = start_datetime
+
+    return segments
+
+
+# merges the segments of every byte range, in file order, into billing cycles {'mm-yyyy': BillingCycle}
+def merge_segments(shard_segments, tariff):
+    merged = [] # one segment per billing cycle
+    cycles_created = set()
+    for segments in shard_segments:
+        for segment in segments:
+            if segment.key is not None and segment.key not in cycles_created:
+                cycles_created.add(segment.key)
+                merged.append(segment)
+            else: # rows of the billing cycle open at the end of the previous segment
+                merged[-1].merge(segment)
+
+    # each billing cycle ends the day before the next one starts, the last one with its last reading
+    decoder = TimestampDecoder()
+    end_days = [decoder.decode_date(segment.first_timestamp)[3] for segment in merged[1:]]
+    end_days.append(last_cycle_end_day(decoder.decode(merged[-1].last_timestamp)))
+
+    billing_cycles = {}
+    for segment, end_day in zip(merged, end_days):
+        cur_billing_cycle = segment.billing_cycle(tariff, end_day)
+        billing_cycles[cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10]] = cur_billing_cycle
+    return billing_cycles
+
+
+# reads in a csv file in byte ranges parsed by worker processes, giving the same billing cycles as preprocess.read_in_data
+# (workers defaults to the number of CPUs, shards to the number of workers; files under shards x min_shard_size
+# bytes use fewer shards)
+def read_in_data_sharded(filename, tariff=None, workers=None, shards=None, min_shard_size=MIN_SHARD_SIZE):
+    if filename.endswith('.ebc'):
+        return read_in_data(filename, tariff) # columnar files are memory-mapped, not parsed
+
+    tariff = resolve_tariff(tariff)
+    workers = workers or os.cpu_count() or 1
+
+    # the header and the first row's date (the start day of every billing cycle) are read once here
+    with open(filename, 'rb') as file:
+        fieldnames = next(csv.reader([file.readline().decode()]))
+        data_start = file.tell()
+    with open(filename, newline='') as file:
+        _, start_of_month = read_rows(file)
+
+    offsets = shard_offsets(filename, data_start, shards or workers, min_shard_size)
+    ranges = list(zip(offsets, offsets[1:]))
+    if len(ranges) == 1 or workers == 1:
+        shard_segments = [parse_shard(filename, start, end, fieldnames, start_of_month, tariff) for start, end in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            shard_segments = list(executor.map(parse_shard, [filename] * len(ranges), *zip(*ranges), [fieldnames] * len(ranges),
+                                               [start_of_month] * len(ranges), [tariff] * len(ranges)))
+    return merge_segments(shard_segments, tariff)
+
+
+def main():
+    from billing import calculate_monthly_bills
+    from output import print_monthly_bills
+
+    parser = argparse.ArgumentParser(description="Bill one large CSV file by parsing byte ranges of it in parallel worker processes.")
+    parser.add_argument('filename', help="interval data CSV file")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--shards', type=int, default=None, help="number of byte ranges to split the file into (default: one per worker)")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    billing_cycles = read_in_data_sharded(args.filename, args.tariff, args.workers, args.shards)
+    print(f"Parsed {args.filename} in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    calculate_monthly_bills(billing_cycles, args.tariff)
+    print_monthly_bills(billing_cycles)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from compare import price_cycles
+from fixed_point import QUANTITY_SCALE, format_cents
+from tariff import minute_of_day, resolve_tariff
+from vectorized import assign_billing_cycles, classify_rows, cycle_billing_days_of, cycle_proration_days, cycle_summer_days, date_string, decode_timestamps, load_columns, to_quantities
+
+
+########################################################
+
+# simulate.py
+
+# contains the load scenario simulator: a meter's rows are
+# read and classified once, then batches of scenarios
+# (demand caps, load shifts, battery dispatch) are applied
+# to the usage and demand arrays and re-billed together,
+# without parsing or classifying the rows again
+# (requires numpy)
+
+########################################################
+
+
+# matrix elements (scenarios x rows) per batch, bounds the memory of a batch
+BATCH_ELEMENTS = 1 << 22
+
+# season filter codes of the scenarios (-1 applies on every day)
+SCENARIO_SEASONS = {None: -1, 'summer': 0, 'winter': 1}
+
+
+# caps the load at kw (e.g. curtailment or peak shaving), on the days of a season or every day
+# the load above the cap is removed, lowering both demand and energy
+class Cap:
+    def __init__(self, kw, season=None):
+        self.kw = float(kw)
+        self.season = season
+
+    def __repr__(self):
+        return f"cap {self.kw:g} kW" + (f" ({self.season})" if self.season else "")
+
+    # returns (rows that can change, load change in millionths of a kW per [scenario, row]) of a batch of caps
+    @staticmethod
+    def batch_delta(profile, scenarios):
+        cap = np.array([scenario.kw * QUANTITY_SCALE for scenario in scenarios])[:, None]
+        rows = np.flatnonzero(profile.demand > cap.min())
+        applies = profile.season_mask(scenarios, rows)
+        return rows, -np.where(applies, np.maximum(profile.demand[rows][None, :] - cap, 0), 0)
+
+
+# moves up to kw of load out of the start-end window into the to_start-to_end window of the same day,
+# on the days of a season or every day (windows are 'HH:MM', start inclusive, end exclusive, and may wrap midnight)
+# above_kw only moves load above that level, max_kwh limits the energy moved per day and efficiency is the share
+# of the moved energy that arrives (a battery: discharge window -> start-end, charge window -> to_start-to_end,
+# see battery); days without data in the target window are left as they are
+class Shift:
+    def __init__(self, kw, start, end, to_start, to_end, season=None, above_kw=0, max_kwh=None, efficiency=1.0):
+        self.kw = float(kw)
+        self.start, self.end, self.to_start, self.to_end = start, end, to_start, to_end
+        self.season = season
+        self.above_kw = float(above_kw)
+        self.max_kwh = None if max_kwh is None else float(max_kwh)
+        self.efficiency = float(efficiency)
+        self.label = None # shown instead of the parameters, e.g. for a battery
+
+    def __repr__(self):
+        if self.label:
+            return self.label
+        text = f"shift {self.kw:g} kW {self.start}-{self.end} -> {self.to_start}-{self.to_end}"
+        if self.above_kw:
+            text += f" above {self.above_kw:g} kW"
+        if self.max_kwh is not None:
+            text += f" max {self.max_kwh:g} kWh/day"
+        if self.efficiency != 1.0:
+            text += f" {self.efficiency:.0%} arrives"
+        return text + (f" ({self.season})" if self.season else "")
+
+    # returns (rows that can change, load change in millionths of a kW per [scenario, row]) of a batch of shifts
+    @staticmethod
+    def batch_delta(profile, scenarios):
+        def column(values):
+            return np.array(values, dtype=np.float64)[:, None]
+
+        hours = profile.interval_minutes / 60
+        kw = column([scenario.kw * QUANTITY_SCALE for scenario in scenarios])
+        above = column([scenario.above_kw * QUANTITY_SCALE for scenario in scenarios])
+        max_energy = column([np.inf if scenario.max_kwh is None else scenario.max_kwh * QUANTITY_SCALE for scenario in scenarios])
+        efficiency = column([scenario.efficiency for scenario in scenarios])
+        windows = [(scenario.start, scenario.end) for scenario in scenarios]
+        to_windows = [(scenario.to_start, scenario.to_end) for scenario in scenarios]
+
+        # only the rows in some scenario's windows, in day order, so per-day totals are reductions over contiguous runs
+        in_any = in_windows(profile.minute, *zip(*set(windows + to_windows))).any(axis=0)
+        rows = profile.day_order[in_any[profile.day_order]]
+        if not len(rows):
+            return rows, np.zeros((len(scenarios), 0))
+        new_day = np.r_[True, profile.day_of_row[rows[1:]] != profile.day_of_row[rows[:-1]]]
+        day, day_starts = np.cumsum(new_day) - 1, np.flatnonzero(new_day)
+
+        minute, demand = profile.minute[rows], profile.demand[rows]
+        applies = profile.season_mask(scenarios, rows)
+        source = applies & in_windows(minute, *zip(*windows))
+        target = applies & in_windows(minute, *zip(*to_windows))
+        target_rows = np.add.reduceat(target, day_starts, axis=1)
+        source &= target_rows[:, day] > 0
+
+        # energy taken out of each source row, limited per day to max_kwh
+        moved = np.where(source, np.clip(demand[None, :] - above, 0, kw), 0) * hours
+        if np.isfinite(max_energy).any():
+            through_row = np.cumsum(moved, axis=1)
+            before_day = (through_row - moved)[:, day_starts][:, day]
+            moved = np.clip(max_energy - (through_row - moved - before_day), 0, moved)
+
+        # spread evenly over the target rows of the same day
+        arriving = np.add.reduceat(moved, day_starts, axis=1) * efficiency / np.maximum(target_rows, 1)
+        return rows, (np.where(target, arriving[:, day], 0) - moved) / hours
+
+
+# returns a Shift that dispatches a battery: discharging up to power_kw (only the load above above_kw) in the
+# discharge window until capacity_kwh is used, and recharging the same energy / efficiency in the charge window
+def battery(power_kw, capacity_kwh, discharge=('16:00', '21:00'), charge=('00:00', '06:00'), above_kw=0, efficiency=0.9, season=None):
+    shift = Shift(power_kw, discharge[0], discharge[1], charge[0], charge[1], season, above_kw, capacity_kwh, 1 / efficiency)
+    shift.label = (f"battery {power_kw:g} kW / {capacity_kwh:g} kWh {discharge[0]}-{discharge[1]}" + (f" above {above_kw:g} kW" if above_kw else "")
+                   + (f" ({season})" if season else ""))
+    return shift
+
+
+# returns a (scenarios x rows) mask of the rows in each scenario's 'HH:MM' window (wrapping past midnight when start > end)
+def in_windows(minute, starts, ends):
+    start = np.array([minute_of_day(start) for start in starts])[:, None]
+    end = np.array([minute_of_day(end) for end in ends])[:, None]
+    after_start, before_end = minute[None, :] >= start, minute[None, :] < end
+    return np.where(start <= end, after_start & before_end, after_start | before_end)
+
+
+# the rows of one meter file, read and classified under a tariff once for any number of scenarios
+class LoadProfile:
+    def __init__(self, filename, tariff=None):
+        self.tariff = tariff = resolve_tariff(tariff)
+        start_datetimes, usage, demand = load_columns(filename)
+        month, date, year, minute = decode_timestamps(start_datetimes)
+        self.minute = minute
+        self.usage, self.demand = to_quantities(usage), to_quantities(demand)
+
+        cycle_index, cycle_starts = assign_billing_cycles(month, date, year, int(date[0]))
+        self.n_cycles = len(cycle_starts)
+        self.cycle_keys = [f"{int(month[i]):02d}-{int(year[i]):04d}" for i in cycle_starts]
+        energy_code, demand_code, all_hours_code, self.is_summer = classify_rows(month, date, year, minute, tariff)
+
+        # billing days per cycle, as in vectorized.parse_fields
+        start_dates = [date_string(month, date, year, i) for i in cycle_starts]
+        self.billing_days = cycle_billing_days_of(month, date, year, minute, cycle_starts)
+        self.days_summer = cycle_summer_days(tariff, start_dates, self.billing_days)
+        self.proration_days = cycle_proration_days(start_dates, self.billing_days)
+
+        # calendar day of every row (days with data, numbered from 0) and the rows in day order
+        self.day_of_row = np.unique(year * 10000 + month * 100 + date, return_inverse=True)[1].reshape(-1)
+        self.day_order = np.argsort(self.day_of_row, kind='stable')
+
+        # interval length: the most common step between rows of the same day
+        steps = np.diff(minute)
+        steps = steps[steps > 0]
+        self.interval_minutes = int(np.bincount(steps).argmax()) if len(steps) else 60
+
+        # group of every row per (cycle, energy period) and (cycle, demand period), -1 for no demand period
+        self.n_energy, self.n_demand = len(tariff.energy_layout), len(tariff.demand_layout)
+        self.energy_group = cycle_index * self.n_energy + energy_code
+        self.demand_group = [np.where(codes >= 0, cycle_index * self.n_demand + codes, -1) for codes in (demand_code, all_hours_code)]
+        self.energy = np.bincount(self.energy_group, weights=self.usage, minlength=self.n_cycles * self.n_energy)
+        self.demand_runs = [row_groups(groups, groups >= 0) for groups in self.demand_group]
+
+    # returns a (scenarios x rows) mask of the rows on the days each scenario applies to
+    def season_mask(self, scenarios, rows):
+        seasons = np.array([SCENARIO_SEASONS[scenario.season] for scenario in scenarios])[:, None]
+        return (seasons < 0) | (self.is_summer[rows][None, :] == (seasons == 0))
+
+    # bills load changes (millionths of a kW per [scenario, row]) of some rows, the other rows keep their usage and demand
+    # each changed row's usage and demand are rounded to whole millionths, as if the meter file had been edited
+    # returns the total charge in cents per [scenario, cycle]
+    def bill(self, rows, delta):
+        n_scenarios = len(delta)
+        usage, demand = self.usage[rows], self.demand[rows]
+        usage_change = np.rint(usage[None, :] + delta * (self.interval_minutes / 60)) - usage[None, :]
+        new_demand = np.rint(demand[None, :] + delta)
+
+        # energy: the unchanged sums plus the changes of the rows
+        energy = np.tile(self.energy, (n_scenarios, 1))
+        order, starts, groups = row_groups(self.energy_group[rows])
+        if len(order):
+            energy[:, groups] += np.add.reduceat(usage_change[:, order], starts, axis=1)
+
+        # demand: the maxima of the other rows, then of the changed rows
+        other_demand = self.demand.copy()
+        other_demand[rows] = 0
+        demand_max = np.zeros((n_scenarios, self.n_cycles * self.n_demand))
+        for (order, starts, groups), row_group in zip(self.demand_runs, self.demand_group):
+            if len(order):
+                demand_max[:, groups] = np.maximum(demand_max[:, groups], np.maximum.reduceat(other_demand[order], starts))
+            order, starts, groups = row_groups(row_group[rows], row_group[rows] >= 0)
+            if len(order):
+                demand_max[:, groups] = np.maximum(demand_max[:, groups], np.maximum.reduceat(new_demand[:, order], starts, axis=1))
+
+        energy = energy.reshape(n_scenarios, self.n_cycles, self.n_energy).astype(np.int64)
+        demand_max = demand_max.reshape(n_scenarios, self.n_cycles, self.n_demand).astype(np.int64)
+        totals = np.empty((n_scenarios, self.n_cycles), dtype=np.int64)
+        for i in range(n_scenarios):
+            customer, demand_charge, energy_charge = price_cycles(self.tariff, energy[i], demand_max[i], self.billing_days,
+                                                                  self.days_summer, self.billing_days - self.days_summer, self.proration_days)
+            totals[i] = customer + demand_charge + energy_charge
+        return totals
+
+    # returns the total charge in cents per [cycle] of the unchanged rows
+    def baseline(self):
+        return self.bill(np.array([], dtype=np.intp), np.zeros((1, 0)))[0]
+
+    # bills every scenario in batches of one scenario type, returns the total charge in cents per [scenario, cycle]
+    def simulate(self, scenarios, batch_size=None):
+        batch_size = batch_size or max(1, BATCH_ELEMENTS // len(self.usage))
+        totals = np.empty((len(scenarios), self.n_cycles), dtype=np.int64)
+        by_type = {}
+        for i, scenario in enumerate(scenarios):
+            by_type.setdefault(type(scenario), []).append(i)
+
+        for scenario_type, indexes in by_type.items():
+            for first in range(0, len(indexes), batch_size):
+                batch = indexes[first:first + batch_size]
+                totals[batch] = self.bill(*scenario_type.batch_delta(self, [scenarios[i] for i in batch]))
+        return totals
+
+
+# returns (row order, start of each run of equal keys in that order, key of each run) of the selected rows
+def row_groups(keys, selected=None):
+    rows = np.arange(len(keys)) if selected is None else np.flatnonzero(selected)
+    order = rows[np.argsort(keys[rows], kind='stable')]
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(order) else np.array([], dtype=np.intp)
+    return order, starts, sorted_keys[starts]
+
+
+# builds a scenario from a json object, e.g. {"type": "cap", "kw": 400} or
+# {"type": "battery", "power_kw": 100, "capacity_kwh": 400, "discharge": ["16:00", "21:00"], "above_kw": 300}
+def scenario_from_json(data):
+    data = dict(data)
+    kind = data.pop('type')
+    if kind == 'cap':
+        return Cap(**data)
+    if kind == 'shift':
+        return Shift(**data)
+    if kind == 'battery':
+        return battery(**data)
+    raise ValueError(f"Unknown scenario type '{kind}' (expected cap, shift or battery)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the bills of one meter under load caps, shifts and battery dispatch.")
+    parser.add_argument('filename', help="interval data CSV file")
+    parser.add_argument('--cap', type=float, action='append', default=[], metavar='KW', help="cap the load at KW (repeatable)")
+    parser.add_argument('--cap-sweep', type=float, nargs=3, metavar=('FROM', 'TO', 'STEP'), help="cap the load at every KW from FROM to TO")
+    parser.add_argument('--scenarios', metavar='FILENAME', help="json file with a list of scenarios (cap, shift and battery objects)")
+    parser.add_argument('--top', type=int, default=20, help="scenarios to show, by savings (default: 20)")
+    parser.add_argument('-t', '--tariff', default=None, help="tariff schedule name from tariffs/ or path to a schedule file (default: b19)")
+    args = parser.parse_args()
+
+    scenarios = [Cap(kw) for kw in args.cap]
+    if args.cap_sweep:
+        scenarios += [Cap(kw) for kw in np.arange(args.cap_sweep[0], args.cap_sweep[1] + args.cap_sweep[2] / 2, args.cap_sweep[2])]
+    if args.scenarios:
+        with open(args.scenarios) as file:
+            scenarios += [scenario_from_json(data) for data in json.load(file)]
+    if not scenarios:
+        parser.error("no scenarios given (use --cap, --cap-sweep or --scenarios)")
+
+    start = time.perf_counter()
+    profile = LoadProfile(args.filename, args.tariff)
+    baseline = int(profile.baseline().sum())
+    loaded = time.perf_counter()
+    totals = profile.simulate(scenarios).sum(axis=1)
+    elapsed = time.perf_counter() - loaded
+
+    print(f"Baseline: ${format_cents(baseline)} over {profile.n_cycles} billing cycle(s) "
+          f"(read and classified in {loaded - start:.2f} s, {len(scenarios):,} scenario(s) in {elapsed:.2f} s)")
+    for i in sorted(range(len(scenarios)), key=lambda i: totals[i])[:args.top]:
+        print(f"  {scenarios[i]!r:<60} ${format_cents(int(totals[i])):>16}  saves ${format_cents(baseline - int(totals[i]))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+from datetime import date as calendar_date, timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+from fixed_point import RATE_SCALE, RATIO_SCALE, to_fixed
+
+
+########################################################
+
+# tariff.py
+
+# contains the Tariff object, which loads a tariff
+# schedule from a data file in tariffs/ and compiles it
+# into time-of-use lookup tables and rate tables
+
+########################################################
+
+
+# directory holding the tariff schedule files and the schedule used when none is given
+TARIFF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tariffs')
+DEFAULT_TARIFF = 'b19'
+
+# every tariff has a summer date range, all other days are winter
+SEASONS = ('summer', 'winter')
+
+
+# minutes since midnight of every 'HH:MM' time of the day
+MINUTES_OF_DAY = {f"{minute // 60:02d}:{minute % 60:02d}": minute for minute in range(24 * 60)}
+
+
+# converts an 'HH:MM' string into minutes since midnight
+def minute_of_day(t):
+    minute = MINUTES_OF_DAY.get(t)
+    return int(t[0:2]) * 60 + int(t[3:5]) if minute is None else minute
+
+
+# converts an 'mm-dd' string into a (month, day) pair
+def parse_month_day(value):
+    return (int(value[0:2]), int(value[3:5]))
+
+
+# checks if a minute of the day falls within a window (start inclusive, end exclusive, may wrap past midnight)
+def in_window(minute, start, end):
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+# returns the period of every minute of the day given (start minute, end minute, period) windows (see in_window)
+# the first matching window wins, so windows are painted over the default in reverse order
+def window_periods(windows, default_period):
+    periods = [default_period] * (24 * 60)
+    for start, end, period in reversed(windows):
+        if start <= end:
+            periods[start:end] = [period] * (end - start)
+        else: # window wraps past midnight
+            periods[start:] = [period] * (24 * 60 - start)
+            periods[:end] = [period] * end
+    return periods
+
+
+# converts every rate in a (nested) rate table to Decimal
+def parse_rates(rates):
+    if isinstance(rates, dict):
+        return {key: parse_rates(value) for key, value in rates.items()}
+    return Decimal(str(rates))
+
+
+# stores a tariff schedule compiled into lookup tables
+class Tariff:
+    def __init__(self, name: str, definition: dict, fingerprint: str):
+        self.name = name
+        self.display_name = definition.get('name', name)
+        self.fingerprint = fingerprint
+
+        # seasons
+        self.summer_start = parse_month_day(definition['seasons']['summer']['start'])
+        self.summer_end = parse_month_day(definition['seasons']['summer']['end'])
+
+        # charge periods, in display order, and the demand period that includes all hours
+        self.energy_periods = {season: tuple(definition['energy_periods'][season]['periods']) for season in SEASONS}
+        self.demand_periods = {season: tuple(definition['demand_periods'][season]['periods']) for season in SEASONS}
+        self.all_hours_periods = {season: definition['demand_periods'][season].get('all_hours') for season in SEASONS}
+
+        # fixed (season, period) order of the period accumulators, a period's code is its position in the layout
+        self.energy_layout = tuple((season, period) for season in SEASONS for period in self.energy_periods[season])
+        self.demand_layout = tuple((season, period) for season in SEASONS for period in self.demand_periods[season])
+        self.energy_index = {season: {period: self.energy_layout.index((season, period)) for period in self.energy_periods[season]} for season in SEASONS}
+        self.demand_index = {season: {period: self.demand_layout.index((season, period)) for period in self.demand_periods[season]} for season in SEASONS}
+
+        # rates
+        self.rates = {
+            'customer_charge_rates': parse_rates(definition['customer_charge_rates']),
+            'demand_charge_rates': parse_rates(definition['demand_charge_rates']),
+            'energy_charge_rates': parse_rates(definition['energy_charge_rates'])
+        }
+        self.customer_charge_rate = self.rates['customer_charge_rates'][definition.get('customer_charge', 'mandatory')]
+
+        # the same rates in micro-dollars (see fixed_point.py), energy and demand rates in layout order
+        self.customer_rate_fixed = to_fixed(self.customer_charge_rate, RATE_SCALE)
+        self.energy_rates_fixed = tuple(to_fixed(self.rates['energy_charge_rates'][season].get(period, 0), RATE_SCALE) for season, period in self.energy_layout)
+        self.demand_rates_fixed = tuple(to_fixed(self.rates['demand_charge_rates'][season].get(period, 0), RATE_SCALE) for season, period in self.demand_layout)
+
+        # demand ratchet - the all hours demand billed is at least percent of the highest one in the previous cycles
+        ratchet = definition.get('demand_ratchet') or {}
+        self.ratchet_percent = Decimal(str(ratchet.get('percent', 0)))
+        self.ratchet_cycles = int(ratchet.get('cycles', 0))
+        self.ratchet_percent_fixed = to_fixed(self.ratchet_percent, RATIO_SCALE)
+
+        self.compile(definition)
+
+    # builds the time-of-use lookup tables:
+    # day_types[month][date] (or dated_holidays[(year, month, date)]) gives the day type,
+    # tou_table[day_type][minute] gives (season, energy period, demand period or None, all hours demand period) and
+    # tou_codes[day_type][minute] gives the same periods as (energy code, demand code, all hours demand code)
+    def compile(self, definition):
+
+        # recurring ('mm-dd') and one-off ('mm-dd-yyyy') holidays are billed with the default periods all day
+        recurring_holidays, dated_holidays = set(), set()
+        for holiday in definition.get('holidays', []):
+            if len(holiday) == 5:
+                recurring_holidays.add(parse_month_day(holiday))
+            else:
+                dated_holidays.add((int(holiday[6:10]),) + parse_month_day(holiday))
+
+        self.day_seasons = [['winter'] * 32 for _ in range(13)]
+        self.day_types = [[0] * 32 for _ in range(13)]
+        self.tou_table = []
+        minute_tables = {} # days with the same windows share one day type
+
+        def day_type(season, month, holiday):
+            key = self.day_windows(definition, season, month, holiday)
+            if key not in minute_tables:
+                minute_tables[key] = len(self.tou_table)
+                self.tou_table.append(self.build_minute_table(definition, season, *key[1:]))
+            return minute_tables[key]
+
+        # classify every calendar day (index 0 is unused for both month and date)
+        for month in range(1, 13):
+            for date in range(1, 32):
+                season = self.season_of(month, date)
+                self.day_seasons[month][date] = season
+                self.day_types[month][date] = day_type(season, month, (month, date) in recurring_holidays)
+
+        self.dated_holidays = {(year, month, date): day_type(self.season_of(month, date), month, True) for year, month, date in dated_holidays}
+        self.tou_codes = [tuple(self.period_codes(entry) for entry in minute_table) for minute_table in self.tou_table]
+
+    # returns (season, energy windows, demand windows) in effect on a day as (start minute, end minute, period) tuples
+    # (days with the same windows share one minute table)
+    def day_windows(self, definition, season, month, holiday):
+
+        def windows(periods):
+            if holiday:
+                return ()
+            return tuple((minute_of_day(window['start']), minute_of_day(window['end']), window['period'])
+                         for window in periods.get('windows', []) if month in window.get('months', range(1, 13)))
+
+        return (season, windows(definition['energy_periods'][season]), windows(definition['demand_periods'][season]))
+
+    # classifies every minute of the day for a season and its energy and demand windows
+    def build_minute_table(self, definition, season, energy_windows, demand_windows):
+        default_period = definition['energy_periods'][season]['default']
+        energy_periods = window_periods(energy_windows, default_period)
+        demand_periods = window_periods(demand_windows, None)
+        all_hours_period = self.all_hours_periods[season]
+        return tuple((season, energy_period, demand_period, all_hours_period)
+                     for energy_period, demand_period in zip(energy_periods, demand_periods))
+
+    # returns the layout positions (energy code, demand code, all hours demand code) of a tou_table entry, -1 means no period
+    def period_codes(self, entry):
+        season, energy_period, demand_period, all_hours_period = entry
+        demand_index = self.demand_index[season]
+        return (self.energy_index[season][energy_period],
+                demand_index[demand_period] if demand_period else -1,
+                demand_index[all_hours_period] if all_hours_period else -1)
+
+    # returns the season a calendar day falls in
+    def season_of(self, month, date):
+        return 'summer' if self.summer_start <= (month, date) <= self.summer_end else 'winter'
+
+    # returns (season, energy period, demand period or None, all hours demand period) for a date and 'HH:MM' time
+    def classify(self, month, date, time, year=None):
+        day_type = self.day_types[month][date]
+        if self.dated_holidays and year:
+            day_type = self.dated_holidays.get((year, month, date), day_type)
+        return self.tou_table[day_type][minute_of_day(time)]
+
+    # returns (energy code, demand code, all hours demand code) for a date and 'HH:MM' time, see period_codes
+    def classify_codes(self, month, date, time, year=None):
+        day_type = self.day_types[month][date]
+        if self.dated_holidays and year:
+            day_type = self.dated_holidays.get((year, month, date), day_type)
+        return self.tou_codes[day_type][minute_of_day(time)]
+
+    # returns {season: days} of the given number of days starting on an 'mm-dd-yyyy' date
+    def season_days(self, start_date, days):
+        day = calendar_date(int(start_date[6:10]), int(start_date[0:2]), int(start_date[3:5]))
+        counts = {season: 0 for season in SEASONS}
+        for _ in range(days):
+            counts[self.day_seasons[day.month][day.day]] += 1
+            day += timedelta(days=1)
+        return counts
+
+    # returns the seasons, in order, that a full billing cycle starting on an 'mm-dd-yyyy' date covers
+    def seasons_in_cycle(self, start_date):
+        day, end = full_cycle_dates(start_date)
+
+        seasons = []
+        while day < end:
+            season = self.season_of(day.month, day.day)
+            if season not in seasons:
+                seasons.append(season)
+            day += timedelta(days=1)
+        return seasons
+
+
+# returns (first day, day after the last day) of a full billing cycle starting on an 'mm-dd-yyyy' date,
+# which runs to the same day of the next month (or that month's last day)
+def full_cycle_dates(start_date):
+    day = calendar_date(int(start_date[6:10]), int(start_date[0:2]), int(start_date[3:5]))
+    next_month = calendar_date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    month_after = calendar_date(next_month.year + next_month.month // 12, next_month.month % 12 + 1, 1)
+    return day, next_month.replace(day=min(day.day, (month_after - next_month).days))
+
+
+# returns the number of days of a full billing cycle starting on an 'mm-dd-yyyy' date, see full_cycle_dates
+def full_cycle_days(start_date):
+    first, end = full_cycle_dates(start_date)
+    return (end - first).days
+
+
+# lists the names of the tariff schedules in the tariffs directory
+def available_tariffs():
+    return sorted(name[:-len('.json')] for name in os.listdir(TARIFF_DIR) if name.endswith('.json'))
+
+
+# loads and compiles a tariff schedule by name (from the tariffs directory) or by path to a json file
+# (each schedule is only compiled once per process)
+@lru_cache(maxsize=None)
+def load_tariff(name_or_path):
+    if os.path.isfile(name_or_path):
+        path = name_or_path
+    else:
+        path = os.path.join(TARIFF_DIR, name_or_path + '.json')
+        if not os.path.isfile(path):
+            raise ValueError(f"Unknown tariff '{name_or_path}' (available: {', '.join(available_tariffs())})")
+
+    with open(path, 'rb') as file:
+        data = file.read()
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Tariff(name, json.loads(data), hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+# returns the tariff used when none is given
+def default_tariff():
+    return load_tariff(DEFAULT_TARIFF)
+
+
+# returns the given tariff, loading it by name if needed, or the default tariff
+def resolve_tariff(tariff=None):
+    if tariff is None:
+        return default_tariff()
+    if isinstance(tariff, str):
+        return load_tariff(tariff)
+    return tariff
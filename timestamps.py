@@ -0,0 +1,147 @@
+import csv
+from datetime import date as calendar_date
+
+
+########################################################
+
+# timestamps.py
+
+# contains the decoder for the fixed 'mm-dd-yyyy HH:MM'
+# timestamps of interval data files, and the report of
+# the interval length, gaps and duplicates found in them
+
+########################################################
+
+
+# day number of 1970-01-01, epoch minutes count from its midnight
+EPOCH_ORDINAL = calendar_date(1970, 1, 1).toordinal()
+
+# examples kept of each kind of irregular step (the counts are always complete)
+MAX_EXAMPLES = 10
+
+
+# decodes 'mm-dd-yyyy HH:MM' timestamps without strptime, caching the decoded dates
+class TimestampDecoder:
+    def __init__(self):
+        self.dates = {} # 'mm-dd-yyyy' : (year, month, date, day number)
+
+    # returns (year, month, date, days since 1970-01-01) of the date a timestamp starts with
+    def decode_date(self, timestamp):
+        key = timestamp[:10]
+        decoded = self.dates.get(key)
+        if decoded is None:
+            year, month, date = int(key[6:10]), int(key[0:2]), int(key[3:5])
+            # (also rejects impossible dates such as 02-30-2024)
+            decoded = self.dates[key] = (year, month, date, calendar_date(year, month, date).toordinal() - EPOCH_ORDINAL)
+        return decoded
+
+    # returns the minutes since 1970-01-01 00:00 of a timestamp
+    def decode(self, timestamp):
+        return self.decode_date(timestamp)[3] * 24 * 60 + int(timestamp[11:13]) * 60 + int(timestamp[14:16])
+
+
+# stores what was seen of the steps between consecutive timestamps:
+# the interval length is the most common step, longer steps are gaps, repeated timestamps are duplicates
+# and steps back in time are out of order rows (e.g. the repeated hour when daylight saving time ends)
+class IntervalReport:
+    def __init__(self):
+        self.rows = 0
+        self.prev_minute = None
+        self.prev_timestamp = None
+        self.steps = {} # step (minutes) : count
+        self.step_examples = {} # step (minutes) : [timestamps the step ends at]
+        self.duplicates = 0
+        self.duplicate_examples = []
+        self.out_of_order = 0
+        self.out_of_order_examples = []
+
+    # records the next timestamp (as epoch minutes and as text)
+    def observe(self, minute, timestamp):
+        self.rows += 1
+        if self.prev_minute is not None:
+            step = minute - self.prev_minute
+            if step > 0:
+                if step in self.steps:
+                    self.steps[step] += 1
+                else:
+                    self.steps[step] = 1
+                    self.step_examples[step] = []
+                if len(self.step_examples[step]) < MAX_EXAMPLES:
+                    self.step_examples[step].append(timestamp)
+            elif step == 0:
+                self.duplicates += 1
+                if len(self.duplicate_examples) < MAX_EXAMPLES:
+                    self.duplicate_examples.append(timestamp)
+            else:
+                self.out_of_order += 1
+                if len(self.out_of_order_examples) < MAX_EXAMPLES:
+                    self.out_of_order_examples.append(f"{self.prev_timestamp} -> {timestamp}")
+        self.prev_minute, self.prev_timestamp = minute, timestamp
+
+    # returns the interval length in minutes (the most common step), or None with fewer than two rows
+    def interval_length(self):
+        return max(self.steps, key=self.steps.get) if self.steps else None
+
+    # returns {gap length (minutes): count} of the steps longer than the interval length
+    def gaps(self):
+        interval_length = self.interval_length()
+        return {step: count for step, count in sorted(self.steps.items()) if step > interval_length} if interval_length else {}
+
+    # returns the number of intervals missing in the gaps
+    def missing_intervals(self):
+        interval_length = self.interval_length()
+        return sum((step // interval_length - 1) * count for step, count in self.gaps().items())
+
+    # returns {step (minutes): count} of the steps shorter than the interval length (mixed interval lengths)
+    def short_steps(self):
+        interval_length = self.interval_length()
+        return {step: count for step, count in sorted(self.steps.items()) if step < interval_length} if interval_length else {}
+
+    # checks if the timestamps are evenly spaced, without gaps, duplicates or rows out of order
+    def is_clean(self):
+        return len(self.steps) <= 1 and not self.duplicates and not self.out_of_order
+
+    # returns the report as lines of text
+    def summary_lines(self):
+        interval_length = self.interval_length()
+        lines = [f"Rows: {self.rows:,}",
+                 f"Interval length: {interval_length} minutes" if interval_length else "Interval length: unknown (fewer than two rows)"]
+        for step, count in self.gaps().items():
+            lines.append(f"Gap of {step} minutes ({step // interval_length - 1} missing intervals) x {count:,}, e.g. ending at {', '.join(self.step_examples[step])}")
+        for step, count in self.short_steps().items():
+            lines.append(f"Short interval of {step} minutes x {count:,}, e.g. at {', '.join(self.step_examples[step])}")
+        if self.duplicates:
+            lines.append(f"Duplicate timestamps x {self.duplicates:,}, e.g. {', '.join(self.duplicate_examples)}")
+        if self.out_of_order:
+            lines.append(f"Timestamps going back in time x {self.out_of_order:,}, e.g. {', '.join(self.out_of_order_examples)}")
+        if self.is_clean():
+            lines.append("No gaps, duplicates or rows out of order")
+        return lines
+
+
+# reads the timestamps of an interval data csv file and reports their intervals, gaps and duplicates
+def check_interval_data(filename):
+    decoder, report = TimestampDecoder(), IntervalReport()
+    with open(filename, newline='') as file:
+        reader = csv.reader(file)
+        column = next(reader).index('Start Date Time')
+        for row in reader:
+            report.observe(decoder.decode(row[column]), row[column])
+    return report
+
+
+def main():
+    import argparse # only needed on the command line, the decoder is imported by every parse
+
+    parser = argparse.ArgumentParser(description="Report the interval length, gaps and duplicates of interval data CSV files.")
+    parser.add_argument('filenames', nargs='+', help="interval data CSV files")
+    args = parser.parse_args()
+
+    for filename in args.filenames:
+        print(f"{filename}:")
+        for line in check_interval_data(filename).summary_lines():
+            print(f"  {line}")
+
+
+if __name__ == '__main__':
+    main()
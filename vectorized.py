@@ -0,0 +1,178 @@
+import csv
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+from billing import cycle_billing_days, demand_proration_days, last_cycle_end_day
+from billing_cycle import BillingCycle
+from fixed_point import QUANTITY_SCALE
+from tariff import resolve_tariff
+from timestamps import TimestampDecoder
+
+
+########################################################
+
+# vectorized.py
+
+# contains a NumPy columnar engine that parses interval
+# data into the same billing cycle objects as preprocess.py
+# (requires numpy)
+
+########################################################
+
+
+# season codes used by the columnar engine
+SEASON_CODES = {'summer': 0, 'winter': 1}
+
+
+# converts a tariff's time-of-use lookup table into code arrays indexed by [day type, minute]
+# (period codes index into the tariff's energy and demand layouts, -1 means no period)
+@lru_cache(maxsize=None)
+def build_code_tables(tariff):
+    tou_codes = np.array(tariff.tou_codes, dtype=np.intp).reshape(len(tariff.tou_codes), 24 * 60, 3)
+    energy_codes = tou_codes[:, :, 0]
+    demand_codes = tou_codes[:, :, 1]
+    all_hours_codes = tou_codes[:, :, 2]
+    season_codes = np.array([[SEASON_CODES[entry[0]] for entry in row] for row in tariff.tou_table], dtype=np.intp)
+    return np.array(tariff.day_types, dtype=np.intp), energy_codes, demand_codes, all_hours_codes, season_codes
+
+
+# converts a column of kWh / kW values into whole millionths (see fixed_point.py)
+# kept as float64, which holds them (and their sums, up to 2 ** 53 millionths) exactly
+def to_quantities(values):
+    return np.rint(np.asarray(values, dtype=np.float64) * QUANTITY_SCALE)
+
+
+# read the Start Date Time, Usage and Peak Demand columns of a csv file into arrays
+def load_columns(filename):
+    with open(filename, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        start_col, usage_col, demand_col = header.index('Start Date Time'), header.index('Usage'), header.index('Peak Demand')
+
+        start_datetimes, usage, demand = [], [], []
+        for row in reader:
+            start_datetimes.append(row[start_col])
+            usage.append(row[usage_col] or '0')
+            demand.append(row[demand_col] or '0')
+
+    return np.array(start_datetimes, dtype='S16'), np.array(usage).astype(np.float64), np.array(demand).astype(np.float64)
+
+
+# decodes fixed "%m-%d-%Y %H:%M" timestamps into (month, date, year, minute of day) arrays
+def decode_timestamps(start_datetimes):
+    digits = start_datetimes.view(np.uint8).reshape(-1, 16).astype(np.intp) - ord('0')
+    month = digits[:, 0] * 10 + digits[:, 1]
+    date = digits[:, 3] * 10 + digits[:, 4]
+    year = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+    minute = (digits[:, 11] * 10 + digits[:, 12]) * 60 + digits[:, 14] * 10 + digits[:, 15]
+    return month, date, year, minute
+
+
+# formats the date of a row as 'mm-dd-yyyy'
+def date_string(month, date, year, i):
+    return f"{int(month[i]):02d}-{int(date[i]):02d}-{int(year[i]):04d}"
+
+
+# returns the billing days of each billing cycle given the first row of each, see billing.cycle_billing_days
+def cycle_billing_days_of(month, date, year, minute, cycle_starts):
+    decode_date = TimestampDecoder().decode_date
+    start_days = [decode_date(date_string(month, date, year, i))[3] for i in cycle_starts]
+    last_minute = decode_date(date_string(month, date, year, len(month) - 1))[3] * 24 * 60 + int(minute[-1])
+    end_days = start_days[1:] + [last_cycle_end_day(last_minute)]
+    return np.array([cycle_billing_days(start_day, end_day) for start_day, end_day in zip(start_days, end_days)], dtype=np.int64)
+
+
+# returns the days the demand charges of each billing cycle are prorated over, see billing.demand_proration_days
+def cycle_proration_days(start_dates, billing_days):
+    return np.array([demand_proration_days(start_date, days) for start_date, days in zip(start_dates, billing_days.tolist())], dtype=np.int64)
+
+
+# returns the summer days of each billing cycle under a tariff given its start date and billing days
+def cycle_summer_days(tariff, start_dates, billing_days):
+    return np.array([tariff.season_days(start_date, days)['summer'] for start_date, days in zip(start_dates, billing_days.tolist())], dtype=np.int64)
+
+
+# assigns a billing cycle index to every row, returns (cycle index per row, first row of each cycle)
+def assign_billing_cycles(month, date, year, start_of_month):
+    # a cycle starts on the first row falling on the start day of each month-year
+    candidates = np.flatnonzero(date == start_of_month)
+    _, first = np.unique((year[candidates] * 12 + month[candidates]), return_index=True)
+    cycle_starts = np.sort(candidates[first])
+    cycle_index = np.searchsorted(cycle_starts, np.arange(len(month)), side='right') - 1
+    return cycle_index, cycle_starts
+
+
+# classifies every row under a tariff
+# returns (energy code, demand code, all hours demand code, is summer) arrays, see build_code_tables
+def classify_rows(month, date, year, minute, tariff):
+    day_type_codes, energy_codes, demand_codes, all_hours_codes, season_codes = build_code_tables(tariff)
+    day_type = day_type_codes[month, date]
+    for (holiday_year, holiday_month, holiday_date), holiday_day_type in tariff.dated_holidays.items():
+        day_type[(year == holiday_year) & (month == holiday_month) & (date == holiday_date)] = holiday_day_type
+    return (energy_codes[day_type, minute], demand_codes[day_type, minute], all_hours_codes[day_type, minute],
+            season_codes[day_type, minute] == SEASON_CODES['summer'])
+
+
+# parse columnar interval data into billing cycles
+def parse_columns(start_datetimes, usage, demand, tariff=None):
+    return parse_fields(*decode_timestamps(start_datetimes), usage, demand, tariff)
+
+
+# parse decoded (month, date, year, minute of day) columns and usage and demand columns into billing cycles
+def parse_fields(month, date, year, minute, usage, demand, tariff=None):
+
+    start_of_month = int(date[0])
+
+    cycle_index, cycle_starts = assign_billing_cycles(month, date, year, start_of_month)
+    n_cycles = len(cycle_starts)
+
+    # time-of-use classification of every row
+    tariff = resolve_tariff(tariff)
+    energy_code, demand_code, all_hours_code, _ = classify_rows(month, date, year, minute, tariff)
+
+    # usage and demand in millionths of a kWh / kW
+    usage, demand = to_quantities(usage), to_quantities(demand)
+
+    # grouped energy sums per (cycle, energy period)
+    energy_layout, demand_layout = tariff.energy_layout, tariff.demand_layout
+    n_energy, n_demand = len(energy_layout), len(demand_layout)
+    energy = np.bincount(cycle_index * n_energy + energy_code, weights=usage, minlength=n_cycles * n_energy).reshape(n_cycles, n_energy)
+
+    # grouped demand maxima per (cycle, demand period), e.g. max demand includes all hours
+    demand_max = np.zeros(n_cycles * n_demand)
+    for codes in (demand_code, all_hours_code):
+        in_period = codes >= 0
+        np.maximum.at(demand_max, cycle_index[in_period] * n_demand + codes[in_period], demand[in_period])
+    energy, demand_max = energy.astype(np.int64), demand_max.reshape(n_cycles, n_demand).astype(np.int64)
+
+    # calendar days per cycle, by season
+    billing_days = cycle_billing_days_of(month, date, year, minute, cycle_starts)
+    start_dates = [date_string(month, date, year, i) for i in cycle_starts]
+    days_summer = cycle_summer_days(tariff, start_dates, billing_days)
+    cycle_ends = np.append(cycle_starts[1:], len(month)) - 1
+
+    billing_cycles = {}
+    for i in range(n_cycles):
+        cur_billing_cycle = BillingCycle(start_dates[i])
+        cur_billing_cycle.initialize_energy_charge_periods(cur_billing_cycle, tariff)
+        cur_billing_cycle.initialize_demand_charge_periods(cur_billing_cycle, tariff)
+
+        cur_billing_cycle.energy_values = array('q', energy[i].tobytes())
+        cur_billing_cycle.demand_values = array('q', demand_max[i].tobytes())
+
+        cur_billing_cycle.billing_days = int(billing_days[i])
+        cur_billing_cycle.days_in_season['summer'] = int(days_summer[i])
+        cur_billing_cycle.days_in_season['winter'] = int(billing_days[i] - days_summer[i])
+        cur_billing_cycle.end_date = date_string(month, date, year, cycle_ends[i])
+
+        key = (cur_billing_cycle.start_date[0:2] + '-' + cur_billing_cycle.start_date[6:10])
+        billing_cycles[key] = cur_billing_cycle
+
+    return billing_cycles
+
+
+# open and read in data from csv file as columns, then parse data into billing cycles
+def read_in_data_vectorized(filename, tariff=None):
+    return parse_columns(*load_columns(filename), tariff=tariff)